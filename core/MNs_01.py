@@ -1,5 +1,6 @@
 from core.micro_neurona import MicroNeurona
 from core.neurona import Neurona
+from core.embedding_engine import embedding_engine
 
 def poblar_modelo_base(razonador, umbral_neurona=0.7):
     # =================================================================================
@@ -92,9 +93,6 @@ def poblar_modelo_base(razonador, umbral_neurona=0.7):
         ("gen_fin", "<FIN>", {'GRAMATICA': {'TIPO': 'fin_frase'}}),
     ]
 
-    for mn_id, concepto, metadata in vocabulario_unificado:
-        razonador.registrar_micro_neurona(MicroNeurona(mn_id, concepto, "palabra_clave", metadata=metadata))
-
     # --- 1.2 MNs Abstractas (Pensamiento) ---
     # Estas neuronas representan ideas y no palabras. No necesitan cambios.
     mn_conceptos = [
@@ -110,27 +108,44 @@ def poblar_modelo_base(razonador, umbral_neurona=0.7):
         ("concepto_empatia_positiva", "la idea de compartir la alegría de alguien"), ("concepto_empatia_negativa", "la idea de mostrar comprensión ante el malestar"),
         ("concepto_clarificacion", "la idea de pedir que se aclare algo"), ("concepto_iniciar_conversacion", "la idea de empezar a hablar proactivamente"),
     ]
-    for mn_id, concepto in mn_conceptos:
-        razonador.registrar_micro_neurona(MicroNeurona(mn_id, concepto, "concepto_abstracto"))
 
     # =================================================================================
     # CAPA 2: Neuronas (Ns)
     # =================================================================================
     # No se necesitan cambios aquí, ya que los IDs de las MNs de condición
     # (ej. "mn_hola") se han conservado como los canónicos.
-    razonador.registrar_neurona(Neurona("n_patron_saludo_hola", "Patrón: Hola", ["mn_hola"]))
-    razonador.registrar_neurona(Neurona("n_patron_saludo_formal", "Patrón: Buenos días/tardes/noches", ["mn_buenos", "mn_dias"]))
-    razonador.registrar_neurona(Neurona("n_patron_despedida", "Patrón: Adiós/Chao/etc", ["mn_adios"]))
-    razonador.registrar_neurona(Neurona("n_pregunta_como_estas", "Patrón: ¿Cómo estás?", ["mn_como", "mn_estas"], exclusiones_mn=["mn_no"]))
-    razonador.registrar_neurona(Neurona("n_saludo_que_tal", "Patrón: ¿Qué tal?", ["mn_que", "mn_tal"]))
-    razonador.registrar_neurona(Neurona("n_pregunta_quien_eres", "Patrón: ¿Quién eres?", ["mn_quien", "mn_eres"]))
-    razonador.registrar_neurona(Neurona("n_pregunta_que_haces", "Patrón: ¿Qué haces?", ["mn_que", "mn_haces"], exclusiones_mn=["mn_tal"]))
-    razonador.registrar_neurona(Neurona("n_peticion_ayuda", "Patrón: ¿Puedes ayudar?", ["mn_puedes", "mn_ayuda"]))
-    razonador.registrar_neurona(Neurona("n_peticion_nombre", "Patrón: Pregunta por nombre", ["mn_cual", "mn_es", "mn_tu", "mn_nombre"]))
-    razonador.registrar_neurona(Neurona("n_agradecimiento", "Patrón: Usuario da las gracias", ["mn_gracias"]))
-    razonador.registrar_neurona(Neurona("n_afirmacion_positiva", "Patrón: Usuario afirma 'si/claro/ok'", ["mn_si"]))
-    razonador.registrar_neurona(Neurona("n_negacion", "Patrón: Usuario dice 'no'", ["mn_no"]))
-    razonador.registrar_neurona(Neurona("n_charla_sobre_clima", "Patrón: Usuario menciona el clima", ["mn_clima"]))
+    patrones_neuronas = [
+        ("n_patron_saludo_hola", "Patrón: Hola", ["mn_hola"], []),
+        ("n_patron_saludo_formal", "Patrón: Buenos días/tardes/noches", ["mn_buenos", "mn_dias"], []),
+        ("n_patron_despedida", "Patrón: Adiós/Chao/etc", ["mn_adios"], []),
+        ("n_pregunta_como_estas", "Patrón: ¿Cómo estás?", ["mn_como", "mn_estas"], ["mn_no"]),
+        ("n_saludo_que_tal", "Patrón: ¿Qué tal?", ["mn_que", "mn_tal"], []),
+        ("n_pregunta_quien_eres", "Patrón: ¿Quién eres?", ["mn_quien", "mn_eres"], []),
+        ("n_pregunta_que_haces", "Patrón: ¿Qué haces?", ["mn_que", "mn_haces"], ["mn_tal"]),
+        ("n_peticion_ayuda", "Patrón: ¿Puedes ayudar?", ["mn_puedes", "mn_ayuda"], []),
+        ("n_peticion_nombre", "Patrón: Pregunta por nombre", ["mn_cual", "mn_es", "mn_tu", "mn_nombre"], []),
+        ("n_agradecimiento", "Patrón: Usuario da las gracias", ["mn_gracias"], []),
+        ("n_afirmacion_positiva", "Patrón: Usuario afirma 'si/claro/ok'", ["mn_si"], []),
+        ("n_negacion", "Patrón: Usuario dice 'no'", ["mn_no"], []),
+        ("n_charla_sobre_clima", "Patrón: Usuario menciona el clima", ["mn_clima"], []),
+    ]
+
+    # =================================================================================
+    # Registro: todos los embeddings se calculan juntos en un único lote
+    # =================================================================================
+    textos = ([concepto for _, concepto, _ in vocabulario_unificado] +
+              [concepto for _, concepto in mn_conceptos] +
+              [nombre for _, nombre, _, _ in patrones_neuronas])
+    matriz, indice = embedding_engine.calcular_lote(textos, dim=64)
+
+    for mn_id, concepto, metadata in vocabulario_unificado:
+        razonador.registrar_micro_neurona(MicroNeurona(mn_id, concepto, "palabra_clave", embedding=matriz[indice[concepto]].tolist(), metadata=metadata))
+
+    for mn_id, concepto in mn_conceptos:
+        razonador.registrar_micro_neurona(MicroNeurona(mn_id, concepto, "concepto_abstracto", embedding=matriz[indice[concepto]].tolist()))
+
+    for n_id, nombre, condiciones, exclusiones in patrones_neuronas:
+        razonador.registrar_neurona(Neurona(n_id, nombre, condiciones, exclusiones_mn=exclusiones, embedding=matriz[indice[nombre]].tolist()))
 
     # =================================================================================
     # CAPA 3: MacroNeuronas (MacroNs) - OBSOLETO
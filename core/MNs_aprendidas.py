@@ -1,14 +1,18 @@
 from core.micro_neurona import MicroNeurona
+from core.embedding_engine import embedding_engine
 
 neuronas_aprendidas = []
 
 def poblar_neuronas_aprendidas():
+    # Los embeddings de todos los patrones se calculan juntos en un único lote
+    matriz, indice = embedding_engine.calcular_lote(["qué tal", "hace calor"], dim=64)
+
     # Ejemplo 1: Neurona aprendida para patrón "qué tal"
     neuronas_aprendidas.append(MicroNeurona(
         id="n_patron_que_tal",
         concepto="qué tal",
         tipo="patron",
-        embedding=None,  # Se puede recalcular al cargar
+        embedding=matriz[indice["qué tal"]].tolist(),
         metadata={
             "secuencia": ["que", "tal"],
             "regex": r"que tal",
@@ -44,7 +48,7 @@ def poblar_neuronas_aprendidas():
         id="n_patron_hace_calor",
         concepto="hace calor",
         tipo="patron",
-        embedding=None,
+        embedding=matriz[indice["hace calor"]].tolist(),
         metadata={
             "secuencia": ["hace", "calor"],
             "regex": r"hace calor",
@@ -3,134 +3,610 @@ Sistema de Caché Inteligente para Krystal AI
 Optimiza el rendimiento mediante caché LRU de similitudes y activaciones.
 """
 
+import os
+import pickle
+import sys
 import time
 import threading
-from collections import OrderedDict
-from typing import Dict, List, Tuple, Optional, Any
-import hashlib
-import pickle
+import weakref
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Callable, Dict, List, Set, Tuple, Optional, Any
+
+import numpy as np
+
+from .eviction import entry_size
+
+
+_MISSING = object()
+
+# Bytes de contabilidad por entrada: nodo del OrderedDict y vencimiento
+_BYTES_CONTABILIDAD = 200
+
+# Formato de las instantáneas de CacheManager
+SNAPSHOT_FORMAT = 1
+
+
+def vector_fingerprint(vector) -> int:
+    """Huella de 64 bits de un vector: hash de la tupla de sus valores.
+    
+    El hash de floats y tuplas de Python no se sala por proceso (a diferencia
+    del de str), así que la huella es estable entre ejecuciones. Un array
+    NumPy y una lista con los mismos valores dan la misma huella.
+    """
+    if isinstance(vector, np.ndarray):
+        vector = vector.tolist()
+    return hash(tuple(vector))
+
+
+def batch_fingerprint(vectores) -> Tuple[int, int]:
+    """Huella de una lista de vectores: (número de vectores, hash de sus huellas)."""
+    return (len(vectores), hash(tuple(vector_fingerprint(v) for v in vectores)))
 
 
 class LRUCache:
-    """Implementación de caché LRU thread-safe con TTL opcional."""
+    """Implementación de caché LRU thread-safe con TTL opcional.
+    
+    Los aciertos no esperan al lock: la lectura del diccionario es atómica y
+    la recencia sólo se actualiza si el lock está libre en ese momento.
+    Los contadores de aciertos pueden perder algún incremento bajo contención.
     
-    def __init__(self, max_size: int = 1000, ttl: Optional[float] = None):
+    `on_evict(key)` se llama (con el lock tomado) cada vez que una entrada sale
+    por capacidad, expiración o `remove`, para que quien indexe las claves
+    pueda mantenerse al día.
+    
+    Con TTL único por caché, el orden de escritura es el orden de vencimiento:
+    `_vencimientos` (clave -> instante de vencimiento en reloj monótono) se
+    mantiene en ese orden y la expiración sólo recorre su principio, así que
+    cuesta lo proporcional a las entradas vencidas.
+    """
+    
+    def __init__(self, max_size: int = 1000, ttl: Optional[float] = None,
+                 on_evict: Optional[Callable[[Any], None]] = None):
         self.max_size = max_size
         self.ttl = ttl  # Time to live en segundos
+        self.on_evict = on_evict
         self.cache = OrderedDict()
-        self.timestamps = {}
+        self._vencimientos: "OrderedDict[Any, float]" = OrderedDict()
         self.lock = threading.RLock()
         self.hits = 0
         self.misses = 0
+        
+        # Métricas de expiración y expulsión
+        self.expired = 0
+        self.expired_on_access = 0
+        self.expiry_sweeps = 0
+        self.evictions = 0
     
     def _is_expired(self, key: str) -> bool:
         """Verifica si una entrada ha expirado."""
         if self.ttl is None:
             return False
-        return time.time() - self.timestamps.get(key, 0) > self.ttl
+        return time.monotonic() >= self._vencimientos.get(key, 0.0)
     
-    def _cleanup_expired(self):
-        """Limpia entradas expiradas."""
-        if self.ttl is None:
-            return
+    def _cleanup_expired(self) -> int:
+        """Quita las entradas vencidas recorriendo sólo el principio del orden (requiere el lock)."""
+        if self.ttl is None or not self._vencimientos:
+            return 0
         
-        current_time = time.time()
-        expired_keys = [
-            key for key, timestamp in self.timestamps.items()
-            if current_time - timestamp > self.ttl
-        ]
-        
-        for key in expired_keys:
-            self.cache.pop(key, None)
-            self.timestamps.pop(key, None)
+        ahora = time.monotonic()
+        quitadas = 0
+        while self._vencimientos:
+            key, vencimiento = next(iter(self._vencimientos.items()))
+            if vencimiento > ahora:
+                break
+            self._discard(key)
+            quitadas += 1
+        if quitadas:
+            self.expired += quitadas
+            self.expiry_sweeps += 1
+        return quitadas
+    
+    def _discard(self, key) -> bool:
+        """Quita una entrada y avisa a on_evict (requiere el lock)."""
+        if key not in self.cache:
+            return False
+        del self.cache[key]
+        self._vencimientos.pop(key, None)
+        if self.on_evict is not None:
+            self.on_evict(key)
+        return True
     
     def get(self, key: str) -> Optional[Any]:
         """Obtiene un valor del caché."""
-        with self.lock:
-            if key not in self.cache or self._is_expired(key):
+        value = self.cache.get(key, _MISSING)
+        if value is _MISSING or self._is_expired(key):
+            with self.lock:
                 self.misses += 1
-                if key in self.cache:
+                if key in self.cache and self._is_expired(key):
                     # Remover entrada expirada
-                    del self.cache[key]
-                    del self.timestamps[key]
-                return None
-            
-            # Mover al final (más reciente)
-            value = self.cache.pop(key)
-            self.cache[key] = value
-            self.hits += 1
-            return value
+                    self._discard(key)
+                    self.expired += 1
+                    self.expired_on_access += 1
+            return None
+        
+        # Mover al final (más reciente) sólo si nadie más tiene el lock
+        if self.lock.acquire(blocking=False):
+            try:
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+            finally:
+                self.lock.release()
+        self.hits += 1
+        return value
     
     def put(self, key: str, value: Any):
         """Almacena un valor en el caché."""
         with self.lock:
-            # Limpiar expirados ocasionalmente
-            if len(self.cache) % 100 == 0:
-                self._cleanup_expired()
+            # Expirar lo vencido (normalmente nada: una comparación)
+            self._cleanup_expired()
             
             if key in self.cache:
                 # Actualizar valor existente
                 self.cache.pop(key)
             elif len(self.cache) >= self.max_size:
                 # Remover el más antiguo
-                oldest_key = next(iter(self.cache))
-                del self.cache[oldest_key]
-                del self.timestamps[oldest_key]
+                self._discard(next(iter(self.cache)))
+                self.evictions += 1
             
             self.cache[key] = value
-            self.timestamps[key] = time.time()
+            if self.ttl is not None:
+                # Reescribir mueve la clave al final: el orden sigue siendo el de vencimiento
+                self._vencimientos.pop(key, None)
+                self._vencimientos[key] = time.monotonic() + self.ttl
+    
+    def remove(self, key) -> bool:
+        """Quita una entrada concreta; devuelve si existía."""
+        with self.lock:
+            return self._discard(key)
+    
+    def snapshot_entries(self) -> List[Tuple[Any, Any, Optional[float]]]:
+        """Entradas vigentes como (clave, valor, segundos de vida restantes), de la más antigua a la más reciente."""
+        with self.lock:
+            ahora = time.monotonic()
+            entradas = []
+            for key, value in self.cache.items():
+                restante = None
+                if self.ttl is not None:
+                    restante = self._vencimientos.get(key, 0.0) - ahora
+                    if restante <= 0:
+                        continue
+                entradas.append((key, value, restante))
+            return entradas
+    
+    def restore(self, entradas: List[Tuple[Any, Any, Optional[float]]]) -> int:
+        """Carga entradas de `snapshot_entries` sin pisar las que ya existen.
+        
+        Conserva el orden LRU de la instantánea por detrás de lo ya presente y
+        reordena los vencimientos (una sola vez) para mantener la invariante.
+        """
+        with self.lock:
+            ahora = time.monotonic()
+            previas = list(self.cache)
+            restauradas = 0
+            for key, value, restante in entradas:
+                if key in self.cache:
+                    continue
+                if self.ttl is not None and (restante is None or restante <= 0):
+                    continue
+                self.cache[key] = value
+                if self.ttl is not None:
+                    self._vencimientos[key] = ahora + min(restante, self.ttl)
+                restauradas += 1
+            # Lo que ya estaba es más reciente que lo restaurado
+            for key in previas:
+                self.cache.move_to_end(key)
+            if self.ttl is not None:
+                self._vencimientos = OrderedDict(sorted(self._vencimientos.items(),
+                                                        key=lambda item: item[1]))
+            while len(self.cache) > self.max_size:
+                self._discard(next(iter(self.cache)))
+            return restauradas
+    
+    def resize(self, max_size: int):
+        """Cambia la capacidad, expulsando las entradas más antiguas si sobran."""
+        with self.lock:
+            self.max_size = max(1, max_size)
+            while len(self.cache) > self.max_size:
+                self._discard(next(iter(self.cache)))
+                self.evictions += 1
     
     def clear(self):
         """Limpia todo el caché."""
         with self.lock:
             self.cache.clear()
-            self.timestamps.clear()
+            self._vencimientos.clear()
             self.hits = 0
             self.misses = 0
     
+    def __len__(self) -> int:
+        return len(self.cache)
+    
+    def __contains__(self, key) -> bool:
+        """Presencia sin tocar el orden LRU ni las estadísticas."""
+        return key in self.cache
+    
     def get_stats(self) -> Dict[str, Any]:
-        """Obtiene estadísticas del caché."""
-        with self.lock:
-            total_requests = self.hits + self.misses
-            hit_rate = self.hits / total_requests if total_requests > 0 else 0
-            return {
-                'size': len(self.cache),
-                'max_size': self.max_size,
-                'hits': self.hits,
-                'misses': self.misses,
-                'hit_rate': hit_rate,
-                'ttl': self.ttl
-            }
+        """Obtiene estadísticas del caché (lectura sin lock de los contadores)."""
+        hits, misses = self.hits, self.misses
+        total_requests = hits + misses
+        hit_rate = hits / total_requests if total_requests > 0 else 0
+        return {
+            'size': len(self.cache),
+            'max_size': self.max_size,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hit_rate,
+            'ttl': self.ttl,
+            'expired': self.expired,
+            'expired_on_access': self.expired_on_access,
+            'expiry_sweeps': self.expiry_sweeps,
+            'evictions': self.evictions
+        }
+
+
+class ShardedLRUCache:
+    """Caché LRU particionada por hash de la clave.
+    
+    Cada partición es un LRUCache con su propio lock, así que hilos que usan
+    claves distintas casi nunca compiten. Mantiene la interfaz de LRUCache.
+    """
+    
+    # Participa del reparto de presupuesto de CacheManager
+    resizable = True
+    
+    def __init__(self, max_size: int = 1000, ttl: Optional[float] = None, num_shards: int = 16,
+                 on_evict: Optional[Callable[[Any], None]] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        shard_size = max(1, -(-max_size // num_shards))
+        self.shards = [LRUCache(max_size=shard_size, ttl=ttl, on_evict=on_evict)
+                       for _ in range(num_shards)]
+    
+    def _shard(self, key) -> LRUCache:
+        return self.shards[hash(key) % len(self.shards)]
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Obtiene un valor del caché."""
+        return self._shard(key).get(key)
+    
+    def put(self, key: str, value: Any):
+        """Almacena un valor en el caché."""
+        self._shard(key).put(key, value)
+    
+    def remove(self, key) -> bool:
+        """Quita una entrada concreta; devuelve si existía."""
+        return self._shard(key).remove(key)
+    
+    def resize(self, max_size: int):
+        """Reparte una nueva capacidad total entre las particiones."""
+        self.max_size = max_size
+        shard_size = max(1, -(-max_size // len(self.shards)))
+        for shard in self.shards:
+            shard.resize(shard_size)
+    
+    def snapshot_entries(self) -> List[Tuple[Any, Any, Optional[float]]]:
+        """Entradas vigentes de todas las particiones (cada una en su orden LRU)."""
+        entradas = []
+        for shard in self.shards:
+            entradas.extend(shard.snapshot_entries())
+        return entradas
+    
+    def restore(self, entradas: List[Tuple[Any, Any, Optional[float]]]) -> int:
+        """Reparte entradas de una instantánea entre las particiones."""
+        por_particion = [[] for _ in self.shards]
+        for entrada in entradas:
+            por_particion[hash(entrada[0]) % len(self.shards)].append(entrada)
+        return sum(shard.restore(parte) for shard, parte in zip(self.shards, por_particion))
+    
+    def sample(self, n: int) -> List[Tuple[Any, Any]]:
+        """Hasta n pares (clave, valor) recientes, repartidos entre particiones."""
+        por_particion = max(1, -(-n // len(self.shards)))
+        muestra = []
+        for shard in self.shards:
+            with shard.lock:
+                muestra.extend(islice(reversed(shard.cache.items()), por_particion))
+        return muestra
+    
+    def _cleanup_expired(self) -> int:
+        """Limpia entradas expiradas partición por partición."""
+        quitadas = 0
+        for shard in self.shards:
+            with shard.lock:
+                quitadas += shard._cleanup_expired()
+        return quitadas
+    
+    def clear(self):
+        """Limpia todo el caché."""
+        for shard in self.shards:
+            shard.clear()
+    
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards)
+    
+    def __contains__(self, key) -> bool:
+        return key in self._shard(key)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Obtiene estadísticas agregadas de las particiones, sin lock global."""
+        hits = sum(shard.hits for shard in self.shards)
+        misses = sum(shard.misses for shard in self.shards)
+        total_requests = hits + misses
+        return {
+            'size': len(self),
+            'max_size': self.max_size,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total_requests if total_requests > 0 else 0,
+            'ttl': self.ttl,
+            'expired': sum(shard.expired for shard in self.shards),
+            'expired_on_access': sum(shard.expired_on_access for shard in self.shards),
+            'expiry_sweeps': sum(shard.expiry_sweeps for shard in self.shards),
+            'evictions': sum(shard.evictions for shard in self.shards),
+            'shards': len(self.shards)
+        }
+
+
+def _bytes_entrada(key, value) -> int:
+    """Bytes aproximados de una entrada: clave tupla, valor y contabilidad de la caché."""
+    size = entry_size(key, value) + _BYTES_CONTABILIDAD
+    if isinstance(key, tuple):
+        size += sum(sys.getsizeof(parte) for parte in key)
+    return size
 
 
 class CacheManager:
-    """Gestor central de caché para el sistema Krystal AI."""
+    """Gestor central de caché para el sistema Krystal AI.
+    
+    Con `max_memory_mb`, las cuatro cachés comparten un presupuesto de bytes:
+    cada `rebalance_interval` segundos se mide el tamaño medio de entrada de
+    cada caché (por muestreo) y sus aciertos desde el reparto anterior, y los
+    bytes se reparten en proporción a los aciertos, con un mínimo de
+    `min_share` por caché. Una caché que no expulsa entradas no recibe más
+    del doble de lo que ocupa; lo que sobra va a las demás.
+    """
+    
+    # Tamaño supuesto de entrada antes de poder muestrear (bytes)
+    _BYTES_INICIALES = {
+        'similarity_cache': 400,
+        'embedding_cache': 1200,
+        'activation_cache': 500,
+        'evaluation_cache': 600,
+    }
     
-    def __init__(self):
+    def __init__(self, max_memory_mb: Optional[float] = 64, rebalance_interval: float = 60.0,
+                 min_share: float = 0.05, sample_size: int = 64,
+                 shared_memory: Optional[str] = None):
         # Caché para similitudes coseno
-        self.similarity_cache = LRUCache(max_size=10000, ttl=3600)  # 1 hora TTL
+        self.similarity_cache = ShardedLRUCache(max_size=10000, ttl=3600)  # 1 hora TTL
         
         # Caché para embeddings calculados
-        self.embedding_cache = LRUCache(max_size=5000, ttl=7200)  # 2 horas TTL
+        self.embedding_cache = ShardedLRUCache(max_size=5000, ttl=7200)  # 2 horas TTL
         
         # Caché para activaciones de micro-neuronas
-        self.activation_cache = LRUCache(max_size=2000, ttl=1800)  # 30 min TTL
+        self.activation_cache = ShardedLRUCache(max_size=2000, ttl=1800,  # 30 min TTL
+                                                on_evict=self._olvidar_dependencia)
         
         # Caché para resultados de evaluación de neuronas
-        self.evaluation_cache = LRUCache(max_size=1000, ttl=1800)  # 30 min TTL
+        self.evaluation_cache = ShardedLRUCache(max_size=1000, ttl=1800,  # 30 min TTL
+                                                on_evict=self._olvidar_dependencia)
+        
+        # Índice inverso: id de neurona -> claves de activación/evaluación que dependen de ella.
+        # Las claves son ('activation' | 'evaluation', id, ...), así que la clave misma dice
+        # a qué neurona y a qué caché pertenece.
+        self._dependencias: Dict[str, Set[Tuple]] = {}
+        self._dep_lock = threading.Lock()
+        self.invalidated_entries = 0
+        
+        # Identidades de vectores registrados: id(objeto) -> (weakref, huella).
+        # Sólo arrays de sólo lectura: su contenido no puede cambiar.
+        self._identidades: Dict[int, Tuple[Any, int]] = {}
+        
+        # Backend opcional en memoria compartida para similitudes y embeddings
+        if shared_memory is not None:
+            self.enable_shared_memory(shared_memory)
+        
+        # Presupuesto global de memoria
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024) if max_memory_mb else None
+        self.rebalance_interval = rebalance_interval
+        self.min_share = min_share
+        self.sample_size = sample_size
+        self._budget_lock = threading.Lock()
+        self._bytes_medios = dict(self._BYTES_INICIALES)
+        self._contadores_previos: Dict[str, Dict[str, int]] = {}
+        self._proximo_balance = time.monotonic() + rebalance_interval
+        self.rebalances = 0
+        self.rebalance_history = deque(maxlen=10)
+        if self.max_memory_bytes is not None:
+            self._ajustar_inicial()
+        
+        # Instantáneas periódicas (ver start_snapshots)
+        self._snapshot_stop = threading.Event()
+        self._snapshot_thread: Optional[threading.Thread] = None
+        self._snapshot_path: Optional[str] = None
+        self._snapshot_versiones: Optional[Callable[[], Tuple[str, str]]] = None
+        self.snapshots_saved = 0
+        self.snapshot_entries_restored = 0
+        self.snapshots_rejected = 0
         
         # Estadísticas globales
         self.start_time = time.time()
     
-    def _generate_key(self, *args) -> str:
-        """Genera una clave única para los argumentos dados."""
-        # Serializar argumentos y crear hash
-        serialized = pickle.dumps(args, protocol=pickle.HIGHEST_PROTOCOL)
-        return hashlib.md5(serialized).hexdigest()
+    def _caches(self) -> Dict[str, ShardedLRUCache]:
+        return {
+            'similarity_cache': self.similarity_cache,
+            'embedding_cache': self.embedding_cache,
+            'activation_cache': self.activation_cache,
+            'evaluation_cache': self.evaluation_cache,
+        }
+    
+    def _caches_locales(self) -> Dict[str, ShardedLRUCache]:
+        """Cachés en memoria del proceso: las que entran en el reparto de presupuesto."""
+        return {nombre: cache for nombre, cache in self._caches().items() if cache.resizable}
+    
+    def enable_shared_memory(self, name: str, similarity_slots: int = 65536,
+                             embedding_slots: int = 16384, embedding_bytes: int = 520):
+        """Pasa las cachés de similitud y embedding a memoria compartida.
+        
+        Todos los procesos del host que usen el mismo `name` comparten los
+        resultados. `embedding_bytes` limita el tamaño de un embedding en caché
+        (520 bytes admite hasta 129 dimensiones float32); los más grandes no
+        se cachean. La API de CacheManager no cambia.
+        """
+        from .shared_cache import SharedMemoryCache
+        
+        self.similarity_cache = SharedMemoryCache(f"{name}_similarity", slots=similarity_slots,
+                                                  max_value_bytes=16, ttl=self.similarity_cache.ttl)
+        self.embedding_cache = SharedMemoryCache(f"{name}_embedding", slots=embedding_slots,
+                                                 max_value_bytes=embedding_bytes,
+                                                 ttl=self.embedding_cache.ttl)
+    
+    def _ajustar_inicial(self):
+        """Escala las capacidades por defecto para que quepan en el presupuesto."""
+        estimado = sum(cache.max_size * self._bytes_medios[nombre]
+                       for nombre, cache in self._caches_locales().items())
+        if estimado > self.max_memory_bytes:
+            factor = self.max_memory_bytes / estimado
+            for cache in self._caches_locales().values():
+                cache.resize(max(len(cache.shards), int(cache.max_size * factor)))
+    
+    def _tal_vez_rebalancear(self):
+        """Reparte el presupuesto si toca; no bloquea si otro hilo ya lo está haciendo."""
+        if (self.max_memory_bytes is not None and time.monotonic() >= self._proximo_balance
+                and self._budget_lock.acquire(blocking=False)):
+            try:
+                self._rebalancear()
+            except Exception as e:
+                print(f"Error repartiendo el presupuesto de caché: {e}")
+            finally:
+                self._budget_lock.release()
+    
+    def rebalance(self) -> Optional[Dict[str, Any]]:
+        """Reparte ahora el presupuesto entre las cachés y devuelve la decisión."""
+        if self.max_memory_bytes is None:
+            return None
+        with self._budget_lock:
+            return self._rebalancear()
+    
+    def _rebalancear(self) -> Dict[str, Any]:
+        """Reparte el presupuesto según aciertos y tamaño de entrada (requiere _budget_lock)."""
+        self._proximo_balance = time.monotonic() + self.rebalance_interval
+        caches = self._caches_locales()
+        
+        medidas = {}
+        for nombre, cache in caches.items():
+            muestra = cache.sample(self.sample_size)
+            if muestra:
+                self._bytes_medios[nombre] = sum(_bytes_entrada(k, v) for k, v in muestra) / len(muestra)
+            stats = cache.get_stats()
+            previos = self._contadores_previos.get(nombre, {})
+            # clear() reinicia los contadores: un delta negativo cuenta como el valor actual
+            delta = {}
+            for campo in ('hits', 'misses', 'evictions'):
+                anterior = previos.get(campo, 0)
+                delta[campo] = stats[campo] - anterior if stats[campo] >= anterior else stats[campo]
+            self._contadores_previos[nombre] = {c: stats[c] for c in ('hits', 'misses', 'evictions')}
+            medidas[nombre] = {
+                'bytes_entrada': self._bytes_medios[nombre],
+                'ocupado': stats['size'] * self._bytes_medios[nombre],
+                **delta
+            }
+        
+        # Piso por caché y reparto del resto en proporción a los aciertos, con techo
+        # para las cachés que no expulsan (no necesitan más del doble de lo que ocupan)
+        piso = self.max_memory_bytes * self.min_share
+        disponible = self.max_memory_bytes - piso * len(caches)
+        pesos = {nombre: m['hits'] + 1 for nombre, m in medidas.items()}
+        techos = {nombre: (float('inf') if m['evictions'] else max(0.0, 2 * m['ocupado'] - piso))
+                  for nombre, m in medidas.items()}
+        asignado = {nombre: 0.0 for nombre in caches}
+        pendientes = set(caches)
+        while pendientes and disponible > 0:
+            total = sum(pesos[n] for n in pendientes)
+            topados = {n for n in pendientes if disponible * pesos[n] / total >= techos[n]}
+            if not topados:
+                for n in pendientes:
+                    asignado[n] = disponible * pesos[n] / total
+                disponible = 0
+                break
+            for n in topados:
+                asignado[n] = techos[n]
+                disponible -= techos[n]
+            pendientes -= topados
+        if disponible > 0:
+            # Todas topadas: el sobrante se reparte igual en proporción a los aciertos
+            total = sum(pesos.values())
+            for n in caches:
+                asignado[n] += disponible * pesos[n] / total
+        
+        decision = {'timestamp': time.time(), 'caches': {}}
+        for nombre, cache in caches.items():
+            bytes_cache = piso + asignado[nombre]
+            capacidad = max(len(cache.shards), int(bytes_cache / self._bytes_medios[nombre]))
+            cache.resize(capacidad)
+            decision['caches'][nombre] = {
+                'max_size': capacidad,
+                'budget_bytes': int(bytes_cache),
+                'avg_entry_bytes': round(self._bytes_medios[nombre], 1),
+                'hits': medidas[nombre]['hits'],
+                'misses': medidas[nombre]['misses'],
+                'evictions': medidas[nombre]['evictions']
+            }
+        self.rebalances += 1
+        self.rebalance_history.append(decision)
+        return decision
+    
+    def estimated_memory_bytes(self) -> int:
+        """Bytes estimados en uso: entradas de cada caché por su tamaño medio medido."""
+        return int(sum(len(cache) * self._bytes_medios[nombre]
+                       for nombre, cache in self._caches_locales().items()))
+    
+    def _generate_key(self, *args) -> Tuple:
+        """Genera una clave única para los argumentos dados.
+        
+        Es una tupla plana: los vectores ya vienen reducidos a huellas enteras,
+        así que basta el hash de tupla de Python (sin pickle ni md5).
+        """
+        return args
+    
+    def registrar_vector(self, vector) -> int:
+        """Registra un vector y devuelve su identidad entera (su huella).
+        
+        Un array de sólo lectura (p. ej. el embedding de una micro-neurona)
+        queda asociado a su identidad mientras viva, y las consultas
+        posteriores con ese mismo objeto no recalculan la huella.
+        """
+        identidad = vector_fingerprint(vector)
+        if isinstance(vector, np.ndarray) and not vector.flags.writeable:
+            clave = id(vector)
+            ref = weakref.ref(vector, lambda _, clave=clave: self._identidades.pop(clave, None))
+            self._identidades[clave] = (ref, identidad)
+        return identidad
+    
+    def identidad_vector(self, vector) -> int:
+        """Identidad entera de un vector: la registrada o, si no lo está, su huella."""
+        registrada = self._identidades.get(id(vector))
+        if registrada is not None and registrada[0]() is vector:
+            return registrada[1]
+        return vector_fingerprint(vector)
+    
+    @staticmethod
+    def _pair_key(id1: int, id2: int) -> Tuple:
+        """Clave de un par no ordenado: (a, b) y (b, a) comparten una sola entrada."""
+        return ('similarity', id1, id2) if id1 <= id2 else ('similarity', id2, id1)
+    
+    def get_similarity_ids(self, id1: int, id2: int) -> Optional[float]:
+        """Obtiene del caché la similitud entre dos vectores por su identidad."""
+        return self.similarity_cache.get(self._pair_key(id1, id2))
+    
+    def cache_similarity_ids(self, id1: int, id2: int, similarity: float):
+        """Almacena en caché la similitud entre dos vectores por su identidad."""
+        self.similarity_cache.put(self._pair_key(id1, id2), similarity)
+        self._tal_vez_rebalancear()
     
     def get_similarity(self, vector1: List[float], vector2: List[float]) -> Optional[float]:
         """Obtiene similitud coseno del caché.
-        Asegura que vector1 y vector2 sean secuencias antes de convertirlas a tuple.
+        Asegura que vector1 y vector2 sean secuencias antes de calcular su identidad.
         Si alguno es float, lo encapsula en una lista. Si no es secuencia ni float, lanza TypeError.
         """
         def ensure_sequence(vec, name):
@@ -141,17 +617,12 @@ class CacheManager:
             return vec
         vector1 = ensure_sequence(vector1, "vector1")
         vector2 = ensure_sequence(vector2, "vector2")
-        key = self._generate_key('similarity', tuple(vector1), tuple(vector2))
-        return self.similarity_cache.get(key)
+        return self.get_similarity_ids(self.identidad_vector(vector1), self.identidad_vector(vector2))
     
     def cache_similarity(self, vector1: List[float], vector2: List[float], similarity: float):
-        """Almacena similitud coseno en caché."""
-        key = self._generate_key('similarity', tuple(vector1), tuple(vector2))
-        self.similarity_cache.put(key, similarity)
-        
-        # También cachear la similitud inversa (vector2, vector1)
-        key_inverse = self._generate_key('similarity', tuple(vector2), tuple(vector1))
-        self.similarity_cache.put(key_inverse, similarity)
+        """Almacena similitud coseno en caché (una sola entrada por par, sin importar el orden)."""
+        self.cache_similarity_ids(self.identidad_vector(vector1), self.identidad_vector(vector2),
+                                  similarity)
     
     def get_embedding(self, texto: str, dim: int) -> Optional[List[float]]:
         """Obtiene embedding del caché."""
@@ -162,23 +633,23 @@ class CacheManager:
         """Almacena embedding en caché."""
         key = self._generate_key('embedding', texto, dim)
         self.embedding_cache.put(key, embedding)
+        self._tal_vez_rebalancear()
     
     def get_activation(self, mn_id: str, vectores_entrada: List[List[float]], 
                       frase_original: str, umbral: float) -> Optional[Tuple[bool, float]]:
         """Obtiene resultado de activación del caché."""
-        key = self._generate_key('activation', mn_id, 
-                                [tuple(v) for v in vectores_entrada], 
-                                frase_original, umbral)
+        key = self._generate_key('activation', mn_id, batch_fingerprint(vectores_entrada),
+                                 frase_original, umbral)
         return self.activation_cache.get(key)
     
     def cache_activation(self, mn_id: str, vectores_entrada: List[List[float]], 
                         frase_original: str, umbral: float, 
                         result: Tuple[bool, float]):
         """Almacena resultado de activación en caché."""
-        key = self._generate_key('activation', mn_id, 
-                                [tuple(v) for v in vectores_entrada], 
-                                frase_original, umbral)
-        self.activation_cache.put(key, result)
+        key = self._generate_key('activation', mn_id, batch_fingerprint(vectores_entrada),
+                                 frase_original, umbral)
+        self._guardar_con_dependencia(self.activation_cache, mn_id, key, result)
+        self._tal_vez_rebalancear()
     
     def get_evaluation(self, neurona_id: str, conceptos_activos: Dict[str, float]) -> Optional[Tuple[bool, float]]:
         """Obtiene resultado de evaluación del caché."""
@@ -192,15 +663,163 @@ class CacheManager:
         """Almacena resultado de evaluación en caché."""
         conceptos_sorted = tuple(sorted(conceptos_activos.items()))
         key = self._generate_key('evaluation', neurona_id, conceptos_sorted)
-        self.evaluation_cache.put(key, result)
+        self._guardar_con_dependencia(self.evaluation_cache, neurona_id, key, result)
+        self._tal_vez_rebalancear()
     
-    def invalidate_neuron_caches(self, neurona_id: str):
-        """Invalida cachés relacionados con una neurona específica."""
-        # Para una implementación más sofisticada, podríamos mantener
-        # un índice inverso de qué claves están relacionadas con cada neurona
-        # Por ahora, simplemente limpiamos los cachés de activación y evaluación
-        self.activation_cache.clear()
-        self.evaluation_cache.clear()
+    def _guardar_con_dependencia(self, cache, neurona_id: str, key: Tuple, result: Any):
+        """Guarda una entrada dependiente de una neurona sin carreras con el índice inverso.
+        
+        La dependencia se anota antes del put, así que una expulsión posterior
+        siempre la encuentra. Si una invalidación de la neurona se cruza entre
+        ambos pasos, la anotación ya no está al terminar y la entrada (calculada
+        con los pesos viejos) se retira.
+        """
+        self._registrar_dependencia(neurona_id, key)
+        cache.put(key, result)
+        with self._dep_lock:
+            vigente = key in self._dependencias.get(neurona_id, ())
+        if not vigente:
+            cache.remove(key)
+    
+    def _registrar_dependencia(self, neurona_id: str, key: Tuple):
+        """Anota en el índice inverso que `key` depende de la neurona."""
+        with self._dep_lock:
+            self._dependencias.setdefault(neurona_id, set()).add(key)
+    
+    def _olvidar_dependencia(self, key: Tuple):
+        """Callback on_evict: la entrada salió del caché, ya no hace falta indexarla."""
+        with self._dep_lock:
+            claves = self._dependencias.get(key[1])
+            if claves is not None:
+                claves.discard(key)
+                if not claves:
+                    del self._dependencias[key[1]]
+    
+    def invalidate_neuron_caches(self, neurona_id: str) -> int:
+        """Invalida sólo las activaciones y evaluaciones que dependen de una neurona.
+        
+        Devuelve el número de entradas expulsadas.
+        """
+        with self._dep_lock:
+            claves = self._dependencias.pop(neurona_id, None)
+        if not claves:
+            return 0
+        
+        expulsadas = 0
+        for key in claves:
+            cache = self.activation_cache if key[0] == 'activation' else self.evaluation_cache
+            if cache.remove(key):
+                expulsadas += 1
+        self.invalidated_entries += expulsadas
+        return expulsadas
+    
+    # Cachés que sobreviven a un reinicio: la de evaluación depende de pesos que
+    # cambian con el aprendizaje y se reconstruye en caliente.
+    SNAPSHOT_CACHES = ('similarity_cache', 'embedding_cache', 'activation_cache')
+    
+    def save_snapshot(self, path: str, embedding_version: str, graph_version: str) -> int:
+        """Guarda las cachés de similitud, embedding y activación en `path`.
+        
+        La escritura es atómica (archivo temporal + rename). Devuelve el número
+        de entradas guardadas.
+        """
+        caches = self._caches()
+        contenido = {
+            'format': SNAPSHOT_FORMAT,
+            'embedding_version': embedding_version,
+            'graph_version': graph_version,
+            'created': time.time(),
+            'caches': {nombre: caches[nombre].snapshot_entries() for nombre in self.SNAPSHOT_CACHES}
+        }
+        directorio = os.path.dirname(path)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        temporal = path + '.tmp'
+        with open(temporal, 'wb') as f:
+            pickle.dump(contenido, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, path)
+        self.snapshots_saved += 1
+        return sum(len(entradas) for entradas in contenido['caches'].values())
+    
+    def load_snapshot(self, path: str, embedding_version: str, graph_version: str) -> int:
+        """Restaura una instantánea si coincide con las versiones actuales.
+        
+        Una instantánea de otro algoritmo de embeddings o de otro grafo de
+        neuronas se descarta entera. Devuelve el número de entradas restauradas.
+        """
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path, 'rb') as f:
+                contenido = pickle.load(f)
+        except Exception as e:
+            print(f"Error leyendo instantánea de caché {path}: {e}")
+            self.snapshots_rejected += 1
+            return 0
+        
+        if (contenido.get('format') != SNAPSHOT_FORMAT
+                or contenido.get('embedding_version') != embedding_version
+                or contenido.get('graph_version') != graph_version):
+            print(f"Instantánea de caché {path} descartada: versión distinta")
+            self.snapshots_rejected += 1
+            return 0
+        
+        caches = self._caches()
+        restauradas = 0
+        for nombre in self.SNAPSHOT_CACHES:
+            entradas = contenido['caches'].get(nombre, [])
+            for _, value, _ in entradas:
+                # Los embeddings en caché son de sólo lectura; pickle los devuelve escribibles
+                if isinstance(value, np.ndarray):
+                    value.flags.writeable = False
+            if nombre == 'activation_cache':
+                # Anotar antes de restaurar (las expulsiones lo limpian) y olvidar
+                # luego las que no entraron: vencidas o fuera de presupuesto
+                for key, _, _ in entradas:
+                    self._registrar_dependencia(key[1], key)
+            restauradas += caches[nombre].restore(entradas)
+            if nombre == 'activation_cache':
+                for key, _, _ in entradas:
+                    if key not in caches[nombre]:
+                        self._olvidar_dependencia(key)
+        self.snapshot_entries_restored += restauradas
+        return restauradas
+    
+    def start_snapshots(self, path: str, interval: float,
+                        versiones: Callable[[], Tuple[str, str]]):
+        """Guarda una instantánea cada `interval` segundos desde un hilo de fondo.
+        
+        `versiones()` devuelve (versión de embeddings, versión del grafo) en el
+        momento de guardar.
+        """
+        self._snapshot_path = path
+        self._snapshot_versiones = versiones
+        if self._snapshot_thread is None:
+            self._snapshot_stop.clear()
+            self._snapshot_thread = threading.Thread(target=self._snapshot_loop, args=(interval,),
+                                                     name="cache-snapshots", daemon=True)
+            self._snapshot_thread.start()
+    
+    def _snapshot_loop(self, interval: float):
+        while not self._snapshot_stop.wait(interval):
+            self._guardar_snapshot_actual()
+    
+    def _guardar_snapshot_actual(self):
+        try:
+            self.save_snapshot(self._snapshot_path, *self._snapshot_versiones())
+        except Exception as e:
+            print(f"Error guardando instantánea de caché: {e}")
+    
+    def stop_snapshots(self, save: bool = True):
+        """Detiene las instantáneas periódicas y, por defecto, guarda una última."""
+        if self._snapshot_thread is not None:
+            self._snapshot_stop.set()
+            self._snapshot_thread.join()
+            self._snapshot_thread = None
+        if save and self._snapshot_path is not None:
+            self._guardar_snapshot_actual()
     
     def get_global_stats(self) -> Dict[str, Any]:
         """Obtiene estadísticas globales del sistema de caché."""
@@ -212,11 +831,30 @@ class CacheManager:
             'embedding_cache': self.embedding_cache.get_stats(),
             'activation_cache': self.activation_cache.get_stats(),
             'evaluation_cache': self.evaluation_cache.get_stats(),
+            'dependency_index': {
+                'neurons': len(self._dependencias),
+                'keys': sum(len(claves) for claves in list(self._dependencias.values())),
+                'invalidated_entries': self.invalidated_entries
+            },
+            'memory_budget': {
+                'max_bytes': self.max_memory_bytes,
+                'estimated_bytes': self.estimated_memory_bytes(),
+                'rebalance_interval': self.rebalance_interval,
+                'rebalances': self.rebalances,
+                'last_decision': self.rebalance_history[-1] if self.rebalance_history else None,
+                'history': list(self.rebalance_history)
+            },
+            'snapshots': {
+                'path': self._snapshot_path,
+                'saved': self.snapshots_saved,
+                'entries_restored': self.snapshot_entries_restored,
+                'rejected': self.snapshots_rejected
+            },
             'total_memory_entries': (
-                len(self.similarity_cache.cache) +
-                len(self.embedding_cache.cache) +
-                len(self.activation_cache.cache) +
-                len(self.evaluation_cache.cache)
+                len(self.similarity_cache) +
+                len(self.embedding_cache) +
+                len(self.activation_cache) +
+                len(self.evaluation_cache)
             )
         }
     
@@ -226,6 +864,8 @@ class CacheManager:
         self.embedding_cache.clear()
         self.activation_cache.clear()
         self.evaluation_cache.clear()
+        with self._dep_lock:
+            self._dependencias.clear()
     
     def optimize_memory(self):
         """Optimiza el uso de memoria limpiando cachés según prioridad."""
@@ -237,4 +877,42 @@ class CacheManager:
 
 
 # Instancia global del gestor de caché
-cache_manager = CacheManager()
\ No newline at end of file
+cache_manager = CacheManager()
+
+
+if __name__ == "__main__":
+    # Benchmark: coste por consulta de la clave estructural frente a md5(pickle)
+    import hashlib
+    import timeit
+    
+    rng = np.random.default_rng(0)
+    vec1 = rng.standard_normal(64).astype(np.float32)
+    vec2 = rng.standard_normal(64).astype(np.float32)
+    entradas = [rng.standard_normal(64).astype(np.float32).tolist() for _ in range(4)]
+    frase = "hola como estas hoy"
+    
+    def clave_md5(*args):
+        return hashlib.md5(pickle.dumps(args, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+    
+    # Como en MicroNeuronaOptimizada: embedding propio como array, entrada como lista
+    manager = CacheManager()
+    lista2 = vec2.tolist()
+    manager.cache_similarity(vec1, lista2, 0.5)
+    manager.cache_activation("mn_1", entradas, frase, 0.7, (True, 0.9))
+    
+    casos = [
+        ("similitud md5(pickle)", lambda: clave_md5('similarity', tuple(vec1), tuple(lista2))),
+        ("similitud huellas", lambda: manager._generate_key(
+            'similarity', vector_fingerprint(vec1), vector_fingerprint(lista2))),
+        ("get_similarity (acierto)", lambda: manager.get_similarity(vec1, lista2)),
+        ("activación md5(pickle)", lambda: clave_md5(
+            'activation', "mn_1", [tuple(v) for v in entradas], frase, 0.7)),
+        ("activación huellas", lambda: manager._generate_key(
+            'activation', "mn_1", batch_fingerprint(entradas), frase, 0.7)),
+        ("get_activation (acierto)", lambda: manager.get_activation("mn_1", entradas, frase, 0.7)),
+    ]
+    
+    n = 20000
+    for nombre, fn in casos:
+        segundos = min(timeit.repeat(fn, number=n, repeat=3))
+        print(f"{nombre:28s} {segundos / n * 1e6:8.2f} µs/consulta")
@@ -0,0 +1,142 @@
+"""
+Gestor de Presupuesto en Disco para Krystal AI
+Mantiene el almacén de embeddings bajo un tamaño máximo expulsando las entradas más frías.
+"""
+
+import threading
+from typing import Dict, Optional
+
+import numpy as np
+
+from .embedding_store import EmbeddingStore
+
+
+class DiskBudgetManager:
+    """Mantiene el almacén de un EmbeddingPool bajo `max_disk_bytes`.
+
+    Trabaja por pasos acotados desde un hilo en segundo plano: en cada paso
+    borra como mucho `batch_size` entradas (las de último uso más antiguo,
+    combinando la fecha de escritura con los accesos que conoce el pool),
+    compacta el almacén cuando hay bytes muertos que recuperar y poda las
+    estadísticas de acceso de una partición del pool.
+    """
+
+    def __init__(self, pool, max_disk_bytes: int, interval: float = 30.0,
+                 batch_size: int = 1000, low_watermark: float = 0.9,
+                 compact_ratio: float = 0.5, stats_ttl: float = 3600):
+        self.pool = pool
+        self.max_disk_bytes = max_disk_bytes
+        self.interval = interval
+        self.batch_size = batch_size
+        # Al superar el límite se libera hasta quedar en low_watermark * límite
+        self.low_watermark = low_watermark
+        # Compactar también si los bytes muertos superan esta fracción del total
+        self.compact_ratio = compact_ratio
+        self.stats_ttl = stats_ttl
+
+        self._next_shard = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+        # Estadísticas
+        self.runs = 0
+        self.evicted_entries = 0
+        self.compactions = 0
+        self.reclaimed_bytes = 0
+        self.pruned_stats = 0
+
+    def start(self):
+        """Arranca el hilo de fondo (idempotente)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="embedding-disk-budget",
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Detiene el hilo de fondo."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error gestionando el presupuesto en disco: {e}")
+
+    def _select_cold(self, registros: np.ndarray, bytes_needed: int) -> np.ndarray:
+        """Hashes de las entradas más frías que suman al menos `bytes_needed` (hasta batch_size)."""
+        ultimo_uso = registros['timestamp'].astype(np.float64)
+
+        # Los accesos en memoria cuentan como uso; lo residente no se expulsa
+        hashes_acceso, tiempos, residentes = self.pool.access_snapshot()
+        orden = np.argsort(registros['hash'])
+        hashes_ordenados = registros['hash'][orden]
+        for hashes, valores in ((hashes_acceso, tiempos),
+                                (residentes, np.full(len(residentes), np.inf))):
+            if len(hashes) == 0:
+                continue
+            pos = np.searchsorted(hashes_ordenados, hashes)
+            pos_validas = pos < len(hashes_ordenados)
+            encontrados = np.zeros(len(hashes), dtype=bool)
+            encontrados[pos_validas] = hashes_ordenados[pos[pos_validas]] == hashes[pos_validas]
+            filas = orden[pos[encontrados]]
+            ultimo_uso[filas] = np.maximum(ultimo_uso[filas], valores[encontrados])
+
+        candidatos = np.flatnonzero(np.isfinite(ultimo_uso))
+        if len(candidatos) > self.batch_size:
+            parte = np.argpartition(ultimo_uso[candidatos], self.batch_size - 1)[:self.batch_size]
+            candidatos = candidatos[parte]
+        candidatos = candidatos[np.argsort(ultimo_uso[candidatos], kind='stable')]
+
+        acumulado = np.cumsum(EmbeddingStore.record_bytes(registros[candidatos]))
+        cuantos = int(np.searchsorted(acumulado, bytes_needed)) + 1
+        return registros['hash'][candidatos[:cuantos]]
+
+    def run_once(self) -> Dict:
+        """Ejecuta un paso de gestión y devuelve lo que hizo."""
+        with self.lock:
+            self.runs += 1
+            store = self.pool.store
+            resultado = {'evicted': 0, 'reclaimed_bytes': 0, 'pruned_stats': 0}
+
+            uso = store.disk_usage()
+            objetivo = int(self.max_disk_bytes * self.low_watermark)
+            if uso > self.max_disk_bytes:
+                # Lo que no alcance con los bytes muertos se libera borrando entradas frías
+                faltan = uso - objetivo - store.dead_bytes()
+                if faltan > 0:
+                    frias = self._select_cold(store.live_records(), faltan)
+                    resultado['evicted'] = store.delete_hashes(frias)
+                    self.evicted_entries += resultado['evicted']
+
+            # Compactar (reescribe todo lo vivo) sólo cuando basta para volver bajo el
+            # objetivo o cuando los bytes muertos son una fracción grande del total
+            muertos = store.dead_bytes()
+            if muertos and ((uso > self.max_disk_bytes and uso - muertos <= objetivo)
+                            or muertos > uso * self.compact_ratio):
+                liberados = store.compact()
+                self.compactions += 1
+                self.reclaimed_bytes += liberados
+                resultado['reclaimed_bytes'] = liberados
+
+            # Podar estadísticas de acceso, una partición por paso
+            resultado['pruned_stats'] = self.pool.prune_access_stats(self.stats_ttl,
+                                                                     shard_index=self._next_shard)
+            self._next_shard = (self._next_shard + 1) % len(self.pool.shards)
+            self.pruned_stats += resultado['pruned_stats']
+            return resultado
+
+    def get_stats(self) -> Dict:
+        """Obtiene estadísticas del gestor."""
+        return {
+            'max_disk_mb': self.max_disk_bytes / (1024 * 1024),
+            'runs': self.runs,
+            'evicted_entries': self.evicted_entries,
+            'compactions': self.compactions,
+            'reclaimed_mb': self.reclaimed_bytes / (1024 * 1024),
+            'pruned_stats': self.pruned_stats
+        }
@@ -0,0 +1,230 @@
+"""
+Motor de Embeddings para Krystal AI
+Calcula embeddings de n-gramas de caracteres de forma vectorizada con NumPy.
+"""
+
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .cache_manager import cache_manager
+
+
+# Versión del algoritmo de embedding. Cambiarla invalida los embeddings persistidos.
+EMBEDDING_VERSION = "ngram-blake2b-splitmix64-v1"
+
+# Constantes de splitmix64 (generador contador: cada componente es independiente)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas, sin acentos y sólo caracteres alfanuméricos o espacios."""
+    if not texto:
+        return ""
+    texto = texto.lower()
+    texto = ''.join(c for c in unicodedata.normalize('NFD', texto)
+                    if unicodedata.category(c) != 'Mn')
+    texto = ''.join(c for c in texto if c.isalnum() or c.isspace())
+    return texto.strip()
+
+
+def generar_ngrams(palabra: str, min_n: int = 2, max_n: int = 5) -> List[str]:
+    """Genera n-grams de caracteres para una palabra, incluyendo la palabra misma."""
+    if not palabra:
+        return []
+
+    # La palabra original siempre aporta un vector base
+    ngrams = {palabra}
+
+    # Prefijos y sufijos para capturar inicios y finales
+    for i in range(1, min(len(palabra), max_n + 1)):
+        ngrams.add(palabra[:i])
+        ngrams.add(palabra[-i:])
+
+    # N-grams internos
+    for n in range(min_n, max_n + 1):
+        for i in range(len(palabra) - n + 1):
+            ngrams.add(palabra[i:i + n])
+
+    return list(ngrams)
+
+
+class EmbeddingEngine:
+    """Motor de embeddings por n-gramas con caché acotada de vectores base."""
+
+    def __init__(self, max_bases: int = 50000, semilla: int = 0):
+        self.max_bases = max_bases
+
+        # Semilla global del hashing de n-grams (estable entre procesos y reinicios)
+        self.semilla = semilla
+        self._salt = semilla.to_bytes(16, 'little', signed=False)
+
+        # Caché LRU de vectores base: (ngram, dim) -> np.ndarray float32
+        self._bases: "OrderedDict[Tuple[str, int], np.ndarray]" = OrderedDict()
+        self.lock = threading.Lock()
+
+        # Estadísticas
+        self.base_hits = 0
+        self.base_misses = 0
+
+    @property
+    def version(self) -> str:
+        """Etiqueta que identifica algoritmo y semilla de los embeddings generados."""
+        return f"{EMBEDDING_VERSION}:{self.semilla}"
+
+    def _semilla(self, ngram: str) -> int:
+        """Semilla entera de 64 bits para un n-gram.
+
+        No se usa hash() porque Python lo sala por proceso: los embeddings
+        cambiarían en cada reinicio.
+        """
+        digest = hashlib.blake2b(ngram.encode('utf-8'), digest_size=8,
+                                 salt=self._salt, person=b'krystal-ngram').digest()
+        return int.from_bytes(digest, 'little')
+
+    @staticmethod
+    def _generar_bases(semillas: np.ndarray, dim: int) -> np.ndarray:
+        """Genera de una vez la matriz (len(semillas), dim) de vectores base en [-1, 1)."""
+        contador = np.arange(1, dim + 1, dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            z = semillas.astype(np.uint64)[:, None] + contador[None, :] * _GOLDEN
+            z = (z ^ (z >> np.uint64(30))) * _MIX1
+            z = (z ^ (z >> np.uint64(27))) * _MIX2
+            z = z ^ (z >> np.uint64(31))
+        # 53 bits altos -> uniforme en [0, 1) -> [-1, 1)
+        uniforme = (z >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+        return (uniforme * 2.0 - 1.0).astype(np.float32)
+
+    def _bases_para(self, ngrams: List[str], dim: int) -> np.ndarray:
+        """Obtiene los vectores base de una lista de n-grams, calculando los faltantes juntos."""
+        bases = np.empty((len(ngrams), dim), dtype=np.float32)
+        faltantes = []
+
+        with self.lock:
+            for i, ngram in enumerate(ngrams):
+                vec = self._bases.get((ngram, dim))
+                if vec is None:
+                    faltantes.append(i)
+                else:
+                    self._bases.move_to_end((ngram, dim))
+                    bases[i] = vec
+            self.base_hits += len(ngrams) - len(faltantes)
+            self.base_misses += len(faltantes)
+
+        if not faltantes:
+            return bases
+
+        semillas = np.fromiter((self._semilla(ngrams[i]) for i in faltantes),
+                               dtype=np.uint64, count=len(faltantes))
+        nuevas = self._generar_bases(semillas, dim)
+        bases[faltantes] = nuevas
+
+        with self.lock:
+            for fila, i in enumerate(faltantes):
+                self._bases[(ngrams[i], dim)] = nuevas[fila]
+            while len(self._bases) > self.max_bases:
+                self._bases.popitem(last=False)
+
+        return bases
+
+    def _calcular_filas(self, textos: List[str], dim: int) -> np.ndarray:
+        """Calcula juntos los embeddings normalizados de varios textos (sin caché)."""
+        filas = np.zeros((len(textos), dim), dtype=np.float64)
+
+        # Unión de n-grams de todos los textos y, por texto, los índices de los suyos
+        vocabulario: Dict[str, int] = {}
+        posiciones: List[int] = []
+        inicios: List[int] = []
+        no_vacios: List[int] = []
+        for fila, texto in enumerate(textos):
+            ngrams = generar_ngrams(normalizar(texto))
+            if not ngrams:
+                continue
+            no_vacios.append(fila)
+            inicios.append(len(posiciones))
+            posiciones.extend(vocabulario.setdefault(g, len(vocabulario)) for g in ngrams)
+
+        if no_vacios:
+            bases = self._bases_para(list(vocabulario), dim)
+            # Cada embedding es la suma de los vectores base de sus n-grams
+            filas[no_vacios] = np.add.reduceat(bases[np.asarray(posiciones)], inicios,
+                                               axis=0, dtype=np.float64)
+
+        # Normalizamos cada fila para tener una magnitud constante
+        normas = np.linalg.norm(filas, axis=1, keepdims=True)
+        np.divide(filas, normas, out=filas, where=normas > 0)
+        return filas.astype(np.float32)
+
+    def calcular_lote(self, textos: List[str], dim: int = 64,
+                      usar_cache: bool = True) -> Tuple[np.ndarray, Dict[str, int]]:
+        """Calcula los embeddings de una lista de textos en bloque.
+
+        Deduplica los textos, consulta la caché de embeddings una vez por texto
+        y calcula juntos los que faltan. Devuelve una matriz contigua (n, dim)
+        float32 con una fila por texto único y el índice texto -> fila.
+        """
+        indice: Dict[str, int] = {}
+        for texto in textos:
+            if texto not in indice:
+                indice[texto] = len(indice)
+
+        matriz = np.empty((len(indice), dim), dtype=np.float32)
+        faltantes: List[str] = []
+        for texto, fila in indice.items():
+            cached = cache_manager.get_embedding(texto, dim) if usar_cache else None
+            if cached is None:
+                faltantes.append(texto)
+            else:
+                matriz[fila] = cached
+
+        if faltantes:
+            calculadas = self._calcular_filas(faltantes, dim)
+            filas = [indice[texto] for texto in faltantes]
+            matriz[filas] = calculadas
+            if usar_cache:
+                for texto, vec in zip(faltantes, calculadas):
+                    # Copia propia de sólo lectura: la caché no retiene la matriz del lote
+                    vec = vec.copy()
+                    vec.flags.writeable = False
+                    cache_manager.cache_embedding(texto, dim, vec)
+
+        return matriz, indice
+
+    def calcular_vector(self, texto: str, dim: int = 64) -> np.ndarray:
+        """Calcula el embedding normalizado de un texto como array float32."""
+        matriz, _ = self.calcular_lote([texto], dim)
+        return matriz[0]
+
+    def calcular_embedding(self, texto: str, dim: int = 64) -> List[float]:
+        """Calcula el embedding de un texto como lista de floats."""
+        return self.calcular_vector(texto, dim).tolist()
+
+    def get_stats(self):
+        """Obtiene estadísticas del motor."""
+        with self.lock:
+            total = self.base_hits + self.base_misses
+            return {
+                'version': self.version,
+                'bases_en_cache': len(self._bases),
+                'max_bases': self.max_bases,
+                'base_hits': self.base_hits,
+                'base_misses': self.base_misses,
+                'base_hit_rate': self.base_hits / total if total > 0 else 0
+            }
+
+    def clear(self):
+        """Vacía la caché de vectores base."""
+        with self.lock:
+            self._bases.clear()
+            self.base_hits = 0
+            self.base_misses = 0
+
+
+# Instancia global del motor de embeddings
+embedding_engine = EmbeddingEngine()
@@ -3,6 +3,9 @@ Pool de Embeddings Optimizado para Krystal AI
 Gestiona embeddings pre-calculados y optimiza el uso de memoria.
 """
 
+import atexit
+import heapq
+import sys
 import threading
 import time
 from typing import Dict, List, Optional, Set, Tuple
@@ -10,137 +13,289 @@ from collections import defaultdict
 import pickle
 import os
 import math
-from .cache_manager import cache_manager
+import numpy as np
+from .embedding_engine import embedding_engine
+from .embedding_store import EmbeddingStore, WriteBehindQueue, DURABILITY_ASYNC, hash_clave
+from .disk_budget import DiskBudgetManager
+from .eviction import create_policy, entry_size
+from .matriz_vectores import MatrizCuantizada, MatrizNormalizada
+from .precompute import precompute_embeddings
 
 
-class EmbeddingPool:
-    """Pool optimizado para gestión de embeddings con lazy loading y compresión."""
+class _PoolShard:
+    """Partición del pool: sus embeddings residentes, su presupuesto y su propio lock.
     
-    def __init__(self, cache_dir: str = "cache/embeddings", max_memory_mb: int = 512):
-        self.cache_dir = cache_dir
-        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+    Tiene dos niveles en memoria: caliente (float32 exacto) y tibio (8 bits,
+    sólo para búsquedas por similitud). Lo que no cabe en ninguno queda frío,
+    en el almacén en disco. Las entradas se degradan al ser expulsadas de un
+    nivel y se promueven al acumular accesos.
+    """
+    
+    def __init__(self, max_memory_bytes: int, eviction_policy: str,
+                 hot_fraction: float = 0.25, promote_after: int = 2):
+        self.max_memory_bytes = max_memory_bytes
+        self.hot_budget = int(max_memory_bytes * hot_fraction)
+        self.warm_budget = max_memory_bytes - self.hot_budget
+        self.promote_after = promote_after
+        self.lock = threading.RLock()
         
-        # Almacenamiento en memoria
-        self.embeddings: Dict[str, List[float]] = {}
+        # Nivel caliente: vectores float32 residentes y metadata conocida
+        self.embeddings: Dict[str, np.ndarray] = {}
         self.metadata: Dict[str, Dict] = {}
         
-        # Estadísticas y control
+        # Nivel tibio: clave -> dimensión; los códigos viven en warm_matrices
+        self.warm: Dict[str, int] = {}
+        self.warm_hits: Dict[str, int] = {}
+        
+        # Estadísticas de acceso (se actualizan sin lock: son orientativas)
         self.access_count: Dict[str, int] = defaultdict(int)
         self.last_access: Dict[str, float] = {}
-        self.memory_usage = 0
+        self.hot_usage = 0
+        self.warm_usage = 0
         
-        # Threading
-        self.lock = threading.RLock()
+        # Expulsión: política O(1) por acceso y tamaño real en bytes de cada entrada
+        self.eviction = create_policy(eviction_policy)
+        self.warm_eviction = create_policy(eviction_policy)
+        self.entry_sizes: Dict[str, int] = {}
+        self.warm_sizes: Dict[str, int] = {}
+        # Copia unitaria de los residentes por dimensión, para búsquedas vectorizadas
+        self.similarity_matrices: Dict[int, MatrizNormalizada] = {}
+        self.warm_matrices: Dict[int, MatrizCuantizada] = {}
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.eviction_runs = 0
+        self.promotions = 0
+        self.demotions = 0
+    
+    @property
+    def memory_usage(self) -> int:
+        return self.hot_usage + self.warm_usage
+    
+    def record_access(self, key: str):
+        """Anota un acceso; la recencia de la política sólo se toca si el lock está libre."""
+        self.access_count[key] += 1
+        self.last_access[key] = time.time()
+        if self.lock.acquire(blocking=False):
+            try:
+                self.eviction.touch(key)
+            finally:
+                self.lock.release()
+    
+    def record_warm_access(self, key: str, embedding: np.ndarray):
+        """Anota un acierto tibio y promueve la entrada si ya es frecuente (con el lock tomado)."""
+        if key not in self.warm:
+            return
+        self.warm_eviction.touch(key)
+        self.warm_hits[key] = self.warm_hits.get(key, 0) + 1
+        if self.warm_hits[key] >= self.promote_after:
+            self.promotions += 1
+            self.add_resident(key, embedding)
+    
+    def add_resident(self, key: str, embedding: np.ndarray):
+        """Registra un embedding en el nivel caliente, degradando otros si no cabe (con el lock tomado)."""
+        self.remove_resident(key)
+        # Incluye la fila que ocupa en la matriz de similitud
+        size = entry_size(key, embedding) + embedding.nbytes
+        if self.hot_usage + size > self.hot_budget:
+            self.evict_least_used()
+        
+        self.embeddings[key] = embedding
+        self.entry_sizes[key] = size
+        self.hot_usage += size
+        self.eviction.insert(key)
+        
+        dim = embedding.shape[0]
+        if dim not in self.similarity_matrices:
+            self.similarity_matrices[dim] = MatrizNormalizada(dim)
+        self.similarity_matrices[dim].agregar(key, embedding)
+    
+    def add_warm(self, key: str, embedding: np.ndarray):
+        """Registra un embedding cuantizado en el nivel tibio, expulsando a disco si no cabe."""
+        self.remove_resident(key)
+        dim = embedding.shape[0]
+        size = sys.getsizeof(key) + MatrizCuantizada.bytes_por_fila(dim)
+        if self.warm_usage + size > self.warm_budget:
+            self.evict_warm()
+        
+        if dim not in self.warm_matrices:
+            self.warm_matrices[dim] = MatrizCuantizada(dim)
+        self.warm_matrices[dim].agregar(key, embedding)
+        self.warm[key] = dim
+        self.warm_sizes[key] = size
+        self.warm_usage += size
+        self.warm_eviction.insert(key)
+    
+    def remove_resident(self, key: str):
+        """Libera de memoria un embedding de cualquier nivel (sigue persistido en el almacén)."""
+        if key in self.embeddings:
+            dim = self.embeddings.pop(key).shape[0]
+            self.hot_usage -= self.entry_sizes.pop(key)
+            self.eviction.remove(key)
+            self.similarity_matrices[dim].eliminar(key)
+        if key in self.warm:
+            dim = self.warm.pop(key)
+            self.warm_usage -= self.warm_sizes.pop(key)
+            self.warm_hits.pop(key, None)
+            self.warm_eviction.remove(key)
+            self.warm_matrices[dim].eliminar(key)
+    
+    def demote(self, key: str):
+        """Pasa una entrada caliente al nivel tibio."""
+        embedding = self.embeddings.get(key)
+        if embedding is None:
+            return
+        if self.warm_budget <= 0:
+            # Sin nivel tibio: la entrada pasa directamente a disco
+            self.evicted_bytes += self.entry_sizes[key]
+            self.evictions += 1
+            self.remove_resident(key)
+            return
+        self.demotions += 1
+        self.add_warm(key, embedding)
+    
+    def evict_least_used(self):
+        """Degrada entradas calientes según la política hasta liberar el 25% de su presupuesto."""
+        target_memory = self.hot_budget * 0.75
+        self.eviction_runs += 1
+        
+        while self.hot_usage > target_memory:
+            key = self.eviction.victim()
+            if key is None:
+                break
+            self.demote(key)
+    
+    def evict_warm(self):
+        """Expulsa a disco entradas tibias hasta liberar el 25% de su presupuesto."""
+        target_memory = self.warm_budget * 0.75
+        self.eviction_runs += 1
+        
+        while self.warm_usage > target_memory:
+            key = self.warm_eviction.victim()
+            if key is None:
+                break
+            
+            # Ya está persistido en el almacén: basta con liberarlo de memoria
+            self.evicted_bytes += self.warm_sizes.get(key, 0)
+            self.evictions += 1
+            self.remove_resident(key)
+
+
+class EmbeddingPool:
+    """Pool optimizado para gestión de embeddings con lazy loading y compresión.
+    
+    Los embeddings residentes se reparten en particiones por hash de la clave,
+    cada una con su lock; los aciertos en memoria no toman ningún lock.
+    """
+    
+    def __init__(self, cache_dir: str = "cache/embeddings", max_memory_mb: int = 512,
+                 durability: str = DURABILITY_ASYNC, eviction_policy: str = 'blend',
+                 num_shards: int = 16, hot_fraction: float = 0.25, promote_after: int = 2,
+                 max_disk_mb: Optional[int] = None):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+        
+        # Particiones con presupuesto de memoria y lock propios. hot_fraction es la
+        # parte del presupuesto para float32 exactos; el resto, para el nivel de 8 bits.
+        self.shards = [_PoolShard(self.max_memory_bytes // num_shards, eviction_policy,
+                                  hot_fraction=hot_fraction, promote_after=promote_after)
+                       for _ in range(num_shards)]
+        self.eviction_policy = eviction_policy
         
         # Configuración
-        self.compression_enabled = True
+        self.compression_enabled = hot_fraction < 1.0
         self.lazy_loading = True
         
+        # Versión del algoritmo con el que se calcularon los embeddings persistidos
+        self.embedding_version = embedding_engine.version
+        
         # Crear directorio de caché si no existe
         os.makedirs(cache_dir, exist_ok=True)
         
+        # Almacén en disco: un archivo de vectores mapeado en memoria + índice compacto.
+        # Se invalida solo si fue generado con otra versión del algoritmo.
+        self.store = EmbeddingStore(cache_dir, version=self.embedding_version)
+        self._migrate_legacy_pickles()
+        
+        # Escrituras a disco fuera del lock del pool, combinadas y en lotes
+        self.write_queue = WriteBehindQueue(self.store, durability=durability)
+        atexit.register(self.close)
+        
+        # Límite opcional de bytes en disco, gestionado en segundo plano
+        self.disk_manager: Optional[DiskBudgetManager] = None
+        if max_disk_mb is not None:
+            self.disk_manager = DiskBudgetManager(self, max_disk_mb * 1024 * 1024)
+            self.disk_manager.start()
+        
         # Cargar embeddings persistentes
         self._load_persistent_embeddings()
     
-    def _get_cache_path(self, key: str) -> str:
-        """Obtiene la ruta del archivo de caché para una clave."""
-        safe_key = key.replace('/', '_').replace('\\', '_')
-        return os.path.join(self.cache_dir, f"{safe_key}.pkl")
-    
-    def _load_persistent_embeddings(self):
-        """Carga embeddings persistentes desde disco."""
-        if not os.path.exists(self.cache_dir):
+    def _migrate_legacy_pickles(self):
+        """Migra al almacén los embeddings guardados como un .pkl por clave."""
+        legacy_files = [f for f in os.listdir(self.cache_dir) if f.endswith('.pkl')]
+        if not legacy_files:
             return
         
-        for filename in os.listdir(self.cache_dir):
-            if filename.endswith('.pkl'):
-                try:
-                    filepath = os.path.join(self.cache_dir, filename)
-                    with open(filepath, 'rb') as f:
-                        data = pickle.load(f)
-                        key = filename[:-4]  # Remover .pkl
-                        
-                        if 'embedding' in data and 'metadata' in data:
-                            # No cargar en memoria inmediatamente si lazy loading está habilitado
-                            if not self.lazy_loading:
-                                self.embeddings[key] = data['embedding']
-                                self.memory_usage += len(data['embedding']) * 4 # Approximation
-                            
-                            self.metadata[key] = data['metadata']
-                            
-                except Exception as e:
-                    print(f"Error cargando embedding {filename}: {e}")
-    
-    def _save_to_disk(self, key: str, embedding: List[float], metadata: Dict):
-        """Guarda un embedding a disco."""
-        try:
-            filepath = self._get_cache_path(key)
-            
-            compressed_embedding = None
-            is_compressed = False
-            if self.compression_enabled:
-                compressed_embedding = self._compress_embedding(embedding)
-                is_compressed = True
+        migrated_count = 0
+        for filename in legacy_files:
+            filepath = os.path.join(self.cache_dir, filename)
+            try:
+                with open(filepath, 'rb') as f:
+                    data = pickle.load(f)
                 
-            data = {
-                'embedding': compressed_embedding if is_compressed else embedding,
-                'metadata': metadata,
-                'timestamp': time.time(),
-                'compressed': is_compressed # Add compression flag
-            }
-            
-            with open(filepath, 'wb') as f:
-                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+                embedding_data = data.get('embedding')
+                if data.get('embedding_version') == self.embedding_version and embedding_data is not None:
+                    if data.get('compressed', False):
+                        embedding_data = self._decompress_embedding(embedding_data)
+                    self.store.put(filename[:-4], embedding_data, data.get('metadata', {}))
+                    migrated_count += 1
                 
-        except Exception as e:
-            print(f"Error guardando embedding {key}: {e}")
+                os.remove(filepath)
+            except Exception as e:
+                print(f"Error migrando embedding {filename}: {e}")
+        
+        legacy_meta = os.path.join(self.cache_dir, "pool_meta.json")
+        if os.path.exists(legacy_meta):
+            os.remove(legacy_meta)
+        
+        self.store.merge()
+        print(f"Migrados {migrated_count} de {len(legacy_files)} embeddings al almacén único.")
     
-    def _load_from_disk(self, key: str) -> Optional[List[float]]:
-        """Carga un embedding desde disco."""
+    def _load_persistent_embeddings(self):
+        """Carga embeddings persistentes desde disco.
+        
+        Con lazy loading no se lee nada: el almacén se consulta bajo demanda.
+        """
+        if self.lazy_loading:
+            return
+        
+        for key in self.store.keys():
+            embedding = self.store.get(key)
+            if embedding is not None:
+                shard = self._shard(key)
+                with shard.lock:
+                    shard.add_resident(key, embedding)
+    
+    def _save_to_disk(self, key: str, embedding: np.ndarray, metadata: Dict):
+        """Guarda un embedding a disco (a través de la cola write-behind)."""
+        self.write_queue.put(key, embedding, metadata)
+    
+    def is_persisted(self, key: str) -> bool:
+        """Indica si la clave está en disco o pendiente de escribirse."""
+        return key in self.write_queue or key in self.store
+    
+    def _load_from_disk(self, key: str) -> Optional[np.ndarray]:
+        """Carga un embedding desde disco como vista de sólo lectura (sin copia)."""
         try:
-            filepath = self._get_cache_path(key)
-            if not os.path.exists(filepath):
-                return None
-            
-            with open(filepath, 'rb') as f:
-                data = pickle.load(f)
-                
-                embedding_data = data.get('embedding')
-                is_compressed = data.get('compressed', False) # Check for compression flag
-
-                if is_compressed and embedding_data is not None:
-                    return self._decompress_embedding(embedding_data)
-                elif embedding_data is not None:
-                    return embedding_data
-                else:
-                    return None
-                
+            pending = self.write_queue.get(key)
+            if pending is not None:
+                return pending[0]
+            return self.store.get(key)
         except Exception as e:
             print(f"Error cargando embedding {key} desde disco: {e}")
             return None
 
-    def _compress_embedding(self, embedding: List[float]) -> Tuple[float, float, List[int]]:
-        """Comprime un embedding usando cuantización simple."""
-        if not embedding:
-            return 0.0, 0.0, []
-
-        min_val = min(embedding)
-        max_val = max(embedding)
-        
-        # Avoid division by zero if all values are the same
-        if math.isclose(min_val, max_val):
-             # If all values are the same, store the value and a list of zeros
-            quantized_embedding = [0] * len(embedding)
-            return min_val, max_val, quantized_embedding
-
-        # Scale values to 0-255 range and convert to integers
-        scale = 255.0 / (max_val - min_val)
-        quantized_embedding = [int((val - min_val) * scale) for val in embedding]
-
-        return min_val, max_val, quantized_embedding
-
     def _decompress_embedding(self, compressed_embedding: Tuple[float, float, List[int]]) -> List[float]:
-        """Descomprime un embedding cuantizado."""
+        """Descomprime un embedding cuantizado con el formato .pkl antiguo (sólo para migrar)."""
         min_val, max_val, quantized_embedding = compressed_embedding
         
         if not quantized_embedding:
@@ -157,245 +312,302 @@ class EmbeddingPool:
 
         return embedding
 
-    def _evict_least_used(self):
-        """Expulsa embeddings menos usados para liberar memoria."""
-        if not self.embeddings:
-            return
-        
-        # Ordenar por frecuencia de acceso y tiempo de último acceso
-        items = []
-        current_time = time.time()
+    def _shard(self, key: str) -> _PoolShard:
+        return self.shards[hash(key) % len(self.shards)]
+    
+    @property
+    def embeddings(self) -> Dict[str, np.ndarray]:
+        """Vista combinada (copia) de los embeddings residentes de todas las particiones."""
+        combined = {}
+        for shard in self.shards:
+            combined.update(shard.embeddings)
+        return combined
+    
+    @property
+    def memory_usage(self) -> int:
+        return sum(shard.memory_usage for shard in self.shards)
+    
+    def access_snapshot(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Hashes de almacén y último acceso de las claves con estadísticas, y hashes residentes."""
+        keys, times, resident = [], [], []
+        for shard in self.shards:
+            with shard.lock:
+                keys.extend(shard.last_access.keys())
+                times.extend(shard.last_access.values())
+                resident.extend(shard.embeddings.keys())
+                resident.extend(shard.warm.keys())
+        return (np.fromiter((hash_clave(k) for k in keys), dtype=np.uint64, count=len(keys)),
+                np.asarray(times, dtype=np.float64),
+                np.fromiter((hash_clave(k) for k in resident), dtype=np.uint64, count=len(resident)))
+    
+    def prune_access_stats(self, max_age_seconds: float, shard_index: Optional[int] = None) -> int:
+        """Olvida las estadísticas de acceso de claves no residentes que ya no están en
+        disco o llevan más de `max_age_seconds` sin usarse. Devuelve cuántas se podaron."""
+        shards = self.shards if shard_index is None else [self.shards[shard_index]]
+        limit = time.time() - max_age_seconds
+        pruned = 0
+        for shard in shards:
+            with shard.lock:
+                stale = [key for key in list(shard.access_count)
+                         if key not in shard.embeddings and key not in shard.warm
+                         and (shard.last_access.get(key, 0) < limit or not self.is_persisted(key))]
+                for key in stale:
+                    shard.access_count.pop(key, None)
+                    shard.last_access.pop(key, None)
+                    shard.metadata.pop(key, None)
+                pruned += len(stale)
+        return pruned
+    
+    @staticmethod
+    def _freeze(embedding) -> np.ndarray:
+        """Vector float32 de sólo lectura; sólo copia si el original es mutable o de otro tipo."""
+        if isinstance(embedding, np.ndarray) and embedding.dtype == np.float32 \
+                and not embedding.flags.writeable:
+            return embedding
+        vector = np.array(embedding, dtype=np.float32)
+        vector.flags.writeable = False
+        return vector
+    
+    def get_embedding(self, key: str) -> Optional[np.ndarray]:
+        """Obtiene un embedding del pool.
         
-        for key in self.embeddings:
-            access_count = self.access_count[key]
-            last_access = self.last_access.get(key, 0)
-            age = current_time - last_access
-            
-            # Score más bajo = menos importante
-            score = access_count / (1 + age / 3600)  # Penalizar por edad en horas
-            items.append((score, key))
+        Devuelve un array float32 de sólo lectura que comparte el buffer del
+        pool (o del archivo mapeado); quien necesite modificarlo debe copiarlo.
+        """
+        shard = self._shard(key)
         
-        # Ordenar por score ascendente
-        items.sort()
+        # Acierto en memoria: lectura del diccionario sin lock
+        embedding = shard.embeddings.get(key)
+        if embedding is not None:
+            shard.record_access(key)
+            return embedding
         
-        # Expulsar hasta liberar 25% de la memoria
-        target_memory = self.max_memory_bytes * 0.75
+        # Nivel tibio o frío: el vector exacto es una vista del archivo mapeado.
+        # Los fallos no dejan estadísticas: sólo se cuentan claves existentes.
+        if key in shard.warm or (self.lazy_loading and self.is_persisted(key)):
+            embedding = self._load_from_disk(key)
+            if embedding is not None:
+                with shard.lock:
+                    shard.access_count[key] += 1
+                    shard.last_access[key] = time.time()
+                    # Otro hilo pudo almacenar una versión más nueva mientras leíamos
+                    if key in shard.embeddings:
+                        embedding = shard.embeddings[key]
+                    elif key in shard.warm:
+                        shard.record_warm_access(key, embedding)
+                    else:
+                        # Entra por el nivel tibio; se promueve si se sigue usando
+                        shard.add_warm(key, embedding)
+                        shard.warm_hits[key] = 1
+                return embedding
         
-        for score, key in items:
-            if self.memory_usage <= target_memory:
-                break
-            
-            # Guardar a disco antes de expulsar
-            if key in self.embeddings:
-                self._save_to_disk(key, self.embeddings[key], self.metadata.get(key, {}))
-                
-                # Approximate memory usage of the compressed embedding if compression is enabled
-                if self.compression_enabled:
-                    # Rough approximation: size of list of ints + size of two floats
-                    compressed_size_approx = len(self.embeddings[key]) * 1 + 16
-                    self.memory_usage -= compressed_size_approx
-                else:
-                    self.memory_usage -= len(self.embeddings[key]) * 4 # Original Approximation
-                    
-                del self.embeddings[key]
-    
-    def get_embedding(self, key: str) -> Optional[List[float]]:
-        """Obtiene un embedding del pool."""
-        with self.lock:
-            # Actualizar estadísticas de acceso
-            self.access_count[key] += 1
-            self.last_access[key] = time.time()
-            
-            # Si está en memoria, devolverlo
-            if key in self.embeddings:
-                return self.embeddings[key][:] # Return a copy
-            
-            # Si lazy loading está habilitado, intentar cargar desde disco
-            if self.lazy_loading and key in self.metadata:
-                embedding = self._load_from_disk(key)
-                if embedding is not None:
-                    # Approximate memory usage of the decompressed embedding
-                    embedding_size_approx = len(embedding) * 4 # Approximation for decompressed size
-
-                    # Verificar si hay espacio en memoria
-                    if self.memory_usage + embedding_size_approx > self.max_memory_bytes:
-                        self._evict_least_used()
-                    
-                    self.embeddings[key] = embedding[:] # Store a copy
-                    self.memory_usage += embedding_size_approx # Approximation
-                    return embedding[:] # Return a copy
-            
-            return None
+        return None
     
-    def store_embedding(self, key: str, embedding: List[float], metadata: Dict = None):
-        """Almacena un embedding en el pool."""
-        with self.lock:
-            if metadata is None:
-                metadata = {}
-            
-            if not isinstance(embedding, list):
-                raise ValueError("Embedding must be a list")
-            
-            # Approximate memory usage based on compression
-            if self.compression_enabled:
-                 # Rough approximation: size of list of ints + size of two floats
-                embedding_size_approx = len(embedding) * 1 + 16
-            else:
-                embedding_size_approx = len(embedding) * 4 # Original Approximation
-
-            # Verificar espacio en memoria
-            if self.memory_usage + embedding_size_approx > self.max_memory_bytes:
-                self._evict_least_used()
-            
+    def get_metadata(self, key: str) -> Optional[Dict]:
+        """Obtiene la metadata de un embedding (de memoria o del almacén)."""
+        metadata = self._shard(key).metadata.get(key)
+        if metadata is not None:
+            return metadata
+        pending = self.write_queue.get(key)
+        if pending is not None:
+            return pending[1]
+        return self.store.get_metadata(key)
+    
+    def store_embedding(self, key: str, embedding, metadata: Dict = None) -> np.ndarray:
+        """Almacena un embedding en el pool y devuelve la vista de sólo lectura guardada.
+        
+        Acepta una lista o un array; un array float32 de sólo lectura se guarda sin copiarlo.
+        """
+        if metadata is None:
+            metadata = {}
+        
+        if not isinstance(embedding, (list, np.ndarray)):
+            raise ValueError("Embedding must be a list or numpy array")
+        
+        vector = self._freeze(embedding)
+        
+        shard = self._shard(key)
+        with shard.lock:
             # Almacenar en memoria
-            self.embeddings[key] = embedding[:] # Store a copy
-            self.metadata[key] = metadata
-            self.memory_usage += embedding_size_approx
+            shard.add_resident(key, vector)
+            shard.metadata[key] = metadata
             
             # Actualizar estadísticas
-            self.access_count[key] = 1
-            self.last_access[key] = time.time()
+            shard.access_count[key] = 1
+            shard.last_access[key] = time.time()
             
-            # Guardar a disco para persistencia
-            self._save_to_disk(key, embedding, metadata)
+            # Guardar a disco para persistencia (en orden con otras escrituras de la clave)
+            self._save_to_disk(key, vector, metadata)
+        
+        return vector
+    
+    def store_embeddings_bulk(self, keys: List[str], matrix: np.ndarray,
+                              metadata: List[Dict], resident: bool = False):
+        """Almacena en bloque las filas de una matriz (una por clave).
+        
+        La persistencia se encola de una vez. Con resident=False (carga masiva)
+        sólo se actualizan en memoria las claves que ya estaban residentes; el
+        resto se leerá del almacén bajo demanda.
+        """
+        matrix = self._freeze(matrix)
+        
+        by_shard: Dict[int, List[int]] = defaultdict(list)
+        for row, key in enumerate(keys):
+            by_shard[hash(key) % len(self.shards)].append(row)
+        
+        for shard_index, rows in by_shard.items():
+            shard = self.shards[shard_index]
+            with shard.lock:
+                for row in rows:
+                    key = keys[row]
+                    if resident or key in shard.embeddings:
+                        shard.add_resident(key, matrix[row])
+                        shard.metadata[key] = metadata[row]
+                    elif key in shard.warm:
+                        shard.add_warm(key, matrix[row])
+                        shard.metadata.pop(key, None)
+                    else:
+                        shard.metadata.pop(key, None)
+        
+        self.write_queue.put_many((keys[row], matrix[row], metadata[row]) for row in range(len(keys)))
     
     def precompute_common_embeddings(self, common_words: List[str],
-                                   embedding_func, dim: int = 64):
-        """Pre-calcula embeddings para palabras comunes."""
+                                   embedding_func=None, dim: int = 64, progress=None):
+        """Pre-calcula embeddings para palabras comunes.
+        
+        Sin embedding_func, las palabras faltantes se calculan en paralelo con
+        el pipeline de core/precompute.py. `progress(hechas, total)` informa del avance.
+        """
         print(f"Pre-calculando embeddings para {len(common_words)} palabras comunes...")
         
-        for i, word in enumerate(common_words):
-            if i % 100 == 0:
-                print(f"Progreso: {i}/{len(common_words)}")
-            
+        if embedding_func is None:
+            precompute_embeddings(common_words, dim=dim, pool=self, progress=progress)
+            print("Pre-cálculo completado.")
+            return
+        
+        # Solo calcular las que no existen
+        pendientes = [word for word in dict.fromkeys(common_words)
+                      if not self.is_persisted(f"word_{word}_{dim}")]
+        
+        for i, word in enumerate(pendientes):
             key = f"word_{word}_{dim}"
+            try:
+                embedding = embedding_func(word, dim)
+                if embedding is not None and len(embedding) > 0:
+                    metadata = {
+                        'word': word,
+                        'dimension': dim,
+                        'type': 'precomputed',
+                        'timestamp': time.time()
+                    }
+                    self.store_embedding(key, embedding, metadata)
+                    
+            except Exception as e:
+                print(f"Error pre-calculando embedding para '{word}': {e}")
             
-            # Solo calcular si no existe
-            if key not in self.metadata:
-                try:
-                    embedding = embedding_func(word, dim)
-                    if embedding:
-                        metadata = {
-                            'word': word,
-                            'dimension': dim,
-                            'type': 'precomputed',
-                            'timestamp': time.time()
-                        }
-                        self.store_embedding(key, embedding, metadata)
-                        
-                except Exception as e:
-                    print(f"Error pre-calculando embedding para '{word}': {e}")
+            if progress:
+                progress(i + 1, len(pendientes))
         
         print("Pre-cálculo completado.")
     
-    def get_similar_embeddings(self, target_embedding: List[float], 
+    def get_similar_embeddings(self, target_embedding, 
                                threshold: float = 0.8, max_results: int = 10) -> List[Tuple[str, float]]:
-        """Encuentra embeddings similares en el pool."""
-        if not isinstance(target_embedding, list):
-            raise ValueError("Target embedding must be a list")
-        
-        results = []
-        
-        with self.lock:
-            for key, embedding in self.embeddings.items():
-                # Calcular similitud coseno
-                similarity = self._cosine_similarity(target_embedding, embedding)
-                
-                if similarity >= threshold:
-                    results.append((key, similarity))
-        
-        # Ordenar por similitud descendente
-        results.sort(key=lambda x: x[1], reverse=True)
-        return results[:max_results]
-    
-    def _cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
-        """Calcula similitud coseno entre dos vectores."""
-        # Verificar en caché primero
-        cached = cache_manager.get_similarity(vec1, vec2)
-        if cached is not None:
-            return cached
-        
-        # Calcular similitud
-        dot_product = sum(x * y for x, y in zip(vec1, vec2))
-        norm1 = math.sqrt(sum(x * x for x in vec1))
-        norm2 = math.sqrt(sum(x * x for x in vec2))
+        """Encuentra embeddings similares en el pool.
         
-        if norm1 == 0 or norm2 == 0:
-            similarity = 0.0
-        else:
-            similarity = dot_product / (norm1 * norm2)
+        Un único producto matriz-vector sobre los residentes normalizados
+        más una selección parcial de los mejores resultados.
+        """
+        if not isinstance(target_embedding, (list, np.ndarray)):
+            raise ValueError("Target embedding must be a list or numpy array")
         
-        # Cachear resultado
-        cache_manager.cache_similarity(vec1, vec2, similarity)
+        results = []
+        for shard in self.shards:
+            with shard.lock:
+                # Exacto en el nivel caliente, aproximado (8 bits) en el tibio
+                for matrices in (shard.similarity_matrices, shard.warm_matrices):
+                    matrix = matrices.get(len(target_embedding))
+                    if matrix is not None:
+                        results.extend(matrix.mas_similares(target_embedding, k=max_results,
+                                                            umbral=threshold))
         
-        return similarity
+        # Unir los mejores de cada partición
+        return heapq.nlargest(max_results, results, key=lambda x: x[1])
     
     def cleanup_old_embeddings(self, max_age_hours: int = 24):
         """Limpia embeddings antiguos del disco."""
-        current_time = time.time()
-        max_age_seconds = max_age_hours * 3600
+        self.write_queue.flush()
+        removed_count = self.store.delete_older_than(time.time() - max_age_hours * 3600)
         
-        removed_count = 0
-        
-        for filename in os.listdir(self.cache_dir):
-            if filename.endswith('.pkl'):
-                filepath = os.path.join(self.cache_dir, filename)
-                
-                try:
-                    # Verificar edad del archivo
-                    file_age = current_time - os.path.getmtime(filepath)
-                    
-                    if file_age > max_age_seconds:
-                        os.remove(filepath)
-                        removed_count += 1
-                        
-                        # También remover de memoria si está cargado
-                        key = filename[:-4]
-                        if key in self.embeddings:
-                            self.memory_usage -= len(self.embeddings[key]) * 4 # Approximation
-                            del self.embeddings[key]
-                        if key in self.metadata:
-                            del self.metadata[key]
-                            
-                except Exception as e:
-                    print(f"Error limpiando {filename}: {e}")
+        # También remover de memoria los que ya no están en disco
+        for shard in self.shards:
+            with shard.lock:
+                for key in [k for k in list(shard.embeddings) + list(shard.warm)
+                            if k not in self.store]:
+                    shard.remove_resident(key)
+                for key in [k for k in shard.metadata if k not in self.store]:
+                    del shard.metadata[key]
+        self.prune_access_stats(max_age_hours * 3600)
         
         print(f"Limpieza completada. Removidos {removed_count} embeddings antiguos.")
     
     def get_stats(self) -> Dict:
-        """Obtiene estadísticas del pool."""
-        with self.lock:
-            return {
-                'embeddings_in_memory': len(self.embeddings),
-                'embeddings_on_disk': len(self.metadata),
-                'memory_usage_mb': self.memory_usage / (1024 * 1024),
-                'max_memory_mb': self.max_memory_bytes / (1024 * 1024),
-                'memory_utilization': self.memory_usage / self.max_memory_bytes,
-                'cache_dir': self.cache_dir,
-                'compression_enabled': self.compression_enabled,
-                'lazy_loading': self.lazy_loading,
-                'total_accesses': sum(self.access_count.values())
-            }
+        """Obtiene estadísticas del pool (suma de particiones, sin lock global)."""
+        memory_usage = self.memory_usage
+        return {
+            'embeddings_in_memory': sum(len(shard.embeddings) + len(shard.warm) for shard in self.shards),
+            'hot_embeddings': sum(len(shard.embeddings) for shard in self.shards),
+            'warm_embeddings': sum(len(shard.warm) for shard in self.shards),
+            'hot_usage_mb': sum(shard.hot_usage for shard in self.shards) / (1024 * 1024),
+            'warm_usage_mb': sum(shard.warm_usage for shard in self.shards) / (1024 * 1024),
+            'promotions': sum(shard.promotions for shard in self.shards),
+            'demotions': sum(shard.demotions for shard in self.shards),
+            'embeddings_on_disk': len(self.store),
+            'disk_usage_mb': self.store.disk_usage() / (1024 * 1024),
+            'memory_usage_mb': memory_usage / (1024 * 1024),
+            'max_memory_mb': self.max_memory_bytes / (1024 * 1024),
+            'memory_utilization': memory_usage / self.max_memory_bytes,
+            'cache_dir': self.cache_dir,
+            'embedding_version': self.embedding_version,
+            'compression_enabled': self.compression_enabled,
+            'lazy_loading': self.lazy_loading,
+            'write_queue': self.write_queue.get_stats(),
+            'disk_budget': self.disk_manager.get_stats() if self.disk_manager else None,
+            'tracked_access_stats': sum(len(shard.access_count) for shard in self.shards),
+            'shards': len(self.shards),
+            'eviction_policy': self.eviction_policy,
+            'evictions': sum(shard.evictions for shard in self.shards),
+            'evicted_mb': sum(shard.evicted_bytes for shard in self.shards) / (1024 * 1024),
+            'eviction_runs': sum(shard.eviction_runs for shard in self.shards),
+            'total_accesses': sum(sum(shard.access_count.values()) for shard in self.shards)
+        }
     
     def optimize(self):
         """Optimiza el pool liberando memoria y limpiando caché."""
-        with self.lock:
-            # Limpiar embeddings no accedidos recientemente
-            current_time = time.time()
-            to_remove = []
-            
-            for key in self.embeddings:
-                last_access = self.last_access.get(key, 0)
-                if current_time - last_access > 3600:  # 1 hora sin acceso
-                    to_remove.append(key)
-            
-            for key in to_remove:
-                self._save_to_disk(key, self.embeddings[key], self.metadata.get(key, {}))
-                self.memory_usage -= len(self.embeddings[key]) * 4 # Approximation
-                del self.embeddings[key]
-            
-            print(f"Optimización completada. Liberados {len(to_remove)} embeddings de memoria.")
-
+        # Limpiar embeddings no accedidos recientemente
+        current_time = time.time()
+        removed = 0
+        
+        for shard in self.shards:
+            with shard.lock:
+                to_remove = [key for key in shard.embeddings
+                             if current_time - shard.last_access.get(key, 0) > 3600]  # 1 hora sin acceso
+                for key in to_remove:
+                    # Pasa al nivel de 8 bits: sigue disponible para búsquedas por similitud
+                    shard.demote(key)
+                removed += len(to_remove)
+        
+        print(f"Optimización completada. Degradados {removed} embeddings a 8 bits.")
+    
+    def flush(self):
+        """Vuelca a disco las escrituras pendientes."""
+        self.write_queue.flush()
+    
+    def close(self):
+        """Vuelca lo pendiente y cierra el almacén (se llama también al salir)."""
+        if self.disk_manager is not None:
+            self.disk_manager.stop()
+        self.write_queue.close()
+        self.store.close()
 
 # Instancia global del pool de embeddings
-embedding_pool = EmbeddingPool()
\ No newline at end of file
+embedding_pool = EmbeddingPool()
@@ -0,0 +1,611 @@
+"""
+Almacén de Embeddings en Disco para Krystal AI
+Un único archivo de vectores append-only mapeado en memoria y un índice compacto clave -> offset.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+
+# Registro del índice: hash de la clave, posición del vector y de su metadata.
+# length < 0 marca una clave borrada (tombstone).
+REGISTRO_DTYPE = np.dtype([
+    ('hash', '<u8'),
+    ('offset', '<i8'),
+    ('length', '<i4'),
+    ('meta_offset', '<i8'),
+    ('meta_length', '<i4'),
+    ('timestamp', '<f8'),
+])
+
+_PREFIJO_META = struct.Struct('<I')
+
+
+def hash_clave(key: str) -> int:
+    """Hash estable de 64 bits de una clave (no depende del proceso)."""
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8, person=b'krystal-store').digest()
+    return int.from_bytes(digest, 'little')
+
+
+class EmbeddingStore:
+    """Almacén persistente de embeddings float32 con lecturas sin copia.
+
+    Archivos dentro de `directorio`:
+    - vectors.f32: vectores float32 concatenados (append-only, mapeado con mmap).
+    - metadata.log: metadata de cada entrada (pickle con prefijo de longitud, append-only).
+    - index.bin: registros ordenados por hash, mapeados con np.memmap (búsqueda binaria).
+    - index.log: registros añadidos desde la última fusión; se fusionan con index.bin
+      al superar `max_log_entries`, así el arranque no depende del total en disco.
+    - store_meta.json: versión del algoritmo de embedding, número de entradas y
+      generación actual. `compact()` escribe una generación nueva de los archivos
+      (vectors.<n>.f32, ...) y sólo la activa al reescribir store_meta.json, así
+      una compactación interrumpida no deja el almacén inconsistente.
+    """
+
+    def __init__(self, directorio: str, version: str = "", max_log_entries: int = 65536):
+        self.directorio = directorio
+        self.version = version
+        self.max_log_entries = max_log_entries
+
+        self.meta_path = os.path.join(directorio, "store_meta.json")
+
+        self.lock = threading.RLock()
+
+        os.makedirs(directorio, exist_ok=True)
+        self.generation = 0
+        self._count = self._check_version()
+        self._remove_other_generations()
+
+        # Archivos append-only
+        self._vec_file = open(self.vectors_path, 'ab')
+        self._meta_file = open(self.metadata_path, 'ab')
+        self._log_file = open(self.log_path, 'ab')
+        self._meta_reader = open(self.metadata_path, 'rb')
+
+        # Vistas mapeadas en memoria
+        self._mm: Optional[mmap.mmap] = None
+        self._indice = self._map_index()
+
+        # Registros pendientes de fusionar: hash -> tupla (offset, length, meta_offset, meta_length, timestamp)
+        self._log: Dict[int, Tuple[int, int, int, int, float]] = {}
+        self._replay_log()
+
+    # --- Inicialización ---------------------------------------------------
+
+    def _generation_paths(self, generation: int) -> Tuple[str, str, str, str]:
+        """Rutas (vectores, metadata, índice, log) de una generación de archivos."""
+        sufijo = "" if generation == 0 else f".{generation}"
+        return tuple(os.path.join(self.directorio, nombre) for nombre in
+                     (f"vectors{sufijo}.f32", f"metadata{sufijo}.log",
+                      f"index{sufijo}.bin", f"index{sufijo}.log"))
+
+    def _set_generation(self, generation: int):
+        self.generation = generation
+        (self.vectors_path, self.metadata_path,
+         self.index_path, self.log_path) = self._generation_paths(generation)
+
+    def _remove_other_generations(self):
+        """Borra restos de generaciones anteriores o de una compactación interrumpida."""
+        actuales = set(self._generation_paths(self.generation))
+        for nombre in os.listdir(self.directorio):
+            path = os.path.join(self.directorio, nombre)
+            if (nombre.startswith(('vectors', 'metadata', 'index'))
+                    and nombre.endswith(('.f32', '.log', '.bin', '.tmp')) and path not in actuales):
+                os.remove(path)
+
+    def _check_version(self) -> int:
+        """Devuelve el número de entradas guardado; vacía el almacén si la versión no coincide."""
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                header = json.load(f)
+        except (OSError, ValueError):
+            header = None
+
+        self._set_generation(int(header.get('generation', 0)) if header else 0)
+        if header is not None and header.get('embedding_version') == self.version:
+            return int(header.get('count', 0))
+
+        if header is not None or os.path.exists(self.vectors_path):
+            print(f"Versión de embedding cambiada ({header and header.get('embedding_version')} -> "
+                  f"{self.version}). Invalidando almacén de embeddings.")
+        self._set_generation(0)
+        for path in (self.vectors_path, self.metadata_path, self.index_path, self.log_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._write_header(0)
+        return 0
+
+    def _write_header(self, count: int, generation: Optional[int] = None):
+        """Guarda versión, número de entradas y generación de forma atómica."""
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'embedding_version': self.version, 'count': count,
+                       'generation': self.generation if generation is None else generation}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.meta_path)
+
+    def _map_index(self) -> np.ndarray:
+        """Mapea el índice compacto en memoria (sin leerlo)."""
+        if not os.path.exists(self.index_path) or os.path.getsize(self.index_path) == 0:
+            return np.zeros(0, dtype=REGISTRO_DTYPE)
+        return np.memmap(self.index_path, dtype=REGISTRO_DTYPE, mode='r')
+
+    def _replay_log(self):
+        """Aplica los registros aún no fusionados (acotados por max_log_entries)."""
+        with open(self.log_path, 'rb') as f:
+            data = f.read()
+
+        # Descartar un registro final incompleto (escritura interrumpida)
+        completos = len(data) // REGISTRO_DTYPE.itemsize * REGISTRO_DTYPE.itemsize
+        if completos != len(data):
+            self._log_file.truncate(completos)
+
+        registros = np.frombuffer(data[:completos], dtype=REGISTRO_DTYPE)
+        count = self._count
+        for r in registros.tolist():
+            h = r[0]
+            previo = self._buscar(h)
+            self._log[h] = r[1:]
+            count += (r[2] >= 0) - (previo is not None and previo[1] >= 0)
+        self._count = count
+
+    # --- Búsqueda -----------------------------------------------------------
+
+    def _buscar(self, h: int) -> Optional[Tuple[int, int, int, int, float]]:
+        """Busca el registro más reciente de un hash: primero en el log, luego en el índice."""
+        registro = self._log.get(h)
+        if registro is not None:
+            return registro
+
+        indice = self._indice
+        if len(indice) == 0:
+            return None
+        hashes = indice['hash']
+        pos = int(np.searchsorted(hashes, np.uint64(h)))
+        if pos < len(indice) and int(hashes[pos]) == h:
+            return indice[pos].tolist()[1:]
+        return None
+
+    def _vista(self, offset: int, length: int) -> np.ndarray:
+        """Vista de sólo lectura sobre el archivo de vectores (sin copia)."""
+        if length == 0:
+            return np.zeros(0, dtype=np.float32)
+        fin = offset + length * 4
+        if self._mm is None or fin > len(self._mm):
+            self._remap()
+        return np.frombuffer(self._mm, dtype=np.float32, count=length, offset=offset)
+
+    def _remap(self):
+        """Vuelve a mapear el archivo de vectores tras nuevas escrituras."""
+        self._vec_file.flush()
+        if os.path.getsize(self.vectors_path) == 0:
+            return
+        with open(self.vectors_path, 'rb') as f:
+            # Las vistas entregadas mantienen vivo el mapeo anterior; no se cierra
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __contains__(self, key: str) -> bool:
+        registro = self._buscar(hash_clave(key))
+        return registro is not None and registro[1] >= 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Obtiene el vector de una clave como vista float32 de sólo lectura."""
+        with self.lock:
+            registro = self._buscar(hash_clave(key))
+            if registro is None or registro[1] < 0:
+                return None
+            return self._vista(registro[0], registro[1])
+
+    def get_metadata(self, key: str) -> Optional[Dict]:
+        """Obtiene la metadata de una clave."""
+        with self.lock:
+            registro = self._buscar(hash_clave(key))
+            if registro is None or registro[1] < 0:
+                return None
+            entrada = self._leer_metadata(registro[2], registro[3])
+            if entrada.get('key') != key:
+                return None  # Colisión de hash
+            return entrada.get('metadata', {})
+
+    def _leer_metadata(self, offset: int, length: int) -> Dict:
+        self._meta_file.flush()
+        self._meta_reader.seek(offset + _PREFIJO_META.size)
+        return pickle.loads(self._meta_reader.read(length))
+
+    def get_timestamp(self, key: str) -> Optional[float]:
+        """Momento en que se escribió la entrada."""
+        registro = self._buscar(hash_clave(key))
+        if registro is None or registro[1] < 0:
+            return None
+        return registro[4]
+
+    # --- Escritura ------------------------------------------------------------
+
+    def put(self, key: str, embedding, metadata: Optional[Dict] = None):
+        """Añade (o reemplaza) el vector de una clave."""
+        vector = np.ascontiguousarray(embedding, dtype=np.float32)
+        blob = pickle.dumps({'key': key, 'metadata': metadata or {}},
+                            protocol=pickle.HIGHEST_PROTOCOL)
+        h = hash_clave(key)
+
+        with self.lock:
+            offset = self._vec_file.tell()
+            self._vec_file.write(vector.tobytes())
+
+            meta_offset = self._meta_file.tell()
+            self._meta_file.write(_PREFIJO_META.pack(len(blob)))
+            self._meta_file.write(blob)
+
+            self._append_registro(h, (offset, len(vector), meta_offset, len(blob), time.time()))
+
+    def delete(self, key: str) -> bool:
+        """Borra una clave (tombstone). Devuelve True si existía."""
+        with self.lock:
+            if key not in self:
+                return False
+            self._append_registro(hash_clave(key), (0, -1, 0, 0, time.time()))
+            return True
+
+    def delete_older_than(self, timestamp: float) -> int:
+        """Borra las entradas escritas antes de `timestamp`. Devuelve cuántas se borraron."""
+        with self.lock:
+            viejos = [h for h, registro in self.registros() if registro[4] < timestamp]
+            ahora = time.time()
+            for h in viejos:
+                self._append_registro(h, (0, -1, 0, 0, ahora))
+            return len(viejos)
+
+    def _append_registro(self, h: int, registro: Tuple[int, int, int, int, float]):
+        previo = self._buscar(h)
+        existia = previo is not None and previo[1] >= 0
+        self._count += (registro[1] >= 0) - existia
+
+        fila = np.array([(h,) + registro], dtype=REGISTRO_DTYPE)
+        self._log_file.write(fila.tobytes())
+        self._log[h] = registro
+
+        if len(self._log) >= self.max_log_entries:
+            self.merge()
+
+    def flush(self, fsync: bool = False):
+        """Vacía los buffers de escritura al sistema operativo (y opcionalmente a disco)."""
+        with self.lock:
+            for f in (self._vec_file, self._meta_file, self._log_file):
+                f.flush()
+                if fsync:
+                    os.fsync(f.fileno())
+
+    def merge(self):
+        """Fusiona el log en el índice compacto ordenado."""
+        with self.lock:
+            self.flush()
+            if not self._log:
+                return
+
+            hashes_log = np.fromiter(self._log.keys(), dtype=np.uint64, count=len(self._log))
+            nuevos = np.array([(h,) + r for h, r in self._log.items() if r[1] >= 0],
+                              dtype=REGISTRO_DTYPE)
+
+            indice = np.asarray(self._indice)
+            conservados = indice[~np.isin(indice['hash'], hashes_log)]
+            fusionado = np.concatenate([conservados, nuevos])
+            fusionado.sort(order='hash')
+
+            tmp_path = self.index_path + ".tmp"
+            fusionado.tofile(tmp_path)
+            os.replace(tmp_path, self.index_path)
+            self._write_header(self._count)
+
+            self._indice = self._map_index()
+            self._log.clear()
+            self._log_file.truncate(0)
+            self._log_file.seek(0)
+
+    # --- Recorrido --------------------------------------------------------------
+
+    def registros(self) -> Iterator[Tuple[int, Tuple[int, int, int, int, float]]]:
+        """Recorre los registros vivos (hash, registro)."""
+        with self.lock:
+            log = dict(self._log)
+            indice = self._indice
+        for fila in indice.tolist():
+            if fila[0] not in log:
+                yield fila[0], fila[1:]
+        for h, registro in log.items():
+            if registro[1] >= 0:
+                yield h, registro
+
+    def live_records(self) -> np.ndarray:
+        """Registros vivos como array estructurado (REGISTRO_DTYPE), sin recorrerlos en Python."""
+        with self.lock:
+            indice = np.asarray(self._indice)
+            if self._log:
+                hashes_log = np.fromiter(self._log.keys(), dtype=np.uint64, count=len(self._log))
+                vivos_log = np.array([(h,) + r for h, r in self._log.items() if r[1] >= 0],
+                                   dtype=REGISTRO_DTYPE)
+                indice = np.concatenate([indice[~np.isin(indice['hash'], hashes_log)], vivos_log])
+            else:
+                indice = indice.copy()
+        return indice
+
+    @staticmethod
+    def record_bytes(registros: np.ndarray) -> np.ndarray:
+        """Bytes que ocupa en disco cada registro (vector, metadata e índice)."""
+        return (registros['length'].astype(np.int64) * 4 + registros['meta_length']
+                + _PREFIJO_META.size + REGISTRO_DTYPE.itemsize)
+
+    def dead_bytes(self) -> int:
+        """Bytes en disco ocupados por entradas borradas o reemplazadas."""
+        vivos = int(self.record_bytes(self.live_records()).sum())
+        return max(0, self.disk_usage() - vivos)
+
+    def delete_hashes(self, hashes: Iterable[int]) -> int:
+        """Borra entradas por hash (tombstones). Devuelve cuántas existían."""
+        borradas = 0
+        with self.lock:
+            ahora = time.time()
+            for h in hashes:
+                previo = self._buscar(int(h))
+                if previo is not None and previo[1] >= 0:
+                    self._append_registro(int(h), (0, -1, 0, 0, ahora))
+                    borradas += 1
+        return borradas
+
+    def compact(self) -> int:
+        """Reescribe sólo las entradas vivas en una generación nueva de archivos.
+
+        Las vistas entregadas antes siguen siendo válidas: mantienen vivo el
+        mapeo del archivo anterior. Devuelve los bytes liberados.
+        """
+        with self.lock:
+            antes = self.disk_usage()
+            registros = self.live_records()
+            registros.sort(order='offset')
+            if self._mm is None or (len(registros) and
+                                    registros['offset'][-1] + registros['length'][-1] * 4 > len(self._mm)):
+                self._remap()
+
+            nueva = self.generation + 1
+            vec_path, meta_path, index_path, log_path = self._generation_paths(nueva)
+            nuevos = registros.copy()
+            with open(vec_path, 'wb') as vec_out, open(meta_path, 'wb') as meta_out:
+                for i, r in enumerate(registros.tolist()):
+                    _, offset, length, meta_offset, meta_length, _ = r
+                    nuevos['offset'][i] = vec_out.tell()
+                    if length:
+                        vec_out.write(self._mm[offset:offset + length * 4])
+                    self._meta_reader.seek(meta_offset)
+                    nuevos['meta_offset'][i] = meta_out.tell()
+                    meta_out.write(self._meta_reader.read(_PREFIJO_META.size + meta_length))
+                for f in (vec_out, meta_out):
+                    f.flush()
+                    os.fsync(f.fileno())
+            nuevos.sort(order='hash')
+            nuevos.tofile(index_path)
+            open(log_path, 'wb').close()
+
+            # Activar la generación nueva: a partir de aquí es la que se abre al arrancar
+            self._write_header(len(nuevos), nueva)
+            for f in (self._vec_file, self._meta_file, self._log_file, self._meta_reader):
+                f.close()
+            viejos = (self.vectors_path, self.metadata_path, self.index_path, self.log_path)
+
+            self._set_generation(nueva)
+            self._count = len(nuevos)
+            self._vec_file = open(self.vectors_path, 'ab')
+            self._meta_file = open(self.metadata_path, 'ab')
+            self._log_file = open(self.log_path, 'ab')
+            self._meta_reader = open(self.metadata_path, 'rb')
+            self._mm = None
+            self._indice = self._map_index()
+            self._log.clear()
+            for path in viejos:
+                if os.path.exists(path):
+                    os.remove(path)
+
+            return max(0, antes - self.disk_usage())
+
+    def keys(self) -> Iterator[str]:
+        """Recorre las claves vivas (lee la metadata de cada una)."""
+        for _, registro in self.registros():
+            with self.lock:
+                yield self._leer_metadata(registro[2], registro[3])['key']
+
+    def disk_usage(self) -> int:
+        """Bytes ocupados en disco por el almacén."""
+        self.flush()
+        return sum(os.path.getsize(p) for p in
+                   (self.vectors_path, self.metadata_path, self.index_path, self.log_path)
+                   if os.path.exists(p))
+
+    def close(self):
+        """Fusiona el índice y cierra los archivos."""
+        with self.lock:
+            if self._vec_file.closed:
+                return
+            self.merge()
+            for f in (self._vec_file, self._meta_file, self._log_file, self._meta_reader):
+                f.close()
+
+
+# Modos de durabilidad de WriteBehindQueue
+DURABILITY_SYNC = 'sync'    # Escritura inmediata en el almacén y fsync en cada put
+DURABILITY_BATCH = 'batch'  # Write-behind; cada lote se vacía con fsync
+DURABILITY_ASYNC = 'async'  # Write-behind; el sistema operativo decide cuándo llega a disco
+DURABILITY_MODES = (DURABILITY_SYNC, DURABILITY_BATCH, DURABILITY_ASYNC)
+
+
+class WriteBehindQueue:
+    """Cola de persistencia write-behind sobre un EmbeddingStore.
+
+    Las escrituras repetidas de una misma clave se combinan y un hilo en
+    segundo plano las vuelca en lotes. `close()` (registrado con atexit por
+    el pool) garantiza el vaciado al apagar.
+    """
+
+    def __init__(self, store: EmbeddingStore, durability: str = DURABILITY_ASYNC,
+                 flush_interval: float = 0.5, max_batch: int = 1024):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Modo de durabilidad desconocido: {durability}")
+
+        self.store = store
+        self.durability = durability
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        # Escrituras pendientes: clave -> (vector, metadata); la última gana
+        self._pending: Dict[str, Tuple[np.ndarray, Dict]] = {}
+        # Lote que flush() está escribiendo: sigue visible hasta que lo tenga el almacén
+        self._in_flight: Dict[str, Tuple[np.ndarray, Dict]] = {}
+        self.lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+        # Estadísticas
+        self.enqueued = 0
+        self.coalesced = 0
+        self.batches_flushed = 0
+        self.written = 0
+
+    def put(self, key: str, vector: np.ndarray, metadata: Dict):
+        """Encola (o escribe, en modo sync) el vector de una clave."""
+        if self.durability == DURABILITY_SYNC or self._stopped:
+            self.store.put(key, vector, metadata)
+            self.store.flush(fsync=self.durability == DURABILITY_SYNC)
+            self.written += 1
+            return
+
+        with self.lock:
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = (vector, metadata)
+            self.enqueued += 1
+            full = len(self._pending) >= self.max_batch
+
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def put_many(self, items: Iterable[Tuple[str, np.ndarray, Dict]]):
+        """Encola muchas escrituras tomando el lock una sola vez.
+
+        Si la cola acumula demasiado (cuatro lotes), el llamador vuelca en
+        línea para que una carga masiva no crezca sin límite en memoria.
+        """
+        if self.durability == DURABILITY_SYNC or self._stopped:
+            count = 0
+            for key, vector, metadata in items:
+                self.store.put(key, vector, metadata)
+                count += 1
+            self.store.flush(fsync=self.durability == DURABILITY_SYNC)
+            self.written += count
+            return
+
+        with self.lock:
+            for key, vector, metadata in items:
+                if key in self._pending:
+                    self.coalesced += 1
+                self._pending[key] = (vector, metadata)
+                self.enqueued += 1
+            backlog = len(self._pending)
+
+        if backlog >= 4 * self.max_batch:
+            self.flush()
+        else:
+            self._ensure_thread()
+            if backlog >= self.max_batch:
+                self._wakeup.set()
+
+    def get(self, key: str) -> Optional[Tuple[np.ndarray, Dict]]:
+        """Devuelve (vector, metadata) si la clave aún no se ha volcado."""
+        with self.lock:
+            pending = self._pending.get(key)
+            return pending if pending is not None else self._in_flight.get(key)
+
+    def __contains__(self, key: str) -> bool:
+        # Bajo el lock: flush() pasa el lote de _pending a _in_flight en dos asignaciones
+        with self.lock:
+            return key in self._pending or key in self._in_flight
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def discard(self, key: str):
+        """Descarta una escritura pendiente.
+
+        Si la clave ya está en el lote que flush() está escribiendo, esa
+        escritura no se cancela: sigue visible y llega igualmente al almacén.
+        """
+        with self.lock:
+            self._pending.pop(key, None)
+
+    def flush(self):
+        """Vuelca al almacén todas las escrituras pendientes."""
+        with self._flush_lock:
+            with self.lock:
+                batch, self._pending = self._pending, {}
+                self._in_flight = batch
+            if not batch:
+                return
+
+            try:
+                for key, (vector, metadata) in batch.items():
+                    try:
+                        self.store.put(key, vector, metadata)
+                    except Exception as e:
+                        print(f"Error guardando embedding {key}: {e}")
+                self.store.flush(fsync=self.durability == DURABILITY_BATCH)
+            finally:
+                with self.lock:
+                    self._in_flight = {}
+
+            self.batches_flushed += 1
+            self.written += len(batch)
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self.lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="embedding-write-behind",
+                                                    daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """Detiene el hilo de fondo y vuelca lo pendiente."""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def get_stats(self) -> Dict:
+        """Obtiene estadísticas de la cola."""
+        return {
+            'durability': self.durability,
+            'pending': len(self._pending),
+            'enqueued': self.enqueued,
+            'coalesced': self.coalesced,
+            'batches_flushed': self.batches_flushed,
+            'written': self.written
+        }
@@ -0,0 +1,261 @@
+"""
+Políticas de Expulsión para Krystal AI
+Estructuras de expulsión con actualización de accesos en tiempo constante y medición real de bytes.
+"""
+
+import random
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+def entry_size(key: str, value: Any) -> int:
+    """Bytes reales que ocupan una clave y su valor en memoria.
+
+    Para arrays NumPy cuenta la cabecera del objeto más su buffer de datos;
+    para listas, la lista más cada elemento.
+    """
+    size = sys.getsizeof(key)
+    if isinstance(value, np.ndarray):
+        # getsizeof ya incluye el buffer sólo si el array es dueño de sus datos
+        size += sys.getsizeof(value) if value.base is None else sys.getsizeof(value) + value.nbytes
+    elif isinstance(value, (list, tuple)):
+        size += sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value)
+    else:
+        size += sys.getsizeof(value)
+    return size
+
+
+class EvictionPolicy:
+    """Interfaz común: registrar, tocar, quitar y elegir víctima en O(1)."""
+
+    name = 'base'
+
+    def insert(self, key: str):
+        raise NotImplementedError
+
+    def touch(self, key: str):
+        raise NotImplementedError
+
+    def remove(self, key: str):
+        raise NotImplementedError
+
+    def victim(self) -> Optional[str]:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def __contains__(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LRUPolicy(EvictionPolicy):
+    """Menos usado recientemente: lista ordenada por último acceso."""
+
+    name = 'lru'
+
+    def __init__(self):
+        self._order: "OrderedDict[str, None]" = OrderedDict()
+
+    def insert(self, key: str):
+        self._order[key] = None
+        self._order.move_to_end(key)
+
+    def touch(self, key: str):
+        if key in self._order:
+            self._order.move_to_end(key)
+
+    def remove(self, key: str):
+        self._order.pop(key, None)
+
+    def victim(self) -> Optional[str]:
+        return next(iter(self._order), None)
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._order
+
+    def clear(self):
+        self._order.clear()
+
+
+class LFUPolicy(EvictionPolicy):
+    """Menos frecuentemente usado con envejecimiento.
+
+    Las claves se agrupan en cubetas por frecuencia (cada cubeta en orden LRU),
+    así que tocar y elegir víctima son O(1). Cada `aging_window` accesos por
+    clave residente las frecuencias se dividen a la mitad, para que lo que fue
+    popular hace tiempo no quede fijado para siempre.
+    """
+
+    name = 'lfu'
+
+    def __init__(self, aging_window: int = 10):
+        self.aging_window = aging_window
+        self._freq: Dict[str, int] = {}
+        self._buckets: Dict[int, "OrderedDict[str, None]"] = {}
+        self._min_freq = 0
+        self._ops = 0
+
+    def _add_to_bucket(self, key: str, freq: int):
+        self._freq[key] = freq
+        self._buckets.setdefault(freq, OrderedDict())[key] = None
+
+    def _remove_from_bucket(self, key: str, freq: int):
+        bucket = self._buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[freq]
+            if self._min_freq == freq:
+                self._min_freq = freq + 1
+
+    def _age(self):
+        """Divide a la mitad todas las frecuencias (coste amortizado O(1) por acceso)."""
+        old_buckets = self._buckets
+        self._buckets = {}
+        self._freq.clear()
+        for freq in sorted(old_buckets):
+            for key in old_buckets[freq]:
+                self._add_to_bucket(key, max(1, freq // 2))
+        self._min_freq = min(self._buckets) if self._buckets else 0
+        self._ops = 0
+
+    def _tick(self):
+        self._ops += 1
+        if self._ops >= self.aging_window * max(1, len(self._freq)):
+            self._age()
+
+    def insert(self, key: str):
+        if key in self._freq:
+            self.touch(key)
+            return
+        self._add_to_bucket(key, 1)
+        self._min_freq = 1
+        self._tick()
+
+    def touch(self, key: str):
+        freq = self._freq.get(key)
+        if freq is None:
+            return
+        self._remove_from_bucket(key, freq)
+        self._add_to_bucket(key, freq + 1)
+        self._tick()
+
+    def remove(self, key: str):
+        freq = self._freq.pop(key, None)
+        if freq is None:
+            return
+        bucket = self._buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[freq]
+            if self._min_freq == freq:
+                self._min_freq = min(self._buckets) if self._buckets else 0
+
+    def victim(self) -> Optional[str]:
+        if not self._freq:
+            return None
+        bucket = self._buckets.get(self._min_freq)
+        if not bucket:
+            self._min_freq = min(self._buckets)
+            bucket = self._buckets[self._min_freq]
+        return next(iter(bucket))
+
+    def __len__(self) -> int:
+        return len(self._freq)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._freq
+
+    def clear(self):
+        self._freq.clear()
+        self._buckets.clear()
+        self._min_freq = 0
+        self._ops = 0
+
+
+class BlendPolicy(EvictionPolicy):
+    """Mezcla de frecuencia y antigüedad: score = accesos / (1 + horas sin acceso).
+
+    En lugar de puntuar y ordenar todas las claves, la víctima se elige entre
+    una muestra aleatoria de `sample_size` claves (como hace Redis).
+    """
+
+    name = 'blend'
+
+    def __init__(self, sample_size: int = 16):
+        self.sample_size = sample_size
+        self._keys: List[str] = []
+        self._pos: Dict[str, int] = {}
+        self._count: Dict[str, int] = {}
+        self._last: Dict[str, float] = {}
+
+    def insert(self, key: str):
+        if key not in self._pos:
+            self._pos[key] = len(self._keys)
+            self._keys.append(key)
+            self._count[key] = 0
+        self.touch(key)
+
+    def touch(self, key: str):
+        if key in self._pos:
+            self._count[key] += 1
+            self._last[key] = time.time()
+
+    def remove(self, key: str):
+        pos = self._pos.pop(key, None)
+        if pos is None:
+            return
+        # Intercambiar con el último para borrar en O(1)
+        last_key = self._keys.pop()
+        if last_key != key:
+            self._keys[pos] = last_key
+            self._pos[last_key] = pos
+        del self._count[key]
+        del self._last[key]
+
+    def _score(self, key: str, now: float) -> float:
+        return self._count[key] / (1 + (now - self._last[key]) / 3600)
+
+    def victim(self) -> Optional[str]:
+        if not self._keys:
+            return None
+        now = time.time()
+        sample = (self._keys if len(self._keys) <= self.sample_size
+                  else random.sample(self._keys, self.sample_size))
+        return min(sample, key=lambda k: self._score(k, now))
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._pos
+
+    def clear(self):
+        self._keys.clear()
+        self._pos.clear()
+        self._count.clear()
+        self._last.clear()
+
+
+EVICTION_POLICIES = {
+    LRUPolicy.name: LRUPolicy,
+    LFUPolicy.name: LFUPolicy,
+    BlendPolicy.name: BlendPolicy,
+}
+
+
+def create_policy(name: str) -> EvictionPolicy:
+    """Crea una política de expulsión por nombre ('lru', 'lfu' o 'blend')."""
+    if name not in EVICTION_POLICIES:
+        raise ValueError(f"Política de expulsión desconocida: {name}")
+    return EVICTION_POLICIES[name]()
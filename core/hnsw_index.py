@@ -0,0 +1,504 @@
+import heapq
+import math
+import os
+import pickle
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class HNSWIndex:
+    """
+    Approximate nearest-neighbour index (Hierarchical Navigable Small World)
+    over unit-normalized float32 vectors, with the VectorIndex API.
+
+    Layer 0 adjacency lives in an (capacity, 2*M) int32 matrix, so expanding
+    a node is one gather plus one matrix-vector product; upper layers are
+    small and kept as per-node arrays. Searches are lock-free; inserts and
+    removals take a lock. Growing the storage publishes all arrays at once
+    (`_view`), and a search reads that view a single time, ignoring upper
+    layer links to nodes past its capacity. Removed or replaced vectors
+    become tombstones: they still route searches but never appear in results.
+
+    M trades memory and build time for recall; ef_search trades latency for
+    recall at query time (see measure_recall).
+    """
+    def __init__(self, M: int = 16, ef_construction: int = 100, ef_search: int = 50,
+                 initial_capacity: int = 1024, seed: int = 0):
+        self.M = M
+        self.M0 = 2 * M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.initial_capacity = initial_capacity
+        self.seed = seed
+        self._level_mult = 1.0 / math.log(M)
+        self._rng = random.Random(seed)
+
+        self.dimension: int | None = None
+        self._vectors: np.ndarray | None = None # (capacity, dimension) unit rows
+        self._norms: np.ndarray | None = None # To rebuild the original vector in get_vector
+        self._neighbors0: np.ndarray | None = None # (capacity, M0) layer 0 links
+        self._degree0: np.ndarray | None = None
+        self._deleted: np.ndarray | None = None
+        self._view: Tuple[np.ndarray, ...] | None = None # (vectors, neighbors0, degree0, deleted) for readers
+        self._upper: List[Dict[int, np.ndarray]] = [] # _upper[level - 1][node] -> links
+        self._levels: List[int] = []
+        self._ids: List[Any] = [] # Internal slot -> ID
+        self._metadata: List[Dict[str, Any]] = []
+        self._slots: Dict[Any, int] = {} # ID -> live slot
+        self._count = 0
+        self._entry = -1
+        self._max_level = -1
+        self._tombstones = 0
+        self._lock = threading.RLock()
+        self._local = threading.local() # Per-thread visited marks
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, vector_id: Any) -> bool:
+        return vector_id in self._slots
+
+    @property
+    def _size(self) -> int:
+        return len(self._slots)
+
+    # --- Storage ---
+
+    def _allocate(self, capacity: int):
+        old = self._count
+        vectors = np.zeros((capacity, self.dimension), dtype=np.float32)
+        norms = np.zeros(capacity, dtype=np.float32)
+        neighbors0 = np.full((capacity, self.M0), -1, dtype=np.int32)
+        degree0 = np.zeros(capacity, dtype=np.int32)
+        deleted = np.zeros(capacity, dtype=bool)
+        if self._vectors is not None:
+            vectors[:old] = self._vectors[:old]
+            norms[:old] = self._norms[:old]
+            neighbors0[:old] = self._neighbors0[:old]
+            degree0[:old] = self._degree0[:old]
+            deleted[:old] = self._deleted[:old]
+        self._vectors, self._norms = vectors, norms
+        self._neighbors0, self._degree0, self._deleted = neighbors0, degree0, deleted
+        # One assignment: readers see either the old arrays or all the new ones
+        self._view = (vectors, neighbors0, degree0, deleted)
+
+    def _visited(self, capacity: int) -> Tuple[np.ndarray, int]:
+        """Thread-local visited marks with an epoch counter (no clearing per search)."""
+        marks = getattr(self._local, 'marks', None)
+        if marks is None or len(marks) < capacity or self._local.epoch >= _MAX_EPOCH:
+            marks = np.zeros(capacity, dtype=np.uint32)
+            self._local.marks = marks
+            self._local.epoch = 0
+        self._local.epoch += 1
+        return marks, self._local.epoch
+
+    # --- Search ---
+
+    def _search_layer(self, query: np.ndarray, entries: List[int], ef: int, level: int,
+                      view: Tuple[np.ndarray, ...], marks: np.ndarray, epoch: int) -> List[Tuple[float, int]]:
+        """Best-first search of one layer over a captured view; returns up to ef (similarity, slot) pairs."""
+        vectors, neighbors0, degree0, _ = view
+        capacity = vectors.shape[0]
+        entries_arr = np.asarray(entries, dtype=np.int64)
+        marks[entries_arr] = epoch
+        sims = (vectors[entries_arr] @ query).tolist()
+        candidates = [(-sim, node) for sim, node in zip(sims, entries)]
+        heapq.heapify(candidates)
+        results = [(sim, node) for sim, node in zip(sims, entries)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            # Expand the few best candidates together: one gather and one
+            # matrix product per batch instead of per node
+            worst = results[0][0] if len(results) >= ef else -math.inf
+            nodes = []
+            while candidates and len(nodes) < _EXPAND_BATCH and -candidates[0][0] >= worst:
+                nodes.append(heapq.heappop(candidates)[1])
+            if not nodes:
+                break
+            if level > 0:
+                # Upper layers are shared live: skip nodes added after the view was taken
+                links = np.concatenate([self._upper[level - 1].get(node, _EMPTY) for node in nodes])
+                links = links[links < capacity]
+            elif len(nodes) == 1:
+                links = neighbors0[nodes[0], :degree0[nodes[0]]]
+            else:
+                links = neighbors0[nodes].ravel()
+                links = links[links >= 0]
+            links = links[marks[links] != epoch]
+            if len(links) == 0:
+                continue
+            if len(nodes) > 1:
+                links = np.unique(links)
+            marks[links] = epoch
+            sims = vectors[links] @ query
+            if len(results) >= ef:
+                keep = sims > results[0][0]
+                links, sims = links[keep], sims[keep]
+            for sim, neighbor in zip(sims.tolist(), links.tolist()):
+                if len(results) < ef:
+                    heapq.heappush(results, (sim, neighbor))
+                elif sim > results[0][0]:
+                    heapq.heapreplace(results, (sim, neighbor))
+                else:
+                    continue
+                heapq.heappush(candidates, (-sim, neighbor))
+        return results
+
+    def _snapshot(self) -> Tuple[int, int, Tuple[np.ndarray, ...]]:
+        """(entry, max_level, view) for one search.
+
+        The entry point is read before the view: its row was written before it
+        was published, so it always falls inside the (same or newer) view.
+        """
+        entry, max_level = self._entry, self._max_level
+        return entry, max_level, self._view
+
+    def _search_view(self, query: np.ndarray, ef: int, entry: int, max_level: int,
+                     view: Tuple[np.ndarray, ...]) -> Tuple[List[Tuple[float, int]], Tuple[np.ndarray, ...]]:
+        """Greedy descent through the upper layers, then ef-wide search of layer 0.
+
+        Returns the layer 0 results and the view they index into.
+        """
+        if entry < 0 or view is None:
+            return [], view
+        capacity = view[0].shape[0]
+        marks, epoch = self._visited(capacity)
+        entries = [entry]
+        for level in range(max_level, 0, -1):
+            best = max(self._search_layer(query, entries, 1, level, view, marks, epoch))
+            entries = [best[1]]
+            marks, epoch = self._visited(capacity)
+        return self._search_layer(query, entries, ef, 0, view, marks, epoch), view
+
+    @staticmethod
+    def _normalize(vector) -> Tuple[np.ndarray, float]:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return (vector / norm if norm > 0 else np.zeros_like(vector)), norm
+
+    def search_similar(self, query_vector: List[float], top_k: int = 5, grammar_category: str = None,
+                       ef_search: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """
+        Returns about the top_k (vector_id, cosine similarity) pairs, most similar first.
+        Apply grammar_category filter *after* finding nearest neighbors, like VectorIndex.
+        """
+        if self._entry < 0 or len(query_vector) != self.dimension or top_k <= 0:
+            return []
+        query, _ = self._normalize(query_vector)
+        ef = max(ef_search or self.ef_search, top_k)
+        ids, metadata = self._ids, self._metadata # Append-only: every node in the view is listed
+
+        found, view = self._search_view(query, ef, *self._snapshot())
+        deleted = view[3] if view is not None else None
+        # A neighbour row being shrunk in place can briefly list a node twice
+        best: Dict[int, float] = {}
+        for sim, node in found:
+            if not deleted[node]:
+                best[node] = sim
+        found = heapq.nlargest(top_k, ((sim, node) for node, sim in best.items()))
+        results = []
+        for sim, node in found:
+            if grammar_category is None or metadata[node].get('grammar_category') == grammar_category:
+                results.append((ids[node], sim))
+        return results
+
+    # --- Insertion ---
+
+    def _select_neighbors(self, candidates: List[Tuple[float, int]], count: int) -> List[int]:
+        """Diversity heuristic: keep a candidate only if it is closer to the new
+        vector than to every neighbour already kept; fill up with the best rest."""
+        ordered = sorted(candidates, reverse=True)
+        nodes = [node for _, node in ordered]
+        pairwise = (self._vectors[nodes] @ self._vectors[nodes].T).tolist()
+        selected: List[int] = [] # Positions in ordered
+        rejected: List[int] = []
+        for position, (sim, _) in enumerate(ordered):
+            if len(selected) >= count:
+                break
+            row = pairwise[position]
+            if not selected or max(row[kept] for kept in selected) < sim:
+                selected.append(position)
+            else:
+                rejected.append(position)
+        for position in rejected:
+            if len(selected) >= count:
+                break
+            selected.append(position)
+        return [nodes[position] for position in selected]
+
+    def _connect(self, node: int, new: int, level: int):
+        """Adds new to node's links, shrinking to the closest ones if over capacity."""
+        limit = self.M0 if level == 0 else self.M
+        if level == 0:
+            degree = int(self._degree0[node])
+            if degree < limit:
+                self._neighbors0[node, degree] = new
+                self._degree0[node] = degree + 1
+                return
+            links = np.append(self._neighbors0[node, :degree], new)
+        else:
+            links = np.append(self._upper[level - 1].get(node, _EMPTY), new).astype(np.int32)
+            if len(links) <= limit:
+                self._upper[level - 1][node] = links
+                return
+
+        sims = self._vectors[links] @ self._vectors[node]
+        keep = links[np.argpartition(-sims, limit - 1)[:limit]]
+        if level == 0:
+            self._neighbors0[node, :limit] = keep
+        else:
+            self._upper[level - 1][node] = keep.astype(np.int32)
+
+    def add_vector(self, vector_id: Any, vector: List[float], metadata: Dict[str, Any] = None, category: Any = None):
+        """Adds a vector and its metadata; an existing ID is replaced (see upsert)."""
+        self.upsert(vector_id, vector, metadata, category)
+
+    def upsert(self, vector_id: Any, vector: List[float], metadata: Dict[str, Any] = None, category: Any = None):
+        """Inserts a vector, tombstoning the previous one if the ID already exists."""
+        if self.dimension is None:
+            self.dimension = len(vector)
+        elif len(vector) != self.dimension:
+            print(f"Error: Vector dimension mismatch. Expected {self.dimension}, got {len(vector)}.")
+            return
+
+        if metadata is None:
+            metadata = {}
+
+        if category is not None:
+            metadata = dict(metadata)  # avoid mutating input
+            metadata['category'] = category
+
+        unit, norm = self._normalize(vector)
+        with self._lock:
+            if self._vectors is None:
+                self._allocate(self.initial_capacity)
+            elif self._count == self._vectors.shape[0]:
+                self._allocate(self._count * 2)
+
+            previous = self._slots.get(vector_id)
+            if previous is not None:
+                self._deleted[previous] = True
+                self._tombstones += 1
+
+            new = self._count
+            self._vectors[new] = unit
+            self._norms[new] = norm
+            self._ids.append(vector_id)
+            self._metadata.append(metadata)
+            level = int(-math.log(1.0 - self._rng.random()) * self._level_mult)
+            self._levels.append(level)
+            while len(self._upper) < level:
+                self._upper.append({})
+
+            if self._entry >= 0:
+                view = self._view
+                vectors = view[0]
+                entries = [self._entry]
+                for current in range(self._max_level, level, -1):
+                    marks, epoch = self._visited(vectors.shape[0])
+                    best = max(self._search_layer(unit, entries, 1, current, view, marks, epoch))
+                    entries = [best[1]]
+                for current in range(min(level, self._max_level), -1, -1):
+                    marks, epoch = self._visited(vectors.shape[0])
+                    found = self._search_layer(unit, entries, self.ef_construction, current,
+                                               view, marks, epoch)
+                    limit = self.M0 if current == 0 else self.M
+                    chosen = self._select_neighbors(found, self.M)
+                    if current == 0:
+                        self._neighbors0[new, :len(chosen)] = chosen
+                        self._degree0[new] = len(chosen)
+                    else:
+                        self._upper[current - 1][new] = np.asarray(chosen[:limit], dtype=np.int32)
+                    for neighbor in chosen:
+                        self._connect(neighbor, new, current)
+                    entries = [node for _, node in found]
+
+            # Publish the node only once its links exist
+            self._count = new + 1
+            self._slots[vector_id] = new
+            if level > self._max_level:
+                self._max_level = level
+                self._entry = new
+
+    def build(self, ids: List[Any], matrix, metadata: Optional[List[Dict[str, Any]]] = None):
+        """Inserts matrix rows in order (HNSW has no balanced bulk build)."""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[0] != len(ids):
+            raise ValueError("build expects one matrix row per ID")
+        if metadata is not None and len(metadata) != len(ids):
+            raise ValueError("build expects one metadata dict per ID")
+        if self._vectors is None and len(ids):
+            self.dimension = matrix.shape[1]
+            self._allocate(max(self.initial_capacity, len(ids)))
+        for i, vector_id in enumerate(ids):
+            self.upsert(vector_id, matrix[i], metadata[i] if metadata is not None else None)
+
+    # --- Lookups and removal ---
+
+    def get_vector(self, vector_id: Any) -> np.ndarray | None:
+        """Retrieves a vector by its ID in O(1) (float32, original scale)."""
+        slot = self._slots.get(vector_id)
+        if slot is None:
+            return None
+        return self._vectors[slot] * self._norms[slot]
+
+    def get_metadata(self, vector_id: Any) -> Dict[str, Any] | None:
+        """Retrieves metadata by vector ID in O(1)."""
+        slot = self._slots.get(vector_id)
+        return self._metadata[slot] if slot is not None else None
+
+    def remove_vector(self, vector_id: Any):
+        """Removes a vector by tombstoning it; it keeps routing searches."""
+        with self._lock:
+            slot = self._slots.pop(vector_id, None)
+            if slot is None:
+                print(f"Warning: Vector ID {vector_id} not found in index.")
+                return
+            self._deleted[slot] = True
+            self._tombstones += 1
+
+    def compact(self) -> "HNSWIndex":
+        """Returns a new index with only the live vectors (rebuilds the graph)."""
+        fresh = HNSWIndex(self.M, self.ef_construction, self.ef_search, self.initial_capacity, self.seed)
+        # Copy vectors and metadata under the lock: an upsert afterwards would
+        # turn a slot into a tombstone and its old vector must not be copied
+        with self._lock:
+            ids = list(self._slots)
+            slots = np.fromiter(self._slots.values(), dtype=np.int64, count=len(ids))
+            vectors = self._vectors[slots] * self._norms[slots, None] if len(ids) else None
+            metadata = [self._metadata[slot] for slot in slots.tolist()]
+        if ids:
+            fresh.build(ids, vectors, metadata)
+        return fresh
+
+    # --- Persistence ---
+
+    def save(self, path: str):
+        """Writes the index to a single file (atomic: temporary file + rename)."""
+        with self._lock:
+            count = self._count
+            state = {
+                'format': 1,
+                'params': {'M': self.M, 'ef_construction': self.ef_construction,
+                           'ef_search': self.ef_search, 'initial_capacity': self.initial_capacity,
+                           'seed': self.seed},
+                'dimension': self.dimension,
+                'vectors': self._vectors[:count].copy() if count else None,
+                'norms': self._norms[:count].copy() if count else None,
+                'neighbors0': self._neighbors0[:count].copy() if count else None,
+                'degree0': self._degree0[:count].copy() if count else None,
+                'deleted': self._deleted[:count].copy() if count else None,
+                'upper': [dict(layer) for layer in self._upper],
+                'levels': list(self._levels),
+                'ids': list(self._ids),
+                'metadata': list(self._metadata),
+                'slots': dict(self._slots),
+                'entry': self._entry,
+                'max_level': self._max_level,
+                'tombstones': self._tombstones,
+                'rng': self._rng.getstate(),
+            }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path: str) -> "HNSWIndex":
+        """Loads an index written by save."""
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('format') != 1:
+            raise ValueError(f"Unsupported HNSW index format in {path}")
+        index = cls(**state['params'])
+        index.dimension = state['dimension']
+        count = len(state['ids'])
+        if count:
+            index._allocate(max(index.initial_capacity, count))
+            index._vectors[:count] = state['vectors']
+            index._norms[:count] = state['norms']
+            index._neighbors0[:count] = state['neighbors0']
+            index._degree0[:count] = state['degree0']
+            index._deleted[:count] = state['deleted']
+        index._upper = state['upper']
+        index._levels = state['levels']
+        index._ids = state['ids']
+        index._metadata = state['metadata']
+        index._slots = state['slots']
+        index._entry = state['entry']
+        index._max_level = state['max_level']
+        index._tombstones = state['tombstones']
+        index._rng.setstate(state['rng'])
+        index._count = count
+        return index
+
+    # --- Quality and stats ---
+
+    def measure_recall(self, queries=None, k: int = 10, sample: int = 100,
+                       ef_search: Optional[int] = None, seed: int = 0) -> Dict[str, Any]:
+        """Recall@k against an exact scan of the live vectors, plus mean query latency.
+
+        Without queries, `sample` stored live vectors are used as queries.
+        """
+        live = np.array(sorted(self._slots.values()), dtype=np.int64)
+        if len(live) == 0:
+            return {'recall': 0.0, 'k': k, 'queries': 0}
+        if queries is None:
+            rng = np.random.default_rng(seed)
+            picks = rng.choice(live, size=min(sample, len(live)), replace=False)
+            queries = self._vectors[picks]
+        queries = np.asarray(queries, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = np.divide(queries, norms, out=np.zeros_like(queries), where=norms > 0)
+
+        exact = self._vectors[live] @ queries.T
+        k = min(k, len(live))
+        hits = 0
+        elapsed = 0.0
+        for j, query in enumerate(queries):
+            truth = set(live[np.argpartition(-exact[:, j], k - 1)[:k]].tolist())
+            start = time.perf_counter()
+            found = self.search_similar(query, top_k=k, ef_search=ef_search)
+            elapsed += time.perf_counter() - start
+            hits += len(truth & {self._slots[vector_id] for vector_id, _ in found})
+        return {
+            'recall': hits / (k * len(queries)),
+            'k': k,
+            'ef_search': ef_search or self.ef_search,
+            'queries': len(queries),
+            'mean_query_ms': elapsed / len(queries) * 1000
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Size, graph shape and tombstones of the index."""
+        count = self._count
+        return {
+            'backend': 'hnsw',
+            'size': len(self._slots),
+            'dimension': self.dimension,
+            'nodes': count,
+            'tombstones': self._tombstones,
+            'max_level': self._max_level,
+            'M': self.M,
+            'ef_construction': self.ef_construction,
+            'ef_search': self.ef_search,
+            'mean_degree0': float(self._degree0[:count].mean()) if count else 0.0,
+            'matrix_bytes': (self._vectors.nbytes + self._neighbors0.nbytes) if self._vectors is not None else 0
+        }
+
+
+_EMPTY = np.zeros(0, dtype=np.int32)
+_MAX_EPOCH = 2 ** 32 - 1
+_EXPAND_BATCH = 8 # Candidates expanded per step in _search_layer
@@ -1,7 +1,14 @@
 import math
-import sys
-from typing import List, Tuple, Dict, Any
+import threading
+from typing import List, Tuple, Dict, Any, Optional
 import heapq
+from operator import mul
+
+import numpy as np
+
+from .matriz_vectores import MatrizNormalizada
+from .hnsw_index import HNSWIndex
+from .ivfpq_index import IVFPQIndex
 
 # Existing helper functions
 def dot_product(v1: List[float], v2: List[float]) -> float:
@@ -21,29 +28,81 @@ def cosine_similarity(v1: List[float], v2: List[float]) -> float:
         return 0.0
     return dot / (mag1 * mag2)
 
+def unit_vector(v: List[float]) -> Tuple[float, ...]:
+    """Returns v scaled to unit length (the zero vector stays zero)."""
+    mag = magnitude(v)
+    if mag == 0:
+        return tuple(0.0 for _ in v)
+    return tuple(x / mag for x in v)
+
 # KD-tree Node
 class KDNode:
-    def __init__(self, vector_id: Any, vector: List[float], metadata: Dict[str, Any], axis: int, left=None, right=None):
+    def __init__(self, vector_id: Any, vector: List[float], metadata: Dict[str, Any], axis: int, left=None, right=None, unit=None):
         self.vector_id = vector_id
         self.vector = vector
+        self.unit = unit if unit is not None else unit_vector(vector) # Splits and pruning use the unit vector
         self.metadata = metadata
         self.axis = axis # Dimension used for splitting at this node
         self.left = left
         self.right = right
+        self.deleted = False # Tombstone: the node stays in the tree until compaction
 
 class VectorIndex:
     """
     A pure Python vector indexing system supporting grammatical categories
-    using a basic KD-tree for O(log n) search capability.
+    using a KD-tree over unit-normalized vectors for O(log n) search.
+
+    On unit vectors ||q - x||^2 = 2 - 2 cos(q, x), so ranking by cosine is
+    ranking by Euclidean distance and the usual KD-tree bound (the squared
+    gap to a splitting plane) soundly prunes subtrees. Insertion and search
+    are iterative, so degenerate trees cannot hit the recursion limit.
+
+    `build` bulk-loads a median-split balanced tree. When a one-by-one insert
+    lands deeper than `max_depth_factor * log2(n) + 8`, the subtree of its
+    scapegoat (the deepest ancestor whose child on the insertion path holds
+    more than alpha = 0.7 of its nodes) is rebuilt balanced, so sorted or
+    clustered loads stay shallow at an amortized cost.
+
+    An id -> live node map makes lookups, removals and upserts O(1) (plus the
+    insertion itself). Removed and replaced nodes become tombstones that
+    searches skip; once they exceed `compact_fraction` of the tree, a
+    background thread rebuilds it from the live nodes.
     """
-    def __init__(self):
+    def __init__(self, compact_fraction: float = 0.25, min_compact_nodes: int = 64,
+                 max_depth_factor: float = 4.0):
         self.root: KDNode | None = None
         self.dimension: int | None = None
-        self._size = 0
-        self._removed_ids: set = set() # Set to store IDs of removed vectors
+        self._nodes: Dict[Any, KDNode] = {} # Live node for each ID
+        self._removed_ids: set = set() # IDs removed and not re-added
+        self._tombstones = 0 # Dead nodes still in the tree
+        self.compact_fraction = compact_fraction
+        self.min_compact_nodes = min_compact_nodes
+        self.max_depth_factor = max_depth_factor
+        self._lock = threading.RLock()
+        self._version = 0 # Bumped on every mutation; a rebuild only swaps in if unchanged
+        self._compacting = False
+        self.compactions = 0
+        self.rebuilds = 0
+
+    @property
+    def _size(self) -> int:
+        return len(self._nodes)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __contains__(self, vector_id: Any) -> bool:
+        return vector_id in self._nodes
 
     def add_vector(self, vector_id: Any, vector: List[float], metadata: Dict[str, Any] = None, category: Any = None):
-        """Adds a vector and its associated metadata to the index. Optionally accepts a category."""
+        """Adds a vector and its associated metadata to the index. Optionally accepts a category.
+
+        Adding an existing ID replaces its vector and metadata (see upsert).
+        """
+        self.upsert(vector_id, vector, metadata, category)
+
+    def upsert(self, vector_id: Any, vector: List[float], metadata: Dict[str, Any] = None, category: Any = None):
+        """Inserts a vector or replaces the stored vector and metadata of an existing ID."""
         if self.dimension is None:
             self.dimension = len(vector)
         elif len(vector) != self.dimension:
@@ -57,150 +116,225 @@ class VectorIndex:
             metadata = dict(metadata)  # avoid mutating input
             metadata['category'] = category
 
-        # If the vector_id was previously removed, unmark it
-        if vector_id in self._removed_ids:
-            self._removed_ids.remove(vector_id)
-
-        # Simple insertion. If ID exists, it will be added again.
-        # For true update/overwrite, a more complex KD-tree implementation is needed.
-        # For this basic version, adding an existing ID results in multiple nodes with the same ID.
-        # Search will return all of them if they are neighbors.
-        self.root = self._insert(self.root, vector_id, vector, metadata, 0)
-        self._size += 1
-        # --- Temporary Debug Logging ---
-        print("\n--- VectorIndex Add Debug ---", file=sys.stderr)
-        print(f"Added vector with ID: {vector_id}", file=sys.stderr)
-        if self.root:
-            print(f"Root node vector: {self.root.vector}, axis: {self.root.axis}", file=sys.stderr)
-            if self.root.left:
-                print(f"  Root left child vector: {self.root.left.vector}, axis: {self.root.left.axis}", file=sys.stderr)
-            if self.root.right:
-                print(f"  Root right child vector: {self.root.right.vector}, axis: {self.root.right.axis}", file=sys.stderr)
-        print("---------------------------\n", file=sys.stderr)
-        # --- End Temporary Debug Logging ---
-
-    def _insert(self, node: KDNode | None, vector_id: Any, vector: List[float], metadata: Dict[str, Any], depth: int) -> KDNode:
-        """Recursive helper for inserting a vector into the KD-tree."""
-        axis = depth % self.dimension
-
-        if node is None:
-            return KDNode(vector_id, vector, metadata, axis)
-
-        if vector[axis] < node.vector[axis]:
-            node.left = self._insert(node.left, vector_id, vector, metadata, depth + 1)
+        with self._lock:
+            self._removed_ids.discard(vector_id)
+            node = self._nodes.get(vector_id)
+            if node is not None and list(node.vector) == list(vector):
+                # Same position in the tree: only the metadata changes. Still a
+                # mutation: a compaction copied the old metadata and must retry
+                node.metadata = metadata
+                self._version += 1
+                return
+
+            if node is not None:
+                node.deleted = True
+                self._tombstones += 1
+            self._version += 1
+            path = self._insert(KDNode(vector_id, vector, metadata, 0))
+            if len(path) > self._depth_bound():
+                self._rebuild_subtree(path)
+        self._maybe_compact()
+
+    def _insert(self, new_node: KDNode) -> List[KDNode]:
+        """Iteratively walks down the tree and hangs new_node as a leaf.
+
+        Returns the path from the root down to (and including) new_node.
+        """
+        self._nodes[new_node.vector_id] = new_node
+        path: List[KDNode] = []
+        node = self.root
+        while node is not None:
+            path.append(node)
+            node = node.left if new_node.unit[node.axis] < node.unit[node.axis] else node.right
+
+        new_node.axis = len(path) % self.dimension
+        if not path:
+            self.root = new_node
+        elif new_node.unit[path[-1].axis] < path[-1].unit[path[-1].axis]:
+            path[-1].left = new_node
         else:
-            node.right = self._insert(node.right, vector_id, vector, metadata, depth + 1)
+            path[-1].right = new_node
+        path.append(new_node)
+        return path
+
+    def _depth_bound(self) -> float:
+        return self.max_depth_factor * math.log2(len(self._nodes) + self._tombstones + 1) + 8
+
+    @staticmethod
+    def _subtree_nodes(top: KDNode | None) -> List[KDNode]:
+        """Every node (tombstones included) under top, iteratively."""
+        members: List[KDNode] = []
+        stack = [top] if top is not None else []
+        while stack:
+            node = stack.pop()
+            members.append(node)
+            if node.left is not None:
+                stack.append(node.left)
+            if node.right is not None:
+                stack.append(node.right)
+        return members
+
+    def _rebuild_subtree(self, path: List[KDNode]):
+        """Rebuilds balanced the subtree of the scapegoat on the path (requires the lock).
+
+        The scapegoat is the deepest ancestor whose child on the path holds
+        more than 70% of its nodes; a path longer than the depth bound always
+        has one. The new subtree is made of fresh nodes, so lock-free searches
+        walking the old one are unaffected.
+        """
+        alpha = 0.7
+        start = 0
+        below = 1 # Size of the subtree of the path child (the new leaf at first)
+        for i in range(len(path) - 2, -1, -1):
+            ancestor = path[i]
+            other = ancestor.right if ancestor.left is path[i + 1] else ancestor.left
+            size = 1 + below + len(self._subtree_nodes(other))
+            if below > alpha * size:
+                start = i
+                break
+            below = size
+
+        top = path[start]
+        members = self._subtree_nodes(top)
+        live = [node for node in members if not node.deleted]
+        self._tombstones -= len(members) - len(live)
+        subtree, nodes, _ = self._build_tree(live, start_depth=start)
+        self._nodes.update(nodes)
+        if start == 0:
+            self.root = subtree
+        elif path[start - 1].left is top:
+            path[start - 1].left = subtree
+        else:
+            path[start - 1].right = subtree
+        self.rebuilds += 1
 
-        return node
+    def build(self, ids: List[Any], matrix, metadata: Optional[List[Dict[str, Any]]] = None):
+        """Replaces the index contents with a balanced tree built from matrix rows.
+
+        ids[i] is the ID of matrix[i]; metadata is an optional list of dicts
+        aligned with ids. Duplicate IDs keep their last row.
+        """
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if matrix.ndim != 2 or matrix.shape[0] != len(ids):
+            raise ValueError("build expects one matrix row per ID")
+        if metadata is not None and len(metadata) != len(ids):
+            raise ValueError("build expects one metadata dict per ID")
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        units = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+        latest: Dict[Any, KDNode] = {}
+        for i, vector_id in enumerate(ids):
+            latest[vector_id] = KDNode(vector_id, matrix[i].tolist(),
+                                       metadata[i] if metadata is not None else {},
+                                       0, unit=tuple(units[i].tolist()))
+
+        with self._lock:
+            self.dimension = matrix.shape[1]
+            self._version += 1
+            self._swap_in(*self._build_tree(list(latest.values())))
+            self._removed_ids.clear()
+
+    def _build_tree(self, nodes: List[KDNode], start_depth: int = 0) -> Tuple[KDNode | None, Dict[Any, KDNode], int]:
+        """Median-split balanced tree over fresh copies of nodes, built iteratively.
+
+        start_depth is the depth the subtree root will occupy (it fixes the split axes).
+        Returns (root, id -> node, depth of the deepest node).
+        """
+        if not nodes:
+            return None, {}, start_depth
+        copies = [KDNode(n.vector_id, n.vector, n.metadata, 0, unit=n.unit) for n in nodes]
+        units = np.array([n.unit for n in copies], dtype=np.float64)
+        root = None
+        max_depth = 0
+        # (row indices, depth, parent, attach as left child)
+        stack = [(np.arange(len(copies)), start_depth, None, False)]
+        while stack:
+            rows, depth, parent, as_left = stack.pop()
+            axis = depth % self.dimension
+            middle = len(rows) // 2
+            order = np.argpartition(units[rows, axis], middle) if len(rows) > 1 else np.zeros(1, dtype=np.intp)
+            node = copies[rows[order[middle]]]
+            node.axis = axis
+            if parent is None:
+                root = node
+            elif as_left:
+                parent.left = node
+            else:
+                parent.right = node
+            max_depth = max(max_depth, depth + 1)
+            # Ties with the median may land on either side: search bounds stay valid
+            if middle > 0:
+                stack.append((rows[order[:middle]], depth + 1, node, True))
+            if middle + 1 < len(rows):
+                stack.append((rows[order[middle + 1:]], depth + 1, node, False))
+        return root, {n.vector_id: n for n in copies}, max_depth
+
+    def _swap_in(self, root: KDNode | None, nodes: Dict[Any, KDNode], depth: int):
+        """Installs a freshly built tree (requires the lock)."""
+        self.root = root
+        self._nodes = nodes
+        self._tombstones = 0
 
     def get_vector(self, vector_id: Any) -> List[float] | None:
-        """Retrieves a vector by its ID. O(n) in worst case for KD-tree."""
-        # Simple tree traversal to find by ID, skipping removed IDs.
-        return self._find_by_id(self.root, vector_id)
-
-    def _find_by_id(self, node: KDNode | None, vector_id: Any) -> List[float] | None:
-        """Recursive helper to find a vector by ID, skipping removed."""
-        if node is None:
-            return None
-        if node.vector_id == vector_id and node.vector_id not in self._removed_ids:
-            return node.vector
-        left_result = self._find_by_id(node.left, vector_id)
-        if left_result:
-            return left_result
-        right_result = self._find_by_id(node.right, vector_id)
-        return right_result
+        """Retrieves a vector by its ID in O(1)."""
+        node = self._nodes.get(vector_id)
+        return node.vector if node is not None else None
 
     def get_metadata(self, vector_id: Any) -> Dict[str, Any] | None:
-        """Retrieves metadata by vector ID. O(n) in worst case."""
-        # Simple tree traversal to find by ID, skipping removed IDs.
-        return self._find_metadata_by_id(self.root, vector_id)
-
-    def _find_metadata_by_id(self, node: KDNode | None, vector_id: Any) -> Dict[str, Any] | None:
-        """Recursive helper to find metadata by ID, skipping removed."""
-        if node is None:
-            return None
-        if node.vector_id == vector_id and node.vector_id not in self._removed_ids:
-            return node.metadata
-        left_result = self._find_metadata_by_id(node.left, vector_id)
-        if left_result:
-            return left_result
-        right_result = self._find_metadata_by_id(node.right, vector_id)
-        return right_result
-
+        """Retrieves metadata by vector ID in O(1)."""
+        node = self._nodes.get(vector_id)
+        return node.metadata if node is not None else None
 
     def search_similar(self, query_vector: List[float], top_k: int = 5, grammar_category: str = None) -> List[Tuple[Any, float]]:
         """
         Searches for vectors similar to the query vector using the KD-tree.
         """
-        if self.root is None or self.dimension is None or len(query_vector) != self.dimension:
+        root = self.root
+        if root is None or self.dimension is None or len(query_vector) != self.dimension or top_k <= 0:
             return []
 
-        # Min-heap for (distance, vector_id, similarity)
-        best_neighbors: List[Tuple[float, Any, float]] = []
+        query = unit_vector(query_vector)
 
-        def search_recursive(node: KDNode | None, depth: int):
-            if node is None:
-                return
-            axis = depth % self.dimension
+        # Min-heap on similarity holding the top_k best: (similarity, tie-breaker, node)
+        best_neighbors: List[Tuple[float, int, KDNode]] = []
 
-            # Only process if the node hasn't been removed
-            if node.vector_id not in self._removed_ids:
-                # Calculate similarity and distance
-                similarity = cosine_similarity(query_vector, node.vector)
-                distance = 1.0 - similarity
+        # Depth-first with an explicit stack: (node, lower bound on the squared
+        # Euclidean distance from the query to anything in that subtree)
+        stack: List[Tuple[KDNode, float]] = [(root, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            # A subtree whose bound exceeds the worst kept distance cannot improve the result
+            if len(best_neighbors) == top_k and bound > 2.0 - 2.0 * best_neighbors[0][0] + 1e-12:
+                continue
 
-                # Add to heap if it's one of the top_k
+            # Only process live nodes (tombstones are skipped)
+            if not node.deleted:
+                similarity = sum(map(mul, query, node.unit))
+
+                # Add to heap if it's one of the top_k (the root is the worst kept)
+                entry = (similarity, id(node), node)
                 if len(best_neighbors) < top_k:
-                    heapq.heappush(best_neighbors, (distance, node.vector_id, similarity))
-                elif distance < best_neighbors[0][0]:
-                    heapq.heapreplace(best_neighbors, (distance, node.vector_id, similarity))
-
-            # Determine which child to search first
-            # The splitting decision is based on the node's vector value along the current axis.
-            if query_vector[axis] < node.vector[axis]:
-                near_child = node.left
-                far_child = node.right
+                    heapq.heappush(best_neighbors, entry)
+                elif similarity > best_neighbors[0][0]:
+                    heapq.heapreplace(best_neighbors, entry)
+
+            # Near child first (pushed last); the far child's bound grows by the
+            # squared gap between the query and the splitting plane
+            gap = query[node.axis] - node.unit[node.axis]
+            if gap < 0:
+                near_child, far_child = node.left, node.right
             else:
-                near_child = node.right
-                far_child = node.left
-
-            # Recursively search the near child
-            search_recursive(near_child, depth + 1)
-
-            # Check if the other side of the splitting plane could contain a closer point.
-            # Simplified pruning check for basic implementation:
-            # If the heap is not full, or if the distance from the query to the splitting plane
-            # along the current axis is less than the distance of the current furthest neighbor.
-            # This is an approximation for cosine similarity.
-            axis_distance = abs(query_vector[axis] - node.vector[axis])
-            # print(f"DEBUG: VectorIndex.search_similar - Axis distance: {axis_distance}, Current furthest distance: {best_neighbors[0][0] if best_neighbors else 'N/A'}") # Debug log - Removed debug log
-
-            # If the heap is not full, we must explore the far child.
-            # If the heap is full, explore the far child only if the splitting plane is within
-            # the radius of the current furthest neighbor.
-            # The radius is best_neighbors[0][0] (which is 1 - similarity).
-            # A point on the other side of the plane at the same axis value as the query
-            # would have an axis distance of axis_distance.
-            # If axis_distance < best_neighbors[0][0], it's possible a point on the other side
-            # is closer. This is a heuristic for cosine similarity.
-
-            # Disable pruning for cosine similarity search to ensure correctness.
-            # Always explore the far child after the near child.
-            search_recursive(far_child, depth + 1)
-
-        # Perform the initial search to get the top_k nearest neighbors based on vector similarity
-        search_recursive(self.root, 0)
-
-        # Convert heap to results list, sorted by similarity descending.
+                near_child, far_child = node.right, node.left
+            if far_child is not None:
+                stack.append((far_child, max(bound, gap * gap)))
+            if near_child is not None:
+                stack.append((near_child, bound))
+
         # Apply grammar_category filter *after* finding nearest neighbors
         filtered_results = []
-        for distance, vector_id, similarity in best_neighbors:
-            # Retrieve metadata for the vector_id
-            metadata = self.get_metadata(vector_id) # Need to retrieve metadata here
-
-            # Apply the grammar_category filter
-            if grammar_category is None or (metadata and metadata.get('grammar_category') == grammar_category):
-                filtered_results.append((vector_id, similarity))
+        for similarity, _, node in best_neighbors:
+            if grammar_category is None or node.metadata.get('grammar_category') == grammar_category:
+                filtered_results.append((node.vector_id, similarity))
 
         # Sort the filtered results by similarity descending
         filtered_results.sort(key=lambda item: item[1], reverse=True)
@@ -208,33 +342,257 @@ class VectorIndex:
         return filtered_results
 
     def remove_vector(self, vector_id: Any):
-        """Removes a vector and its metadata from the index by marking its ID as removed."""
-        if vector_id in self._removed_ids:
-            print(f"Warning: Vector ID {vector_id} already marked as removed.")
+        """Removes a vector and its metadata from the index in O(1), leaving a tombstone."""
+        with self._lock:
+            if vector_id in self._removed_ids:
+                print(f"Warning: Vector ID {vector_id} already marked as removed.")
+                return
+
+            node = self._nodes.pop(vector_id, None)
+            if node is None:
+                print(f"Warning: Vector ID {vector_id} not found in index.")
+                return
+            node.deleted = True
+            self._tombstones += 1
+            self._removed_ids.add(vector_id)
+            self._version += 1
+        self._maybe_compact()
+
+    def _needs_compaction(self) -> bool:
+        total = len(self._nodes) + self._tombstones
+        return total >= self.min_compact_nodes and self._tombstones > total * self.compact_fraction
+
+    def _maybe_compact(self):
+        """Starts a background rebuild once tombstones exceed compact_fraction of the tree."""
+        if self._compacting or not self._needs_compaction():
             return
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact_in_background, name="vector-index-compact",
+                         daemon=True).start()
+
+    def _compact_in_background(self):
+        try:
+            # A rebuild is discarded if the index changed meanwhile: retry a few times
+            for _ in range(3):
+                if self.compact() or not self._needs_compaction():
+                    break
+        except Exception as e:
+            print(f"Error compacting vector index: {e}")
+        finally:
+            self._compacting = False
+
+    def compact(self) -> bool:
+        """Rebuilds a balanced tree from the live nodes, dropping every tombstone.
+
+        The new tree is built without holding the lock and only swapped in if
+        the index did not change meanwhile. Returns whether it was swapped in.
+        """
+        with self._lock:
+            version = self._version
+            live = list(self._nodes.values())
+
+        rebuilt = self._build_tree(live)
+
+        with self._lock:
+            if self._version != version:
+                return False
+            self._swap_in(*rebuilt)
+            self._removed_ids.clear()
+            self.compactions += 1
+            return True
+
+    def depth(self) -> int:
+        """Number of levels of the tree (iterative walk, O(n))."""
+        deepest = 0
+        stack = [(self.root, 1)] if self.root is not None else []
+        while stack:
+            node, level = stack.pop()
+            deepest = max(deepest, level)
+            if node.left is not None:
+                stack.append((node.left, level + 1))
+            if node.right is not None:
+                stack.append((node.right, level + 1))
+        return deepest
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Size, shape and tombstones of the index."""
+        return {
+            'backend': 'kdtree',
+            'size': len(self._nodes),
+            'dimension': self.dimension,
+            'depth': self.depth(),
+            'depth_bound': self._depth_bound(),
+            'tombstones': self._tombstones,
+            'removed': len(self._removed_ids),
+            'compactions': self.compactions,
+            'rebuilds': self.rebuilds
+        }
+
+
+class FlatVectorIndex:
+    """
+    Exact vector index backed by a growable float32 matrix of unit rows.
 
-        # Check if the ID exists in the tree at all before marking as removed
-        # This requires traversing the tree, which is O(n) in worst case.
-        # A more efficient check would require a separate dictionary mapping ID to node,
-        # but that adds memory and complexity to keep in sync with tree modifications.
-        # For this basic implementation, we accept the O(n) check here.
-        if self._find_node_by_id(self.root, vector_id):
-             self._removed_ids.add(vector_id)
-             self._size -= 1
-        else:
-            print(f"Warning: Vector ID {vector_id} not found in index.")
+    Each id maps to one row (adding an existing id overwrites it), so lookups
+    by id are O(1) and a search is a single matrix-vector product followed by
+    an O(n) partial selection. Same API as VectorIndex, including its
+    grammar_category semantics; a lock serializes writes and searches, since
+    the matrix grows and swap-removes rows in place.
+    """
+    def __init__(self, initial_capacity: int = 1024):
+        self.initial_capacity = initial_capacity
+        self.dimension: int | None = None
+        self._matrix: MatrizNormalizada | None = None
+        self._norms: Dict[Any, float] = {}  # To rebuild the original vector in get_vector
+        self._metadata: Dict[Any, Dict[str, Any]] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._metadata)
+
+    def __contains__(self, vector_id: Any) -> bool:
+        return vector_id in self._metadata
+
+    @property
+    def _size(self) -> int:
+        return len(self._metadata)
+
+    def add_vector(self, vector_id: Any, vector: List[float], metadata: Dict[str, Any] = None, category: Any = None):
+        """Adds a vector and its metadata; an existing ID is replaced (see upsert)."""
+        self.upsert(vector_id, vector, metadata, category)
+
+    def upsert(self, vector_id: Any, vector: List[float], metadata: Dict[str, Any] = None, category: Any = None):
+        """Inserts a vector or overwrites the row and metadata of an existing ID."""
+        if metadata is None:
+            metadata = {}
+
+        if category is not None:
+            metadata = dict(metadata)  # avoid mutating input
+            metadata['category'] = category
+
+        norm = float(np.linalg.norm(np.asarray(vector, dtype=np.float32)))
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = len(vector)
+                self._matrix = MatrizNormalizada(self.dimension, self.initial_capacity)
+            elif len(vector) != self.dimension:
+                print(f"Error: Vector dimension mismatch. Expected {self.dimension}, got {len(vector)}.")
+                return
+
+            self._matrix.agregar(vector_id, vector)
+            self._norms[vector_id] = norm
+            self._metadata[vector_id] = metadata
+
+    def build(self, ids: List[Any], matrix, metadata: Optional[List[Dict[str, Any]]] = None):
+        """Bulk load of matrix rows (existing IDs are overwritten, like upsert).
+
+        ids[i] is the ID of matrix[i]; metadata is an optional list of dicts
+        aligned with ids. Duplicate IDs keep their last row.
+        """
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[0] != len(ids):
+            raise ValueError("build expects one matrix row per ID")
+        if metadata is not None and len(metadata) != len(ids):
+            raise ValueError("build expects one metadata dict per ID")
+        if len(ids) == 0:
+            return
+
+        norms = np.linalg.norm(matrix, axis=1).tolist()
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = matrix.shape[1]
+                self._matrix = MatrizNormalizada(self.dimension, max(self.initial_capacity, len(ids)))
+            elif matrix.shape[1] != self.dimension:
+                raise ValueError(f"Vector dimension mismatch. Expected {self.dimension}, got {matrix.shape[1]}.")
+            for i, vector_id in enumerate(ids):
+                self._matrix.agregar(vector_id, matrix[i])
+                self._norms[vector_id] = norms[i]
+                self._metadata[vector_id] = metadata[i] if metadata is not None else {}
+
+    def get_vector(self, vector_id: Any) -> np.ndarray | None:
+        """Retrieves a vector by its ID in O(1) (float32, original scale)."""
+        with self._lock:
+            if vector_id not in self._metadata:
+                return None
+            return self._matrix.vector(vector_id) * self._norms[vector_id]
+
+    def get_metadata(self, vector_id: Any) -> Dict[str, Any] | None:
+        """Retrieves metadata by vector ID in O(1)."""
+        return self._metadata.get(vector_id)
+
+    def search_similar(self, query_vector: List[float], top_k: int = 5, grammar_category: str = None) -> List[Tuple[Any, float]]:
+        """
+        Returns the top_k (vector_id, cosine similarity) pairs, most similar first.
+        Apply grammar_category filter *after* finding nearest neighbors, like VectorIndex.
+        """
+        if not self._metadata or len(query_vector) != self.dimension or top_k <= 0:
+            return []
+
+        with self._lock:
+            found = self._matrix.mas_similares(query_vector, k=top_k)
+            if grammar_category is None:
+                return found
+            return [(vector_id, sim) for vector_id, sim in found
+                    if self._metadata[vector_id].get('grammar_category') == grammar_category]
+
+    def remove_vector(self, vector_id: Any):
+        """Removes a vector and its metadata from the index in O(dimension)."""
+        with self._lock:
+            if vector_id not in self._metadata:
+                print(f"Warning: Vector ID {vector_id} not found in index.")
+                return
+            self._matrix.eliminar(vector_id)
+            del self._norms[vector_id]
+            del self._metadata[vector_id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Size and memory of the index."""
+        capacity = self._matrix._matriz.shape[0] if self._matrix is not None else 0
+        return {
+            'backend': 'flat',
+            'size': len(self),
+            'dimension': self.dimension,
+            'capacity': capacity,
+            'matrix_bytes': self._matrix._matriz.nbytes if self._matrix is not None else 0
+        }
+
+
+INDEX_BACKENDS = {
+    'flat': FlatVectorIndex,
+    'kdtree': VectorIndex,
+    'hnsw': HNSWIndex,
+    'ivfpq': IVFPQIndex,
+}
+
+
+def create_index(backend: str = 'flat', **kwargs):
+    """Creates a vector index by backend name ('flat', 'kdtree', 'hnsw' or 'ivfpq').
+
+    Every backend has add_vector/upsert, build, search_similar, remove_vector,
+    get_vector, get_metadata, get_stats and len(). search_similar's
+    grammar_category keeps only the matching pairs among the top_k nearest.
+    """
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown vector index backend: {backend}")
+    return INDEX_BACKENDS[backend](**kwargs)
+
+
+# Instancia global mínima funcional para importación
+embedding_index = create_index('flat')
+# (Eliminada la línea duplicada de embedding_index)
+# index_manager mínimo para compatibilidad con razonador_optimizado.py
+class IndexManager:
+    def optimize_all(self):
+        # Implementación mínima: no hace nada
+        pass
+
+    def get_all_stats(self):
+        return {'embedding_index': embedding_index.get_stats()}
 
-    def _find_node_by_id(self, node: KDNode | None, vector_id: Any) -> KDNode | None:
-        """Recursive helper to find a node by ID (does not skip removed)."""
-        if node is None:
-            return None
-        if node.vector_id == vector_id:
-            return node
-        left_result = self._find_node_by_id(node.left, vector_id)
-        if left_result:
-            return left_result
-        right_result = self._find_node_by_id(node.right, vector_id)
-        return right_result
+index_manager = IndexManager()
 
 
 # Example Usage (for testing purposes) - Update this to reflect the new structure
@@ -297,18 +655,3 @@ if __name__ == "__main__":
     print(f"Exact match search results: {exact_match_results}")
     print("------------------------\n")
     # --- End Temporary Exact Match Test Case ---
-    
-# Instancia global mínima funcional para importación
-embedding_index = VectorIndex()
-# (Eliminada la línea duplicada de embedding_index)
-# index_manager mínimo para compatibilidad con razonador_optimizado.py
-class IndexManager:
-    def optimize_all(self):
-        # Implementación mínima: no hace nada
-        pass
-
-    def get_all_stats(self):
-        # Implementación mínima: retorna diccionario vacío
-        return {}
-
-index_manager = IndexManager()
\ No newline at end of file
@@ -0,0 +1,578 @@
+import os
+import pickle
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .matriz_vectores import MatrizNormalizada, _seleccionar
+
+
+PQ_CODEWORDS = 256 # One byte per sub-vector code
+
+
+def _nearest_centroids(data: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    """Index of the L2-nearest centroid for every row (chunked to bound memory)."""
+    half_norms = 0.5 * np.einsum('ij,ij->i', centroids, centroids)
+    assignment = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), chunk):
+        block = data[start:start + chunk]
+        # argmin ||x - c||^2 == argmax (x.c - ||c||^2 / 2)
+        assignment[start:start + chunk] = np.argmax(block @ centroids.T - half_norms, axis=1)
+    return assignment
+
+
+def kmeans(data: np.ndarray, k: int, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """Lloyd's k-means; returns (k, dim) float32 centroids.
+
+    Empty clusters are re-seeded with the points farthest from their centroid.
+    """
+    data = np.asarray(data, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=len(data) < k)].copy()
+    for _ in range(iterations):
+        assignment = _nearest_centroids(data, centroids)
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=k)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts[filled])[:-1]))
+        centroids[filled] = np.add.reduceat(data[order], starts, axis=0) / counts[filled, None]
+
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            errors = np.einsum('ij,ij->i', data - centroids[assignment], data - centroids[assignment])
+            farthest = np.argpartition(-errors, min(len(empty), len(data)) - 1)[:len(empty)]
+            centroids[empty[:len(farthest)]] = data[farthest]
+    return centroids
+
+
+def _default_pool_key(vector_id: Any, metadata: Dict[str, Any]) -> Optional[str]:
+    return metadata.get('pool_key')
+
+
+class _InvertedList:
+    """Codes, norms and IDs of the vectors assigned to one coarse centroid."""
+    __slots__ = ('codes', 'norms', 'ids', 'size')
+
+    def __init__(self, code_size: int, capacity: int = 16):
+        self.codes = np.zeros((capacity, code_size), dtype=np.uint8)
+        self.norms = np.zeros(capacity, dtype=np.float32)
+        self.ids: List[Any] = []
+        self.size = 0
+
+    def append(self, vector_ids: List[Any], codes: np.ndarray, norms: np.ndarray) -> int:
+        """Appends rows and returns the position of the first one."""
+        start, end = self.size, self.size + len(vector_ids)
+        if end > self.codes.shape[0]:
+            capacity = max(end, self.codes.shape[0] * 2)
+            grown = np.zeros((capacity, self.codes.shape[1]), dtype=np.uint8)
+            grown[:start] = self.codes[:start]
+            grown_norms = np.zeros(capacity, dtype=np.float32)
+            grown_norms[:start] = self.norms[:start]
+            self.codes, self.norms = grown, grown_norms
+        self.codes[start:end] = codes
+        self.norms[start:end] = norms
+        self.ids.extend(vector_ids)
+        self.size = end
+        return start
+
+    def pop(self, position: int) -> Optional[Any]:
+        """Removes a row by moving the last one into its place; returns the moved ID."""
+        last = self.size - 1
+        moved = None
+        if position != last:
+            self.codes[position] = self.codes[last]
+            self.norms[position] = self.norms[last]
+            moved = self.ids[position] = self.ids[last]
+        self.ids.pop()
+        self.size = last
+        return moved
+
+
+class IVFPQIndex:
+    """
+    Compressed approximate index: an inverted file over k-means coarse
+    centroids, with each vector's residual product-quantized to one byte per
+    sub-vector (8 bytes for a 64-d vector instead of 256 as float32).
+
+    Vectors are unit-normalized, so cosine similarity is the inner product
+    q.x = q.c + q.r. A query builds one (n_subvectors, 256) table of q.r
+    partial products (asymmetric distance: the query is not quantized) and
+    scores every code in the n_probe closest lists with table lookups.
+
+    Full vectors are not kept. With `pool` (an EmbeddingPool) and `rerank`
+    > 0, the best `rerank` candidates are re-scored exactly from the pool;
+    `pool_key(vector_id, metadata)` names each vector's pool entry (by
+    default metadata['pool_key']).
+
+    Until `train_size` vectors have arrived (or train/build is called) the
+    index is exact over a MatrizNormalizada; it then trains the quantizers on
+    those vectors and encodes them.
+    """
+    def __init__(self, n_lists: int = 256, n_subvectors: int = 8, n_probe: int = 8,
+                 rerank: int = 0, pool=None, pool_key: Callable[[Any, Dict[str, Any]], Optional[str]] = None,
+                 train_size: Optional[int] = None, kmeans_iterations: int = 20, seed: int = 0):
+        self.n_lists = n_lists
+        self.n_subvectors = n_subvectors
+        self.n_probe = n_probe
+        self.rerank = rerank
+        self.pool = pool
+        self.pool_key = pool_key or _default_pool_key
+        self.train_size = train_size or max(n_lists, PQ_CODEWORDS) * 40
+        self.kmeans_iterations = kmeans_iterations
+        self.seed = seed
+
+        self.dimension: int | None = None
+        self.coarse: np.ndarray | None = None # (n_lists, dimension)
+        self.codebooks: np.ndarray | None = None # (n_subvectors, 256, sub_dimension)
+        self._lists: List[_InvertedList] = []
+        self._where: Dict[Any, Tuple[int, int]] = {} # ID -> (list, position)
+        self._metadata: Dict[Any, Dict[str, Any]] = {}
+        self._pending: MatrizNormalizada | None = None # Exact rows until trained
+        self._pending_norms: Dict[Any, float] = {}
+        self._lock = threading.RLock()
+        self._training = False # Single-flight guard for the automatic training in upsert
+        self.reranked = 0
+        self.rerank_misses = 0
+
+    def __len__(self) -> int:
+        return len(self._metadata)
+
+    def __contains__(self, vector_id: Any) -> bool:
+        return vector_id in self._metadata
+
+    @property
+    def _size(self) -> int:
+        return len(self._metadata)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.codebooks is not None
+
+    @staticmethod
+    def _normalize_rows(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        norms = np.linalg.norm(matrix, axis=1)
+        units = np.divide(matrix, norms[:, None], out=np.zeros_like(matrix), where=norms[:, None] > 0)
+        return units, norms.astype(np.float32)
+
+    # --- Training and encoding ---
+
+    def train(self, sample):
+        """Trains the coarse centroids and PQ codebooks on a sample of vectors.
+
+        k-means runs without the lock; the new quantizers are then swapped in
+        under it and every vector present at that moment (pending, or encoded
+        with the previous quantizers) is re-encoded, so retraining a trained
+        index loses nothing. Already encoded vectors are re-encoded from the
+        pool when it has them, otherwise from their PQ reconstruction.
+        """
+        sample = np.asarray(sample, dtype=np.float32)
+        if sample.ndim != 2 or len(sample) == 0:
+            raise ValueError("train expects a non-empty (n, dimension) matrix")
+        dimension = sample.shape[1]
+        if dimension % self.n_subvectors:
+            raise ValueError(f"Dimension {dimension} is not divisible by n_subvectors={self.n_subvectors}")
+        if self.dimension is not None and dimension != self.dimension:
+            raise ValueError(f"Vector dimension mismatch. Expected {self.dimension}, got {dimension}.")
+
+        units, _ = self._normalize_rows(sample)
+        n_lists = min(self.n_lists, len(units))
+        coarse = kmeans(units, n_lists, self.kmeans_iterations, self.seed)
+        residuals = units - coarse[_nearest_centroids(units, coarse)]
+        sub_dimension = dimension // self.n_subvectors
+        codebooks = np.stack([
+            kmeans(residuals[:, j * sub_dimension:(j + 1) * sub_dimension], PQ_CODEWORDS,
+                   self.kmeans_iterations, self.seed + j + 1)
+            for j in range(self.n_subvectors)
+        ])
+
+        with self._lock:
+            ids, units, norms = self._live_rows()
+            self.dimension = dimension
+            self.coarse = coarse
+            self.codebooks = codebooks
+            self._lists = [_InvertedList(self.n_subvectors) for _ in range(n_lists)]
+            self._where.clear()
+            self._pending = None
+            self._pending_norms = {}
+            if ids:
+                self._append_encoded(ids, units, norms)
+
+    def _live_rows(self) -> Tuple[List[Any], np.ndarray, np.ndarray]:
+        """(ids, unit rows, norms) of every stored vector (caller holds the lock)."""
+        ids: List[Any] = []
+        blocks: List[np.ndarray] = []
+        norms: List[np.ndarray] = []
+        if self._pending is not None and len(self._pending):
+            ids.extend(self._pending.claves)
+            blocks.append(self._pending.matriz.copy())
+            norms.append(np.array([self._pending_norms[vector_id] for vector_id in self._pending.claves],
+                                  dtype=np.float32))
+        for list_id, inverted in enumerate(self._lists):
+            if not inverted.size:
+                continue
+            approximate = self._decode(list_id, inverted.codes[:inverted.size])
+            for row, vector_id in enumerate(inverted.ids):
+                exact = self._exact(vector_id, self._metadata[vector_id])
+                if exact is not None:
+                    approximate[row] = np.asarray(exact, dtype=np.float32)
+            units, _ = self._normalize_rows(approximate.astype(np.float32))
+            ids.extend(inverted.ids)
+            blocks.append(units)
+            norms.append(inverted.norms[:inverted.size].copy())
+        if not ids:
+            return ids, np.zeros((0, self.dimension or 0), dtype=np.float32), np.zeros(0, dtype=np.float32)
+        return ids, np.concatenate(blocks), np.concatenate(norms)
+
+    def _encode(self, units: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(coarse list, PQ codes) of unit vectors."""
+        lists = _nearest_centroids(units, self.coarse)
+        residuals = units - self.coarse[lists]
+        sub_dimension = self.dimension // self.n_subvectors
+        codes = np.empty((len(units), self.n_subvectors), dtype=np.uint8)
+        for j in range(self.n_subvectors):
+            codes[:, j] = _nearest_centroids(residuals[:, j * sub_dimension:(j + 1) * sub_dimension],
+                                             self.codebooks[j])
+        return lists, codes
+
+    def _append_encoded(self, ids: List[Any], units: np.ndarray, norms: np.ndarray):
+        """Encodes unit vectors and appends them to their lists (caller holds the lock)."""
+        lists, codes = self._encode(units)
+        order = np.argsort(lists, kind='stable')
+        bounds = np.flatnonzero(np.diff(lists[order])) + 1
+        for group in np.split(order, bounds):
+            if len(group) == 0:
+                continue
+            list_id = int(lists[group[0]])
+            group_ids = [ids[i] for i in group]
+            start = self._lists[list_id].append(group_ids, codes[group], norms[group])
+            for offset, vector_id in enumerate(group_ids):
+                self._where[vector_id] = (list_id, start + offset)
+
+    def _decode(self, list_id: int, codes: np.ndarray) -> np.ndarray:
+        """Approximate unit vectors from a list's centroid and PQ codes."""
+        residual = self.codebooks[np.arange(self.n_subvectors), codes].reshape(len(codes), -1)
+        return self.coarse[list_id] + residual
+
+    # --- Insertion and removal ---
+
+    def _discard(self, vector_id: Any):
+        """Drops an ID from the lists or the pending matrix (caller holds the lock)."""
+        where = self._where.pop(vector_id, None)
+        if where is not None:
+            list_id, position = where
+            moved = self._lists[list_id].pop(position)
+            if moved is not None:
+                self._where[moved] = (list_id, position)
+        elif self._pending is not None and self._pending.eliminar(vector_id):
+            self._pending_norms.pop(vector_id, None)
+        self._metadata.pop(vector_id, None)
+
+    def add_vector(self, vector_id: Any, vector: List[float], metadata: Dict[str, Any] = None, category: Any = None):
+        """Adds a vector and its metadata; an existing ID is replaced (see upsert)."""
+        self.upsert(vector_id, vector, metadata, category)
+
+    def upsert(self, vector_id: Any, vector: List[float], metadata: Dict[str, Any] = None, category: Any = None):
+        """Inserts or replaces a vector, training the quantizers once train_size vectors have arrived."""
+        if self.dimension is None:
+            self.dimension = len(vector)
+        elif len(vector) != self.dimension:
+            print(f"Error: Vector dimension mismatch. Expected {self.dimension}, got {len(vector)}.")
+            return
+
+        if metadata is None:
+            metadata = {}
+
+        if category is not None:
+            metadata = dict(metadata)  # avoid mutating input
+            metadata['category'] = category
+
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._discard(vector_id)
+            self._metadata[vector_id] = metadata
+            if self.is_trained:
+                units, norms = self._normalize_rows(vector[None, :])
+                self._append_encoded([vector_id], units, norms)
+                return
+            if self._pending is None:
+                self._pending = MatrizNormalizada(self.dimension)
+            self._pending.agregar(vector_id, vector)
+            self._pending_norms[vector_id] = float(np.linalg.norm(vector))
+            if (self._training or len(self._pending) < self.train_size
+                    or self.dimension % self.n_subvectors):
+                return
+            # Only one writer trains; the others keep adding to _pending,
+            # which train() re-encodes when it swaps the quantizers in
+            self._training = True
+            sample = self._pending.matriz.copy()
+        try:
+            self.train(sample)
+        finally:
+            self._training = False
+
+    def build(self, ids: List[Any], matrix, metadata: Optional[List[Dict[str, Any]]] = None,
+              train_sample: int = 65536):
+        """Bulk load: trains on a random sample of the rows if needed, then encodes all rows at once."""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[0] != len(ids):
+            raise ValueError("build expects one matrix row per ID")
+        if metadata is not None and len(metadata) != len(ids):
+            raise ValueError("build expects one metadata dict per ID")
+        if len(ids) == 0:
+            return
+        if not self.is_trained:
+            rng = np.random.default_rng(self.seed)
+            sample = matrix if len(matrix) <= train_sample else matrix[rng.choice(len(matrix), train_sample, replace=False)]
+            self.train(sample)
+
+        units, norms = self._normalize_rows(matrix)
+        with self._lock:
+            for i, vector_id in enumerate(ids):
+                self._discard(vector_id)
+                self._metadata[vector_id] = metadata[i] if metadata is not None else {}
+            self._append_encoded(list(ids), units, norms)
+
+    def remove_vector(self, vector_id: Any):
+        """Removes a vector by ID (the last row of its list fills the gap)."""
+        with self._lock:
+            if vector_id not in self._metadata:
+                print(f"Warning: Vector ID {vector_id} not found in index.")
+                return
+            self._discard(vector_id)
+
+    # --- Lookups ---
+
+    def get_vector(self, vector_id: Any) -> np.ndarray | None:
+        """Exact vector from the pool when available, otherwise the PQ reconstruction."""
+        with self._lock:
+            metadata = self._metadata.get(vector_id)
+            if metadata is None:
+                return None
+            if self._pending is not None and vector_id in self._pending:
+                return self._pending.vector(vector_id) * self._pending_norms[vector_id]
+            exact = self._exact(vector_id, metadata)
+            if exact is not None:
+                return np.asarray(exact, dtype=np.float32)
+            list_id, position = self._where[vector_id]
+            inverted = self._lists[list_id]
+            approximate = self._decode(list_id, inverted.codes[position:position + 1])[0]
+            return (approximate * inverted.norms[position]).astype(np.float32)
+
+    def get_metadata(self, vector_id: Any) -> Dict[str, Any] | None:
+        """Retrieves metadata by vector ID in O(1)."""
+        return self._metadata.get(vector_id)
+
+    def _exact(self, vector_id: Any, metadata: Dict[str, Any]) -> Optional[np.ndarray]:
+        if self.pool is None:
+            return None
+        key = self.pool_key(vector_id, metadata)
+        return self.pool.get_embedding(key) if key is not None else None
+
+    # --- Search ---
+
+    def search_similar(self, query_vector: List[float], top_k: int = 5, grammar_category: str = None,
+                       n_probe: Optional[int] = None, rerank: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """
+        Returns about the top_k (vector_id, cosine similarity) pairs, most similar first.
+        Apply grammar_category filter *after* finding nearest neighbors, like VectorIndex.
+        """
+        if self.dimension is None or len(query_vector) != self.dimension or top_k <= 0:
+            return []
+        query = MatrizNormalizada.normalizar(query_vector)
+        rerank = self.rerank if rerank is None else rerank
+
+        with self._lock:
+            if not self.is_trained:
+                if self._pending is None:
+                    return []
+                found = self._pending.mas_similares(query, k=top_k)
+            else:
+                found = self._search_codes(query, max(top_k, rerank), n_probe or self.n_probe)
+                if rerank > 0 and self.pool is not None:
+                    found = self._rerank(query, found)
+                found = found[:top_k]
+
+        results = []
+        for vector_id, sim in found:
+            if grammar_category is None or self._metadata[vector_id].get('grammar_category') == grammar_category:
+                results.append((vector_id, sim))
+        return results
+
+    def _search_codes(self, query: np.ndarray, count: int, n_probe: int) -> List[Tuple[Any, float]]:
+        """Top `count` candidates by ADC score over the n_probe best lists (caller holds the lock)."""
+        coarse_scores = self.coarse @ query
+        n_probe = min(n_probe, len(self._lists))
+        probed = np.argpartition(-coarse_scores, n_probe - 1)[:n_probe]
+        probed = [int(list_id) for list_id in probed if self._lists[list_id].size]
+        if not probed:
+            return []
+
+        # Asymmetric distance table: q_j . codeword for every sub-space j
+        sub_queries = query.reshape(self.n_subvectors, -1)
+        table = np.einsum('jd,jkd->jk', sub_queries, self.codebooks).ravel()
+        offsets = np.arange(self.n_subvectors) * PQ_CODEWORDS
+
+        sizes = [self._lists[list_id].size for list_id in probed]
+        codes = np.concatenate([self._lists[list_id].codes[:size] for list_id, size in zip(probed, sizes)])
+        scores = table[codes + offsets].sum(axis=1) + np.repeat(coarse_scores[probed], sizes)
+
+        starts = np.cumsum([0] + sizes)
+        results = []
+        for flat, score in _seleccionar(range(len(scores)), scores, count, None):
+            block = int(np.searchsorted(starts, flat, side='right')) - 1
+            inverted = self._lists[probed[block]]
+            results.append((inverted.ids[flat - int(starts[block])], score))
+        return results
+
+    def _rerank(self, query: np.ndarray, candidates: List[Tuple[Any, float]]) -> List[Tuple[Any, float]]:
+        """Re-scores candidates exactly from the pool; missing ones keep their ADC score."""
+        rescored = []
+        for vector_id, score in candidates:
+            exact = self._exact(vector_id, self._metadata[vector_id])
+            if exact is None:
+                self.rerank_misses += 1
+            else:
+                self.reranked += 1
+                score = float(MatrizNormalizada.normalizar(exact) @ query)
+            rescored.append((vector_id, score))
+        rescored.sort(key=lambda pair: pair[1], reverse=True)
+        return rescored
+
+    # --- Persistence ---
+
+    def save(self, path: str):
+        """Writes the index to a single file (atomic: temporary file + rename).
+
+        The pool and pool_key are not saved; pass them again to load.
+        """
+        with self._lock:
+            state = {
+                'format': 1,
+                'params': {'n_lists': self.n_lists, 'n_subvectors': self.n_subvectors,
+                           'n_probe': self.n_probe, 'rerank': self.rerank,
+                           'train_size': self.train_size, 'kmeans_iterations': self.kmeans_iterations,
+                           'seed': self.seed},
+                'dimension': self.dimension,
+                'coarse': self.coarse,
+                'codebooks': self.codebooks,
+                'lists': [(inverted.codes[:inverted.size].copy(), inverted.norms[:inverted.size].copy(),
+                           list(inverted.ids)) for inverted in self._lists],
+                'metadata': dict(self._metadata),
+                'pending': (list(self._pending.claves), self._pending.matriz.copy(), dict(self._pending_norms))
+                if self._pending is not None else None,
+            }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path: str, pool=None, pool_key=None) -> "IVFPQIndex":
+        """Loads an index written by save."""
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('format') != 1:
+            raise ValueError(f"Unsupported IVF-PQ index format in {path}")
+        index = cls(pool=pool, pool_key=pool_key, **state['params'])
+        index.dimension = state['dimension']
+        index.coarse = state['coarse']
+        index.codebooks = state['codebooks']
+        index._metadata = state['metadata']
+        for list_id, (codes, norms, ids) in enumerate(state['lists']):
+            inverted = _InvertedList(index.n_subvectors, max(16, len(ids)))
+            inverted.append(ids, codes, norms)
+            index._lists.append(inverted)
+            for position, vector_id in enumerate(ids):
+                index._where[vector_id] = (list_id, position)
+        if state['pending'] is not None:
+            ids, units, norms = state['pending']
+            index._pending = MatrizNormalizada(index.dimension, max(1024, len(ids)))
+            for vector_id, unit in zip(ids, units):
+                index._pending.agregar(vector_id, unit)
+            index._pending_norms = norms
+        return index
+
+    # --- Quality and stats ---
+
+    def measure_recall(self, queries, ids: List[Any], matrix, k: int = 10,
+                       n_probe: Optional[int] = None, rerank: Optional[int] = None) -> Dict[str, Any]:
+        """Recall@k against an exact scan of (ids, matrix), plus mean query latency.
+
+        The index keeps no full vectors, so the reference set is passed in.
+        """
+        reference = MatrizNormalizada(np.asarray(matrix).shape[1], max(1, len(ids)))
+        for vector_id, vector in zip(ids, matrix):
+            reference.agregar(vector_id, vector)
+        queries = np.asarray(queries, dtype=np.float32)
+        hits = 0
+        elapsed = 0.0
+        for query in queries:
+            truth = {vector_id for vector_id, _ in reference.mas_similares(query, k=k)}
+            start = time.perf_counter()
+            found = self.search_similar(query, top_k=k, n_probe=n_probe, rerank=rerank)
+            elapsed += time.perf_counter() - start
+            hits += len(truth & {vector_id for vector_id, _ in found})
+        return {
+            'recall': hits / (k * len(queries)) if len(queries) else 0.0,
+            'k': k,
+            'n_probe': n_probe or self.n_probe,
+            'rerank': self.rerank if rerank is None else rerank,
+            'queries': len(queries),
+            'mean_query_ms': elapsed / len(queries) * 1000 if len(queries) else 0.0
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Size, training state, list balance and memory of the index."""
+        with self._lock:
+            sizes = [inverted.size for inverted in self._lists]
+            code_bytes = sum(inverted.codes.nbytes + inverted.norms.nbytes for inverted in self._lists)
+            return {
+                'backend': 'ivfpq',
+                'size': len(self._metadata),
+                'dimension': self.dimension,
+                'trained': self.is_trained,
+                'pending': len(self._pending) if self._pending is not None else 0,
+                'n_lists': len(self._lists) or self.n_lists,
+                'n_subvectors': self.n_subvectors,
+                'n_probe': self.n_probe,
+                'rerank': self.rerank,
+                'bytes_per_vector': self.n_subvectors + 4, # Codes + float32 norm
+                'code_bytes': code_bytes,
+                'largest_list': max(sizes) if sizes else 0,
+                'reranked': self.reranked,
+                'rerank_misses': self.rerank_misses
+            }
+
+
+if __name__ == "__main__":
+    # Regression checks: retraining and concurrent automatic training keep every vector
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((5000, 32)).astype(np.float32)
+
+    index = IVFPQIndex(n_lists=16)
+    index.build(list(range(5000)), X)
+    index.train(X[:2000])
+    assert len(index) == 5000 and len(index._where) == 5000
+    assert index.search_similar(X[4999], top_k=5)
+    assert index.get_vector(4999) is not None
+    print("Retrain keeps all vectors: OK")
+
+    index = IVFPQIndex(n_lists=16, train_size=300)
+    writers = [threading.Thread(target=lambda offset=offset: [index.add_vector(offset * 4000 + i, X[i % 5000])
+                                                           for i in range(4000)])
+               for offset in range(8)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    lost = [vector_id for vector_id in index._metadata
+            if vector_id not in index._where and (index._pending is None or vector_id not in index._pending)]
+    assert index.is_trained and len(index) == 32000 and not lost, f"{len(lost)} lost IDs"
+    print("Concurrent automatic training keeps all vectors: OK")
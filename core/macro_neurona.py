@@ -1,7 +1,7 @@
-from core.micro_neurona import MicroNeurona
+from core.embedding_engine import embedding_engine
 
 class MacroNeurona:
-    def __init__(self, id, nombre, condiciones_n, umbral=0.5, exclusiones_mn=None, metadata=None):
+    def __init__(self, id, nombre, condiciones_n, umbral=0.5, exclusiones_mn=None, metadata=None, embedding=None):
         self.id = id
         self.nombre = nombre
         self.condiciones_n = condiciones_n
@@ -11,7 +11,7 @@ class MacroNeurona:
         self.metadata = metadata if metadata is not None else {}
         self.activa = False
         self.historial_activacion = []
-        self.embedding = MicroNeurona('tmp', nombre, 'tmp').calcular_embedding(nombre, dim=64)
+        self.embedding = embedding if embedding is not None else embedding_engine.calcular_embedding(nombre, dim=64)
 
     # <<< IMPORTANTE: La firma del método ha cambiado >>>
     # Ahora necesita saber tanto las Neuronas activas (para sus condiciones)
@@ -0,0 +1,223 @@
+"""
+Matriz de Vectores Normalizados para Krystal AI
+Mantiene vectores unitarios (float32 o cuantizados a 8 bits) en matrices contiguas para búsquedas por similitud coseno.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class MatrizNormalizada:
+    """Matriz de filas unitarias float32 con mapa clave -> fila.
+
+    Insertar es O(dim) amortizado (la capacidad crece al doble) y borrar es
+    O(dim): la última fila ocupa el hueco. Una consulta de similitud coseno
+    es un único producto matriz-vector seguido de una selección parcial.
+    """
+
+    def __init__(self, dim: int, capacidad_inicial: int = 1024):
+        self.dim = dim
+        self._matriz = np.zeros((capacidad_inicial, dim), dtype=np.float32)
+        self._claves: List[str] = []
+        self._filas: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._claves)
+
+    def __contains__(self, clave: str) -> bool:
+        return clave in self._filas
+
+    @property
+    def matriz(self) -> np.ndarray:
+        """Vista (n, dim) de las filas ocupadas."""
+        return self._matriz[:len(self._claves)]
+
+    @property
+    def claves(self) -> List[str]:
+        """Clave de cada fila, en el orden de la matriz."""
+        return self._claves
+
+    @staticmethod
+    def normalizar(vector) -> np.ndarray:
+        """Devuelve el vector como float32 unitario (el vector nulo queda en ceros)."""
+        vector = np.asarray(vector, dtype=np.float32)
+        norma = float(np.linalg.norm(vector))
+        return vector / norma if norma > 0 else np.zeros_like(vector)
+
+    def agregar(self, clave: str, vector) -> int:
+        """Inserta o reemplaza el vector de una clave y devuelve su fila."""
+        fila = self._filas.get(clave)
+        if fila is None:
+            fila = len(self._claves)
+            if fila == self._matriz.shape[0]:
+                nueva = np.zeros((max(1, fila * 2), self.dim), dtype=np.float32)
+                nueva[:fila] = self._matriz
+                self._matriz = nueva
+            self._claves.append(clave)
+            self._filas[clave] = fila
+        self._matriz[fila] = self.normalizar(vector)
+        return fila
+
+    def eliminar(self, clave: str) -> bool:
+        """Quita una clave moviendo la última fila a su posición."""
+        fila = self._filas.pop(clave, None)
+        if fila is None:
+            return False
+        ultima = len(self._claves) - 1
+        ultima_clave = self._claves.pop()
+        if fila != ultima:
+            self._matriz[fila] = self._matriz[ultima]
+            self._claves[fila] = ultima_clave
+            self._filas[ultima_clave] = fila
+        return True
+
+    def vector(self, clave: str) -> Optional[np.ndarray]:
+        """Vector unitario de una clave (vista de sólo lectura)."""
+        fila = self._filas.get(clave)
+        if fila is None:
+            return None
+        vista = self._matriz[fila]
+        vista.flags.writeable = False
+        return vista
+
+    def similitudes(self, consulta) -> np.ndarray:
+        """Similitud coseno de la consulta contra todas las filas."""
+        return self.matriz @ self.normalizar(consulta)
+
+    def mas_similares(self, consulta, k: int = 10,
+                      umbral: Optional[float] = None) -> List[Tuple[str, float]]:
+        """Las k claves más similares a la consulta (con similitud >= umbral), de mayor a menor."""
+        if not self._claves or k <= 0:
+            return []
+
+        return _seleccionar(self._claves, self.similitudes(consulta), k, umbral)
+
+    def clear(self):
+        """Vacía la matriz conservando su capacidad."""
+        self._claves.clear()
+        self._filas.clear()
+
+
+class MatrizCuantizada:
+    """Matriz de vectores unitarios cuantizados a 8 bits con mapa clave -> fila.
+
+    Cada fila guarda códigos uint8 más su mínimo y su paso, de modo que
+    x ≈ minimo + paso * codigo. El producto escalar con una consulta se
+    calcula directamente sobre los códigos:
+    x · q = minimo * sum(q) + paso * (codigo · q).
+    Ocupa dim + 12 bytes por fila frente a 4 * dim de float32.
+    """
+
+    def __init__(self, dim: int, capacidad_inicial: int = 1024):
+        self.dim = dim
+        self._codigos = np.zeros((capacidad_inicial, dim), dtype=np.uint8)
+        self._minimos = np.zeros(capacidad_inicial, dtype=np.float32)
+        self._pasos = np.zeros(capacidad_inicial, dtype=np.float32)
+        self._normas = np.zeros(capacidad_inicial, dtype=np.float32)
+        self._claves: List[str] = []
+        self._filas: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._claves)
+
+    def __contains__(self, clave: str) -> bool:
+        return clave in self._filas
+
+    @property
+    def claves(self) -> List[str]:
+        return self._claves
+
+    @staticmethod
+    def bytes_por_fila(dim: int) -> int:
+        """Bytes de datos que ocupa una fila (códigos, mínimo, paso y norma)."""
+        return dim + 12
+
+    def _crecer(self):
+        capacidad = max(1, len(self._claves) * 2)
+        for nombre in ('_codigos', '_minimos', '_pasos', '_normas'):
+            viejo = getattr(self, nombre)
+            nuevo = np.zeros((capacidad,) + viejo.shape[1:], dtype=viejo.dtype)
+            nuevo[:len(viejo)] = viejo
+            setattr(self, nombre, nuevo)
+
+    def agregar(self, clave: str, vector) -> int:
+        """Cuantiza e inserta (o reemplaza) el vector unitario de una clave."""
+        fila = self._filas.get(clave)
+        if fila is None:
+            fila = len(self._claves)
+            if fila == self._codigos.shape[0]:
+                self._crecer()
+            self._claves.append(clave)
+            self._filas[clave] = fila
+
+        unitario = MatrizNormalizada.normalizar(vector)
+        minimo = float(unitario.min()) if unitario.size else 0.0
+        maximo = float(unitario.max()) if unitario.size else 0.0
+        paso = (maximo - minimo) / 255.0
+        if paso > 0:
+            codigos = np.rint((unitario - minimo) / paso)
+        else:
+            codigos = np.zeros_like(unitario)
+        self._codigos[fila] = codigos.astype(np.uint8)
+        self._minimos[fila] = minimo
+        self._pasos[fila] = paso
+        # Norma del vector reconstruido, para que el coseno aproximado quede en [-1, 1]
+        self._normas[fila] = np.linalg.norm(minimo + paso * self._codigos[fila].astype(np.float32))
+        return fila
+
+    def eliminar(self, clave: str) -> bool:
+        """Quita una clave moviendo la última fila a su posición."""
+        fila = self._filas.pop(clave, None)
+        if fila is None:
+            return False
+        ultima = len(self._claves) - 1
+        ultima_clave = self._claves.pop()
+        if fila != ultima:
+            for arreglo in (self._codigos, self._minimos, self._pasos, self._normas):
+                arreglo[fila] = arreglo[ultima]
+            self._claves[fila] = ultima_clave
+            self._filas[ultima_clave] = fila
+        return True
+
+    def vector(self, clave: str) -> Optional[np.ndarray]:
+        """Reconstrucción aproximada (float32) del vector unitario de una clave."""
+        fila = self._filas.get(clave)
+        if fila is None:
+            return None
+        return self._minimos[fila] + self._pasos[fila] * self._codigos[fila].astype(np.float32)
+
+    def similitudes(self, consulta) -> np.ndarray:
+        """Similitud coseno aproximada de la consulta contra todas las filas."""
+        n = len(self._claves)
+        q = MatrizNormalizada.normalizar(consulta)
+        productos = self._minimos[:n] * q.sum() + self._pasos[:n] * (self._codigos[:n] @ q)
+        normas = self._normas[:n]
+        return np.divide(productos, normas, out=np.zeros_like(productos), where=normas > 0)
+
+    def mas_similares(self, consulta, k: int = 10,
+                      umbral: Optional[float] = None) -> List[Tuple[str, float]]:
+        """Las k claves más similares a la consulta (con similitud >= umbral), de mayor a menor."""
+        if not self._claves or k <= 0:
+            return []
+        return _seleccionar(self._claves, self.similitudes(consulta), k, umbral)
+
+    def clear(self):
+        """Vacía la matriz conservando su capacidad."""
+        self._claves.clear()
+        self._filas.clear()
+
+
+def _seleccionar(claves: List[str], puntajes: np.ndarray, k: int,
+                 umbral: Optional[float]) -> List[Tuple[str, float]]:
+    """Top-k por selección parcial O(n) y orden sólo de los k elegidos."""
+    candidatos = np.arange(len(puntajes))
+    if umbral is not None:
+        candidatos = np.flatnonzero(puntajes >= umbral)
+
+    if len(candidatos) > k:
+        parte = np.argpartition(-puntajes[candidatos], k - 1)[:k]
+        candidatos = candidatos[parte]
+    candidatos = candidatos[np.argsort(-puntajes[candidatos], kind='stable')]
+
+    return [(claves[i], float(puntajes[i])) for i in candidatos]
@@ -1,10 +1,9 @@
 # --- ARCHIVO COMPLETO Y FINAL: core/micro_neurona.py ---
 
 import math
-import random
-import unicodedata
 from core.indices_vectoriales import VectorIndex
 from core.cache_manager import cache_manager
+from core.embedding_engine import embedding_engine, normalizar
 
 from typing import Tuple, List, Dict, Any
 
@@ -12,9 +11,12 @@ class MicroNeurona:
     def __init__(self, id, concepto, tipo, embedding=None, metadata=None, decay_rate=0.15, umbral_activacion=0.7): # Added umbral_activacion
         self.id = id
         self.concepto = concepto
+        self.concepto_normalizado = normalizar(concepto) if concepto else ""
         self.tipo = tipo
         # El embedding principal es puramente semántico, basado en el concepto.
         self.embedding = embedding if embedding is not None else self.calcular_embedding(concepto, dim=64)
+        # Identidad del embedding en la caché de similitudes (se calcula una vez)
+        self.embedding_id = cache_manager.registrar_vector(self.embedding)
         # La metadata contiene toda la riqueza dimensional y gramatical.
         self.metadata = metadata if metadata is not None else {}
 
@@ -29,56 +31,18 @@ class MicroNeurona:
         self.memoria_episodica = []
 
     def normalizar(self, texto):
-        texto = texto.lower()
-        texto = ''.join(c for c in unicodedata.normalize('NFD', texto) if unicodedata.category(c) != 'Mn')
-        texto = ''.join(c for c in texto if c.isalnum() or c.isspace())
-        texto = texto.strip()
-        return texto
+        return normalizar(texto)
 
     def calcular_embedding(self, texto, dim=64):
-        
-        def _generar_ngrams(palabra, min_n=2, max_n=5):
-            """Genera n-grams de caracteres para una palabra, incluyendo la palabra misma."""
-            # Añadimos la palabra original para que siempre tenga un vector base
-            ngrams = {palabra}
-            # Añadimos prefijos y sufijos para capturar inicios y finales
-            for i in range(1, min(len(palabra), max_n + 1)):
-                ngrams.add(palabra[:i]) # Prefijos
-                ngrams.add(palabra[-i:]) # Sufijos
-
-            for n in range(min_n, max_n + 1):
-                for i in range(len(palabra) - n + 1):
-                    ngrams.add(palabra[i:i+n])
-            return list(ngrams)
-
-        texto = self.normalizar(texto)
-        if not texto:
-            return [0.0] * dim
-
-        vec = [0.0] * dim
-        
-        # Usamos n-grams de la palabra completa para capturar subestructuras
-        ngrams = _generar_ngrams(texto)
-        
-        for ngram in ngrams:
-            # Usamos el hash del n-gram para la semilla
-            seed = abs(hash(ngram)) % (2**32)
-            rnd = random.Random(seed)
-            for j in range(dim):
-                # La contribución de cada n-gram se suma al vector
-                vec[j] += rnd.uniform(-1, 1)
-
-        # Normalizamos el vector final para tener una magnitud constante
-        norm = math.sqrt(sum(x*x for x in vec))
-        if norm > 0:
-            vec = [x / norm for x in vec]
-        return vec
-
-    def activar(self, vectores_entrada, frase_original=None, umbral=None, activation_fn=None):
+        # El motor compartido calcula los n-gramas y suma sus vectores base de forma vectorizada
+        return embedding_engine.calcular_embedding(texto, dim=dim)
+
+    def activar(self, vectores_entrada, frase_original=None, umbral=None, activation_fn=None, frase_normalizada=None):
         """
         Activa la micro-neurona con función de activación y umbral personalizables.
         activation_fn: callable(float) -> float, e.g. sigmoid, relu, tanh. Por defecto sigmoid.
         umbral: si None, usa self.umbral_activacion.
+        frase_normalizada: frase_original ya normalizada (p. ej. por TokenizadorFrases) para no repetirlo por neurona.
         """
         def sigmoid(x):
             return 1 / (1 + math.exp(-x))
@@ -95,7 +59,9 @@ class MicroNeurona:
 
         # Activación por nombre (para comprensión) - alta prioridad
         if frase_original and self.concepto:
-            if self.normalizar(self.concepto) in self.normalizar(frase_original):
+            if frase_normalizada is None:
+                frase_normalizada = self.normalizar(frase_original)
+            if self.concepto_normalizado in frase_normalizada:
                 initial_activation = 1.0 # High activation for direct match
                 activation_reason = 'NM'
 
@@ -103,7 +69,7 @@ class MicroNeurona:
         if initial_activation < 1.0 and vectores_entrada:
             max_sim = 0.0
             for i, vec_entrada in enumerate(vectores_entrada):
-                sim = self.similitud_coseno(self.embedding, vec_entrada)
+                sim = self.similitud_coseno(self.embedding, vec_entrada, id1=self.embedding_id)
                 if sim > max_sim:
                     max_sim = sim
 
@@ -125,7 +91,7 @@ class MicroNeurona:
 
         print(f"DEBUG: MicroNeurona {self.id} - Activation: {self.activation_level}, Active: {self.activa}, Reason: {activation_reason}, Func: {fn.__name__}, Threshold: {threshold}")
         return self.activa # Return boolean active state
-    async def activar_async(self, vectores_entrada, frase_original=None, umbral=0.7):
+    async def activar_async(self, vectores_entrada, frase_original=None, umbral=0.7, frase_normalizada=None):
         """
         Asynchronous method to activate the micro-neuron.
         Wraps the existing activar logic for parallel execution.
@@ -133,10 +99,13 @@ class MicroNeurona:
         # The existing activar method is synchronous, so we can just call it directly
         # within the async method. If it involved I/O or blocking operations,
         # we would use asyncio.to_thread or similar.
-        return self.activar(vectores_entrada, frase_original, umbral)
+        return self.activar(vectores_entrada, frase_original, umbral, frase_normalizada=frase_normalizada)
 
     @staticmethod
-    def similitud_coseno(vec1, vec2):
+    def similitud_coseno(vec1, vec2, id1=None, id2=None):
+        """Similitud coseno con caché simétrica por identidad de vector.
+        id1/id2: identidades ya conocidas (p. ej. self.embedding_id) para no recalcularlas.
+        """
         # Encapsula floats en listas o lanza error si no es secuencia ni float
         def ensure_sequence(v, name):
             if isinstance(v, float) or isinstance(v, int):
@@ -147,15 +116,19 @@ class MicroNeurona:
                 raise TypeError(f"{name} debe ser una secuencia (list, tuple, etc.) o float/int, no {type(v)}")
         vec1 = ensure_sequence(vec1, "vec1")
         vec2 = ensure_sequence(vec2, "vec2")
+        if id1 is None:
+            id1 = cache_manager.identidad_vector(vec1)
+        if id2 is None:
+            id2 = cache_manager.identidad_vector(vec2)
 
         # Check cache first
-        cached_sim = cache_manager.get_similarity(vec1, vec2)
+        cached_sim = cache_manager.get_similarity_ids(id1, id2)
         if cached_sim is not None:
             return cached_sim
 
         if vec1 is None or vec2 is None or len(vec1) != len(vec2):
             # Cache the zero result for consistency, though unlikely to be hit with None inputs
-            cache_manager.cache_similarity(vec1, vec2, 0.0)
+            cache_manager.cache_similarity_ids(id1, id2, 0.0)
             return 0.0
 
         dot = sum(a*b for a, b in zip(vec1, vec2))
@@ -165,12 +138,12 @@ class MicroNeurona:
         # Handle zero vectors
         if norm1 == 0 or norm2 == 0:
             # Cache the zero result
-            cache_manager.cache_similarity(vec1, vec2, 0.0)
+            cache_manager.cache_similarity_ids(id1, id2, 0.0)
             return 0.0
 
         sim = dot / (norm1 * norm2)
         # Cache the calculated similarity
-        cache_manager.cache_similarity(vec1, vec2, sim)
+        cache_manager.cache_similarity_ids(id1, id2, sim)
         return sim
 
     def reset(self):
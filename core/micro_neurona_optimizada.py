@@ -4,7 +4,6 @@ Versión mejorada con caché, índices vectoriales y paralelización.
 """
 
 import math
-import random
 import unicodedata
 import asyncio
 import time
@@ -12,8 +11,11 @@ import math
 from typing import List, Dict, Optional, Tuple, Any
 from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+
 from .cache_manager import cache_manager
 from .embedding_pool import embedding_pool
+from .embedding_engine import embedding_engine
 from .indices_vectoriales import embedding_index
 
 
@@ -24,6 +26,7 @@ class MicroNeuronaOptimizada:
                  embedding: Optional[List[float]] = None, metadata: Optional[Dict] = None):
         self.id = id
         self.concepto = concepto
+        self.concepto_normalizado = self.normalizar(concepto)
         self.tipo = tipo
         
         # Metadata enriquecida
@@ -45,15 +48,20 @@ class MicroNeuronaOptimizada:
         
         # Inicializar embedding
         self.embedding = self._get_or_compute_embedding(concepto, embedding)
+        # Identidad del embedding en la caché de similitudes (se calcula una vez)
+        self.embedding_id = cache_manager.registrar_vector(self.embedding)
         
         # Registrar en índice vectorial si no existe
         self._register_in_index()
     
-    def _get_or_compute_embedding(self, concepto: str, provided_embedding: Optional[List[float]]) -> List[float]:
-        """Obtiene embedding del pool o lo calcula si es necesario."""
+    def _get_or_compute_embedding(self, concepto: str, provided_embedding: Optional[List[float]]) -> np.ndarray:
+        """Obtiene embedding del pool o lo calcula si es necesario.
+        
+        El resultado es un array de sólo lectura compartido con el pool.
+        """
         if provided_embedding is not None:
             # Cachear el embedding proporcionado
-            embedding_pool.store_embedding(
+            return embedding_pool.store_embedding(
                 self.embedding_cache_key, 
                 provided_embedding,
                 {
@@ -62,21 +70,15 @@ class MicroNeuronaOptimizada:
                     'timestamp': time.time()
                 }
             )
-            return provided_embedding
         
         # Intentar obtener del pool
         cached_embedding = embedding_pool.get_embedding(self.embedding_cache_key)
         if cached_embedding is not None:
-            # Devuelve como lista, sea array o lista nativa
-            if hasattr(cached_embedding, "tolist"):
-                return cached_embedding.tolist()
             return cached_embedding
         
-        # Calcular nuevo embedding
-        embedding = self.calcular_embedding(concepto, dim=64)
-        
-        # Almacenar en pool
-        embedding_pool.store_embedding(
+        # Calcular nuevo embedding y almacenarlo en el pool
+        embedding = embedding_engine.calcular_vector(concepto, dim=64)
+        return embedding_pool.store_embedding(
             self.embedding_cache_key,
             embedding,
             {
@@ -85,8 +87,6 @@ class MicroNeuronaOptimizada:
                 'timestamp': time.time()
             }
         )
-        
-        return embedding
     
     def _register_in_index(self):
         """Registra la neurona en el índice vectorial."""
@@ -100,6 +100,7 @@ class MicroNeuronaOptimizada:
                 'concepto': self.concepto,
                 'tipo': self.tipo,
                 'categoria': category,
+                'pool_key': self.embedding_cache_key, # Re-rank exacto de IVFPQIndex
                 'timestamp': time.time()
             }
             
@@ -139,69 +140,17 @@ class MicroNeuronaOptimizada:
     
     def calcular_embedding(self, texto: str, dim: int = 64) -> List[float]:
         """Calcula embedding optimizado con caché."""
-        # Verificar caché primero
-        cached = cache_manager.get_embedding(texto, dim)
-        if cached is not None:
-            return cached
-        
-        # Calcular embedding
-        embedding = self._compute_embedding_internal(texto, dim)
-        
-        # Cachear resultado
-        cache_manager.cache_embedding(texto, dim, embedding)
-        
-        return embedding
-    
-    def _compute_embedding_internal(self, texto: str, dim: int = 64) -> List[float]:
-        """Cálculo interno del embedding con optimizaciones."""
-        def _generar_ngrams(palabra: str, min_n: int = 2, max_n: int = 5) -> List[str]:
-            """Genera n-grams optimizado."""
-            if not palabra:
-                return []
-            
-            ngrams = {palabra}  # Usar set para evitar duplicados
-            
-            # Prefijos y sufijos
-            for i in range(1, min(len(palabra), max_n + 1)):
-                ngrams.add(palabra[:i])
-                ngrams.add(palabra[-i:])
-            
-            # N-grams internos
-            for n in range(min_n, max_n + 1):
-                for i in range(len(palabra) - n + 1):
-                    ngrams.add(palabra[i:i+n])
-            
-            return list(ngrams)
-        
-        texto = self.normalizar(texto)
-        if not texto:
-            return [0.0] * dim
-        
-        # Usar listas para cálculos
-        vec = [0.0] * dim
-        
-        ngrams = _generar_ngrams(texto)
-        
-        for ngram in ngrams:
-            # Hash optimizado
-            seed = abs(hash(ngram)) % (2**32)
-            rnd = random.Random(seed)
-            
-            # Generar contribución del n-gram
-            contribution = [rnd.uniform(-1, 1) for _ in range(dim)]
-            for i in range(dim):
-                vec[i] += contribution[i]
-        
-        # Normalización
-        norm = math.sqrt(sum(x*x for x in vec))
-        if norm > 0:
-            vec = [x / norm for x in vec]
-        
-        return vec
+        # El motor consulta y alimenta la caché de embeddings por texto
+        return embedding_engine.calcular_embedding(texto, dim)
     
     def activar(self, vectores_entrada: List[List[float]], 
-               frase_original: Optional[str] = None, umbral: float = 0.7) -> bool:
-        """Activación optimizada con caché."""
+               frase_original: Optional[str] = None, umbral: float = 0.7,
+               frase_normalizada: Optional[str] = None) -> bool:
+        """Activación optimizada con caché.
+        
+        frase_normalizada evita normalizar la misma frase una vez por neurona
+        cuando la entrada ya viene de TokenizadorFrases.
+        """
         current_time = time.time()
         self.last_activation_time = current_time
         
@@ -216,10 +165,10 @@ class MicroNeuronaOptimizada:
         
         # Activación por nombre (alta prioridad)
         if frase_original and self.concepto:
-            concepto_norm = self.normalizar(self.concepto)
-            frase_norm = self.normalizar(frase_original)
+            if frase_normalizada is None:
+                frase_normalizada = self.normalizar(frase_original)
             
-            if concepto_norm in frase_norm:
+            if self.concepto_normalizado in frase_normalizada:
                 self.activa = True
                 self.confianza = 1.0
                 self.historial_activacion.append((self.confianza, True, 'NOMBRE'))
@@ -260,8 +209,9 @@ class MicroNeuronaOptimizada:
         max_sim = 0.0
         
         for vec_entrada in vectores_entrada:
-            # Verificar caché de similitud
-            cached_sim = cache_manager.get_similarity(self.embedding, vec_entrada)
+            # Verificar caché de similitud (par no ordenado, una sola entrada)
+            id_entrada = cache_manager.identidad_vector(vec_entrada)
+            cached_sim = cache_manager.get_similarity_ids(self.embedding_id, id_entrada)
             if cached_sim is not None:
                 sim = cached_sim
             else:
@@ -269,21 +219,23 @@ class MicroNeuronaOptimizada:
                 sim = self._cosine_similarity(self.embedding, vec_entrada)
                 
                 # Cachear similitud
-                cache_manager.cache_similarity(self.embedding, vec_entrada, sim)
+                cache_manager.cache_similarity_ids(self.embedding_id, id_entrada, sim)
             
             if sim > max_sim:
                 max_sim = sim
         
         return max_sim
     
-    def _cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
-        """Similitud coseno optimizada."""
-        if not vec1 or not vec2 or len(vec1) != len(vec2):
+    def _cosine_similarity(self, vec1, vec2) -> float:
+        """Similitud coseno optimizada (acepta listas o arrays, sin copiarlos si ya son float32)."""
+        if len(vec1) == 0 or len(vec2) == 0 or len(vec1) != len(vec2):
             return 0.0
         
-        dot_product = sum(a*b for a, b in zip(vec1, vec2))
-        norm1 = math.sqrt(sum(a*a for a in vec1))
-        norm2 = math.sqrt(sum(b*b for b in vec2))
+        vec1 = np.asarray(vec1, dtype=np.float32)
+        vec2 = np.asarray(vec2, dtype=np.float32)
+        dot_product = float(np.dot(vec1, vec2))
+        norm1 = float(np.linalg.norm(vec1))
+        norm2 = float(np.linalg.norm(vec2))
         
         if norm1 == 0 or norm2 == 0:
             return 0.0
@@ -308,19 +260,23 @@ class MicroNeuronaOptimizada:
         self.memoria_episodica.append(episodio)
     
     async def activar_async(self, vectores_entrada: List[List[float]], 
-                           frase_original: Optional[str] = None, umbral: float = 0.7) -> bool:
+                           frase_original: Optional[str] = None, umbral: float = 0.7,
+                           frase_normalizada: Optional[str] = None) -> bool:
         """Versión asíncrona de activación para paralelización."""
         # Ejecutar activación en thread pool para operaciones CPU-intensivas
         loop = asyncio.get_event_loop()
         with ThreadPoolExecutor(max_workers=1) as executor:
             result = await loop.run_in_executor(
-                executor, self.activar, vectores_entrada, frase_original, umbral
+                executor, self.activar, vectores_entrada, frase_original, umbral,
+                frase_normalizada
             )
         return result
     
     def buscar_similares(self, k: int = 5, threshold: float = 0.7) -> List[Tuple[str, float]]:
         """Busca micro-neuronas similares usando el índice vectorial."""
-        return []
+        resultados = embedding_index.search_similar(self.embedding, top_k=k + 1)
+        return [(vector_id, sim) for vector_id, sim in resultados
+                if vector_id != self.id and sim >= threshold][:k]
     
     def get_activation_stats(self) -> Dict[str, Any]:
         """Obtiene estadísticas de activación."""
@@ -372,7 +328,7 @@ class MicroNeuronaOptimizada:
             'id': self.id,
             'concepto': self.concepto,
             'tipo': self.tipo,
-            'embedding': self.embedding,
+            'embedding': self.embedding.tolist(),
             'metadata': self.metadata,
             'activa': self.activa,
             'confianza': self.confianza,
@@ -414,11 +370,12 @@ def migrate_from_old_microneurona(old_mn) -> MicroNeuronaOptimizada:
 def batch_activate_neurons(neurons: List[MicroNeuronaOptimizada], 
                           vectores_entrada: List[List[float]],
                           frase_original: Optional[str] = None,
-                          umbral: float = 0.7) -> List[bool]:
+                          umbral: float = 0.7,
+                          frase_normalizada: Optional[str] = None) -> List[bool]:
     """Activa múltiples neuronas en paralelo."""
     async def activate_all():
         tasks = [
-            neuron.activar_async(vectores_entrada, frase_original, umbral)
+            neuron.activar_async(vectores_entrada, frase_original, umbral, frase_normalizada)
             for neuron in neurons
         ]
         return await asyncio.gather(*tasks)
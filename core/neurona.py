@@ -1,8 +1,9 @@
 import math
-from core.micro_neurona import MicroNeurona
+from core.embedding_engine import embedding_engine
+from core.cache_manager import cache_manager
 
 class Neurona:
-    def __init__(self, id, nombre, condiciones_mn, umbral=0.5, exclusiones_mn=None, metadata=None, decay_rate=0.25):
+    def __init__(self, id, nombre, condiciones_mn, umbral=0.5, exclusiones_mn=None, metadata=None, decay_rate=0.25, embedding=None):
         self.id = id
         self.nombre = nombre
         self.condiciones_mn = condiciones_mn # List of input micro-neuron IDs
@@ -19,7 +20,7 @@ class Neurona:
         import random
         self.weights = {mn_id: random.uniform(-1, 1) for mn_id in self.condiciones_mn}
 
-        self.embedding = MicroNeurona('tmp', nombre, 'tmp').calcular_embedding(nombre, dim=64)
+        self.embedding = embedding if embedding is not None else embedding_engine.calcular_embedding(nombre, dim=64)
 
     def update_weights(self, input_activations, learning_rate=0.05):
         """
@@ -33,6 +34,8 @@ class Neurona:
                 self.weights[mn_id] += delta
         # Guardar historial para trazabilidad
         self.historial_pesos.append(self.weights.copy())
+        # Los resultados de evaluación cacheados con los pesos anteriores ya no valen
+        cache_manager.invalidate_neuron_caches(self.id)
 
     def evaluar(self, input_activations, umbral=None, activation_fn=None, micro_neuronas_dict=None, attention_window=10):
         """
@@ -0,0 +1,105 @@
+"""
+Pipeline de Pre-cálculo de Embeddings para Krystal AI
+Calcula embeddings de vocabularios grandes en un pool de procesos y los escribe al pool en bloque.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Sólo el motor: los procesos hijos importan este módulo y no deben crear
+# el EmbeddingPool global (abriría el almacén y registraría atexit).
+from .embedding_engine import embedding_engine
+
+
+def iter_words(path: str) -> Iterator[str]:
+    """Lee un vocabulario de un archivo de texto: una palabra o expresión por línea.
+
+    Ignora líneas vacías y comentarios que empiezan con '#'.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            word = line.strip()
+            if word and not word.startswith('#'):
+                yield word
+
+
+def _compute_chunk(args: Tuple[List[str], int]) -> Tuple[List[str], np.ndarray]:
+    """Calcula en un proceso hijo los embeddings de un bloque de palabras únicas."""
+    words, dim = args
+    # Sin caché: el proceso hijo no debe acumular estado
+    matrix, _ = embedding_engine.calcular_lote(words, dim, usar_cache=False)
+    return words, matrix
+
+
+def _default_metadata(word: str, dim: int) -> Dict:
+    return {
+        'word': word,
+        'dimension': dim,
+        'type': 'precomputed',
+        'timestamp': time.time()
+    }
+
+
+def precompute_embeddings(words: Optional[Iterable[str]] = None, path: Optional[str] = None,
+                          dim: int = 64, pool=None,
+                          key_format: str = "word_{word}_{dim}",
+                          metadata_factory: Callable[[str, int], Dict] = _default_metadata,
+                          workers: Optional[int] = None, chunk_size: int = 5000,
+                          skip_existing: bool = True,
+                          progress: Optional[Callable[[int, int], None]] = None) -> int:
+    """Pre-calcula embeddings de una lista de palabras o de un archivo y los guarda en el pool.
+
+    El cálculo se reparte en bloques de `chunk_size` palabras entre `workers`
+    procesos (por defecto, uno por CPU; 0 o 1 calcula en este proceso). No crea
+    micro-neuronas ni toca índices: sólo escribe en el pool con
+    `store_embeddings_bulk`. `progress(hechas, total)` se llama tras cada bloque.
+
+    Devuelve el número de embeddings escritos.
+    """
+    if pool is None:
+        from .embedding_pool import embedding_pool as pool
+
+    if words is None and path is None:
+        raise ValueError("Se requiere una lista de palabras o un archivo")
+    source = iter_words(path) if words is None else words
+
+    # Únicas, en orden, y sin las que ya están en el pool
+    pending = []
+    for word in dict.fromkeys(source):
+        if not skip_existing or not pool.is_persisted(key_format.format(word=word, dim=dim)):
+            pending.append(word)
+
+    total = len(pending)
+    if progress:
+        progress(0, total)
+    if not pending:
+        return 0
+
+    chunks = [(pending[i:i + chunk_size], dim) for i in range(0, total, chunk_size)]
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    done = 0
+
+    def store(chunk_words: List[str], matrix: np.ndarray):
+        nonlocal done
+        keys = [key_format.format(word=word, dim=dim) for word in chunk_words]
+        metadata = [metadata_factory(word, dim) for word in chunk_words]
+        pool.store_embeddings_bulk(keys, matrix, metadata)
+        done += len(chunk_words)
+        if progress:
+            progress(done, total)
+
+    if workers <= 1 or len(chunks) == 1:
+        for chunk in chunks:
+            store(*_compute_chunk(chunk))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+            for chunk_words, matrix in executor.map(_compute_chunk, chunks):
+                store(chunk_words, matrix)
+
+    return done
@@ -2,7 +2,7 @@ from core.micro_neurona import MicroNeurona
 from core.neurona import Neurona
 from core.macro_neurona import MacroNeurona
 from core.MemoryNs import registrar_memoria
-from core.indices_vectoriales import VectorIndex
+from core.indices_vectoriales import create_index
 import asyncio
 import concurrent.futures
 import threading
@@ -10,9 +10,10 @@ from typing import List, Tuple, Dict, Any
 from core.neural_events import NeuralEvent, NeuralEventPublisher
 from core.priority_manager import PriorityManager
 from core.neurona_interconectora import NeuronaInterconectora
+from core.tokenizador import TokenizadorFrases
 
 class Razonador:
-    def __init__(self, memoria, personalidad):
+    def __init__(self, memoria, personalidad, index_backend='flat'):
         self.memoria = memoria
         self.personalidad = personalidad
         self.micro_neuronas = {}
@@ -20,9 +21,6 @@ class Razonador:
         self.macro_neuronas = {}
         self.interconectoras = {}  # id: NeuronaInterconectora
 
-    def registrar_interconectora(self, interconectora):
-        self.interconectoras[interconectora.id] = interconectora
-
         # Initialize event publisher and priority manager
         self.event_publisher = NeuralEventPublisher()
         self.priority_manager = PriorityManager()
@@ -34,10 +32,17 @@ class Razonador:
         # Ya no hay separación entre comprensión y generación. Todas las palabras
         # con sus metadatos ricos viven en una sola lista para potenciar ambas capacidades.
         self.vocabulario_palabras_clave = []
-        self.vector_index = VectorIndex() # Add VectorIndex instance
+        # 'flat' es exacto; 'hnsw' es aproximado y conviene con vocabularios muy grandes
+        self.vector_index = create_index(index_backend)
+
+        # Tokenizador compartido: reconoce las expresiones multi-palabra del vocabulario
+        self.tokenizador = TokenizadorFrases()
         
         self.historial_ciclos = []
 
+    def registrar_interconectora(self, interconectora):
+        self.interconectoras[interconectora.id] = interconectora
+
     def meta_ajuste_parametros(self, window=10):
         """
         Meta-razonamiento: ajusta umbrales y tasas de decaimiento según desempeño reciente.
@@ -77,6 +82,7 @@ class Razonador:
         # El tipo 'palabra_clave' ahora es el estándar para todas las palabras del vocabulario.
         if mn.tipo == 'palabra_clave':
             self.vocabulario_palabras_clave.append(mn)
+            self.tokenizador.agregar_vocabulario([mn.concepto])
             # Add the neuron's vector and metadata to the index
             vector_id, vector, metadata = mn.get_index_data()
             self.vector_index.add_vector(vector_id, vector, metadata)
@@ -128,9 +134,19 @@ class Razonador:
 
         return results # Return the dictionary of final activation states
 
-    def procesar_entrada_iterativo(self, vectores_entrada, frase_original=None, umbral_mn=0.8, num_iteraciones=10):
+    def procesar_frase(self, frase, umbral_mn=0.8, num_iteraciones=10):
+        """
+        Codifica la frase una sola vez con el tokenizador y la procesa iterativamente.
+        """
+        codificada = self.tokenizador.codificar(frase)
+        return self.procesar_entrada_iterativo(codificada.vectores_entrada, frase_original=frase,
+                                               umbral_mn=umbral_mn, num_iteraciones=num_iteraciones,
+                                               frase_normalizada=codificada.frase_normalizada)
+
+    def procesar_entrada_iterativo(self, vectores_entrada, frase_original=None, umbral_mn=0.8, num_iteraciones=10, frase_normalizada=None):
         """
         Procesa la entrada iterativamente a través de las capas neuronales con feedback y memoria.
+        frase_normalizada: si se conoce (ver procesar_frase), se reutiliza en todas las micro-neuronas.
         """
         # Reset all neuron activations at the start of a new reasoning cycle
         self.reset()
@@ -163,7 +179,7 @@ class Razonador:
                 if similarity >= umbral_mn:
                     if mn_id in self.micro_neuronas and mn_id not in activated_mn_ids:
                         mn = self.micro_neuronas[mn_id]
-                        mn.activar(vectores_entrada, frase_original=frase_original, umbral=umbral_mn)
+                        mn.activar(vectores_entrada, frase_original=frase_original, umbral=umbral_mn, frase_normalizada=frase_normalizada)
                         if mn.activa:
                             activated_mn_ids.add(mn_id)
                             initial_activations[mn_id] = mn.confianza # Store initial confidence
@@ -4,6 +4,7 @@ Versión mejorada con paralelización, caché y gestión eficiente de memoria.
 """
 
 import asyncio
+import hashlib
 import time
 import threading
 from typing import Dict, List, Optional, Set, Tuple, Any
@@ -16,14 +17,18 @@ from .neurona import Neurona
 from .macro_neurona import MacroNeurona
 from .cache_manager import cache_manager
 from .embedding_pool import embedding_pool
+from .precompute import precompute_embeddings
+from .embedding_engine import embedding_engine
 from .indices_vectoriales import index_manager
 from .MemoryNs import registrar_memoria
+from .tokenizador import TokenizadorFrases
 
 
 class RazonadorOptimizado:
     """Razonador optimizado con paralelización y gestión inteligente de memoria."""
     
-    def __init__(self, memoria, personalidad, max_workers: int = 4):
+    def __init__(self, memoria, personalidad, max_workers: int = 4,
+                 snapshot_path: Optional[str] = None, snapshot_interval: float = 300):
         self.memoria = memoria
         self.personalidad = personalidad
         
@@ -35,6 +40,9 @@ class RazonadorOptimizado:
         # Vocabulario unificado optimizado
         self.vocabulario_palabras_clave: List[MicroNeuronaOptimizada] = []
         
+        # Tokenizador compartido: reconoce las expresiones multi-palabra del vocabulario
+        self.tokenizador = TokenizadorFrases()
+        
         # Índices para búsquedas rápidas
         self.neuronas_por_categoria: Dict[str, Set[str]] = defaultdict(set)
         self.neuronas_por_tipo: Dict[str, Set[str]] = defaultdict(set)
@@ -58,6 +66,10 @@ class RazonadorOptimizado:
         self.last_optimization = time.time()
         self.optimization_interval = 300  # 5 minutos
         
+        # Instantáneas de caché para arranque en caliente (ver iniciar_cache)
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        
         # Threading
         self.lock = threading.RLock()
     
@@ -65,6 +77,9 @@ class RazonadorOptimizado:
         """Registra una micro-neurona optimizada."""
         with self.lock:
             self.micro_neuronas[mn.id] = mn
+            # Una neurona nueva (o que reemplaza a otra con el mismo id) invalida
+            # sólo las activaciones cacheadas bajo ese id
+            cache_manager.invalidate_neuron_caches(mn.id)
             
             # Indexar por categoría y tipo
             categoria = mn.metadata.get('semantic_field', mn.tipo)
@@ -74,11 +89,13 @@ class RazonadorOptimizado:
             # Añadir al vocabulario si es palabra clave
             if mn.tipo == 'palabra_clave':
                 self.vocabulario_palabras_clave.append(mn)
+                self.tokenizador.agregar_vocabulario([mn.concepto])
     
     def registrar_neurona(self, n: Neurona):
         """Registra una neurona."""
         with self.lock:
             self.neuronas[n.id] = n
+            cache_manager.invalidate_neuron_caches(n.id)
     
     def registrar_macro_neurona(self, macro_n: MacroNeurona):
         """Registra una macro-neurona."""
@@ -118,9 +135,16 @@ class RazonadorOptimizado:
         for future in as_completed(futures):
             future.result()  # Esperar completación
     
+    def procesar_frase(self, frase: str, umbral_mn: float = 0.7) -> Dict[str, Any]:
+        """Codifica la frase una sola vez con el tokenizador y ejecuta el ciclo de activación."""
+        codificada = self.tokenizador.codificar(frase)
+        return self.ciclo_activacion(codificada.vectores_entrada, frase, umbral_mn,
+                                     frase_normalizada=codificada.frase_normalizada)
+    
     def ciclo_activacion(self, vectores_entrada: List[List[float]], 
                         frase_original: Optional[str] = None, 
-                        umbral_mn: float = 0.7) -> Dict[str, Any]:
+                        umbral_mn: float = 0.7,
+                        frase_normalizada: Optional[str] = None) -> Dict[str, Any]:
         """Ciclo de activación optimizado con paralelización."""
         start_time = time.time()
         
@@ -133,9 +157,11 @@ class RazonadorOptimizado:
             
             # Activación paralela de micro-neuronas
             if len(self.vocabulario_palabras_clave) > 50:
-                resultados = self._activar_paralelo(vectores_entrada, frase_original, umbral_mn)
+                resultados = self._activar_paralelo(vectores_entrada, frase_original, umbral_mn,
+                                                    frase_normalizada)
             else:
-                resultados = self._activar_secuencial(vectores_entrada, frase_original, umbral_mn)
+                resultados = self._activar_secuencial(vectores_entrada, frase_original, umbral_mn,
+                                                      frase_normalizada)
             
             # Guardar historial optimizado
             ciclo_info = {
@@ -156,22 +182,25 @@ class RazonadorOptimizado:
             return ciclo_info
     
     def _activar_paralelo(self, vectores_entrada: List[List[float]], 
-                         frase_original: Optional[str], umbral_mn: float) -> List[bool]:
+                         frase_original: Optional[str], umbral_mn: float,
+                         frase_normalizada: Optional[str] = None) -> List[bool]:
         """Activación paralela para grandes vocabularios."""
         # Usar la función batch optimizada
         return batch_activate_neurons(
             self.vocabulario_palabras_clave,
             vectores_entrada,
             frase_original,
-            umbral_mn
+            umbral_mn,
+            frase_normalizada
         )
     
     def _activar_secuencial(self, vectores_entrada: List[List[float]], 
-                           frase_original: Optional[str], umbral_mn: float) -> List[bool]:
+                           frase_original: Optional[str], umbral_mn: float,
+                           frase_normalizada: Optional[str] = None) -> List[bool]:
         """Activación secuencial para vocabularios pequeños."""
         resultados = []
         for mn in self.vocabulario_palabras_clave:
-            resultado = mn.activar(vectores_entrada, frase_original, umbral_mn)
+            resultado = mn.activar(vectores_entrada, frase_original, umbral_mn, frase_normalizada)
             resultados.append(resultado)
         return resultados
     
@@ -321,23 +350,67 @@ class RazonadorOptimizado:
         self.last_optimization = current_time
         print("Optimización de memoria completada.")
     
-    def precomputar_embeddings_comunes(self, palabras_comunes: List[str]):
-        """Pre-computa embeddings para palabras comunes."""
+    def precomputar_embeddings_comunes(self, palabras_comunes: List[str], progreso=None):
+        """Pre-computa embeddings para palabras comunes.
+        
+        Usa el pipeline en paralelo de core/precompute.py: no construye
+        micro-neuronas ni toca el índice vectorial. `progreso(hechas, total)`
+        informa del avance.
+        """
         print(f"Pre-computando embeddings para {len(palabras_comunes)} palabras...")
         
-        def compute_embedding(word):
-            mn_temp = MicroNeuronaOptimizada(f"temp_{word}", word, "temp")
-            return word, mn_temp.embedding
+        # Misma clave que usa MicroNeuronaOptimizada para encontrarlo en el pool
+        precompute_embeddings(
+            palabras_comunes, dim=64, pool=embedding_pool,
+            key_format="embedding_{word}_{dim}",
+            metadata_factory=lambda word, dim: {
+                'concepto': word,
+                'tipo': 'temp',
+                'timestamp': time.time()
+            },
+            progress=progreso
+        )
         
-        # Computar en paralelo
-        futures = [self.thread_pool.submit(compute_embedding, word) 
-                  for word in palabras_comunes]
+        print("Pre-cómputo completado.")
+    
+    def version_grafo(self) -> str:
+        """Huella del grafo de neuronas del que dependen las activaciones cacheadas.
         
-        for future in as_completed(futures):
-            word, embedding = future.result()
-            # El embedding ya se almacena automáticamente en el pool
+        Cubre micro-neuronas (id, concepto, tipo) y neuronas (id, condiciones,
+        exclusiones); no incluye pesos, que sólo afectan a la caché de
+        evaluación, que no se guarda en las instantáneas.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        with self.lock:
+            for mn_id in sorted(self.micro_neuronas):
+                mn = self.micro_neuronas[mn_id]
+                h.update(repr((mn.id, mn.concepto, mn.tipo)).encode('utf-8'))
+            for n_id in sorted(self.neuronas):
+                n = self.neuronas[n_id]
+                h.update(repr((n.id, list(n.condiciones_mn), sorted(n.exclusiones_mn))).encode('utf-8'))
+        return h.hexdigest()
+    
+    def _versiones_cache(self) -> Tuple[str, str]:
+        return embedding_engine.version, self.version_grafo()
+    
+    def iniciar_cache(self, snapshot_path: Optional[str] = None) -> int:
+        """Restaura la instantánea de caché y arranca las instantáneas periódicas.
         
-        print("Pre-cómputo completado.")
+        Debe llamarse con el grafo ya registrado: la instantánea sólo se usa si
+        coinciden la versión del motor de embeddings y la del grafo. Devuelve
+        el número de entradas restauradas.
+        """
+        if snapshot_path is not None:
+            self.snapshot_path = snapshot_path
+        if self.snapshot_path is None:
+            return 0
+        
+        restauradas = cache_manager.load_snapshot(self.snapshot_path, *self._versiones_cache())
+        if restauradas:
+            print(f"Caché restaurada desde {self.snapshot_path}: {restauradas} entradas")
+        cache_manager.start_snapshots(self.snapshot_path, self.snapshot_interval,
+                                      self._versiones_cache)
+        return restauradas
     
     def exportar_estadisticas(self) -> Dict[str, Any]:
         """Exporta estadísticas completas para análisis."""
@@ -353,6 +426,10 @@ class RazonadorOptimizado:
     def cleanup(self):
         """Limpia recursos y cierra pools de threads."""
         self.thread_pool.shutdown(wait=True)
+        if self.snapshot_path is not None:
+            # Última instantánea antes de vaciar las cachés
+            cache_manager.stop_snapshots(save=True)
+            self.snapshot_path = None
         cache_manager.clear_all_caches()
         print("Razonador optimizado limpiado.")
     
@@ -365,12 +442,17 @@ class RazonadorOptimizado:
 
 
 # Función de migración desde razonador original
-def migrar_desde_razonador_original(razonador_original, max_workers: int = 4) -> RazonadorOptimizado:
-    """Migra un razonador original al optimizado."""
+def migrar_desde_razonador_original(razonador_original, max_workers: int = 4,
+                                    snapshot_path: Optional[str] = None) -> RazonadorOptimizado:
+    """Migra un razonador original al optimizado.
+    
+    Con `snapshot_path`, restaura la caché guardada al terminar de migrar el grafo.
+    """
     razonador_opt = RazonadorOptimizado(
         razonador_original.memoria,
         razonador_original.personalidad,
-        max_workers=max_workers
+        max_workers=max_workers,
+        snapshot_path=snapshot_path
     )
     
     # Migrar micro-neuronas
@@ -391,4 +473,6 @@ def migrar_desde_razonador_original(razonador_original, max_workers: int = 4) ->
     for mn_id, macro_neurona in razonador_original.macro_neuronas.items():
         razonador_opt.registrar_macro_neurona(macro_neurona)
     
+    razonador_opt.iniciar_cache()
+    
     return razonador_opt
\ No newline at end of file
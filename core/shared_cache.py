@@ -0,0 +1,296 @@
+"""
+Caché en Memoria Compartida para Krystal AI
+Tabla hash de ranuras fijas en multiprocessing.shared_memory para compartir resultados entre procesos de un mismo host.
+"""
+
+import hashlib
+import pickle
+import struct
+import time
+import zlib
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+SHARED_CACHE_MAGIC = 0x4B52595354414C43  # "KRYSTALC"
+SHARED_CACHE_VERSION = 1
+
+# Tipos de valor (primer byte de los datos de cada ranura)
+_KIND_FLOAT = 1
+_KIND_FLOAT32 = 2
+_KIND_PICKLE = 3
+
+_CABECERA = 64  # bytes reservados antes de la tabla
+_MASCARA_CRC = 0xFFFFFFFF
+
+
+def _slot_dtype(max_value_bytes: int) -> np.dtype:
+    return np.dtype([
+        ('seq', np.uint32),       # seqlock: impar mientras se escribe
+        ('length', np.uint32),    # bytes usados de 'datos'
+        ('tag', np.uint64),       # huella de la clave (0 = ranura vacía)
+        ('expira', np.float64),   # vencimiento en reloj de pared (compartido entre procesos)
+        ('crc', np.uint32),       # crc32 de los datos, sembrado con la huella
+        ('_pad', np.uint32),
+        ('datos', np.uint8, (max_value_bytes,)),
+    ])
+
+
+def _hash_clave(key) -> Tuple[int, int]:
+    """(hash de cubeta, huella) de una clave, estables entre procesos.
+
+    El hash de str de Python se sala por proceso, así que se usa blake2b
+    sobre la representación de la clave (tuplas de str, int y float).
+    """
+    digest = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+
+def _codificar(value) -> bytes:
+    if isinstance(value, float):
+        return bytes((_KIND_FLOAT,)) + struct.pack('<d', value)
+    if isinstance(value, np.ndarray) and value.dtype == np.float32 and value.ndim == 1:
+        return bytes((_KIND_FLOAT32,)) + value.tobytes()
+    return bytes((_KIND_PICKLE,)) + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _decodificar(payload: bytes):
+    kind = payload[0]
+    if kind == _KIND_FLOAT:
+        return struct.unpack('<d', payload[1:9])[0]
+    if kind == _KIND_FLOAT32:
+        # frombuffer sobre bytes ya es de sólo lectura, como los embeddings del pool
+        return np.frombuffer(payload, dtype=np.float32, offset=1)
+    return pickle.loads(payload[1:])
+
+
+class SharedMemoryCache:
+    """Caché de tamaño fijo compartida por todos los procesos que abren el mismo nombre.
+
+    La tabla es asociativa por conjuntos: cada clave cae en una cubeta de
+    `ways` ranuras y, si no hay hueco, reemplaza la de escritura más antigua.
+    No hay lock entre procesos: cada ranura lleva un seqlock (contador impar
+    durante la escritura) y un crc32 de los datos, así que una lectura que se
+    cruza con una escritura se descarta como fallo en vez de devolver datos
+    mezclados. Con dos escritores sobre la misma ranura gana el último.
+
+    Mantiene la interfaz de ShardedLRUCache que usa CacheManager. La memoria
+    es fija y ajena al proceso, así que no participa del reparto de
+    presupuesto (`resizable = False`) ni de las instantáneas: sobrevive por
+    sí misma al reinicio de cualquier worker.
+    """
+
+    resizable = False
+
+    def __init__(self, name: str, slots: int = 65536, ways: int = 4,
+                 max_value_bytes: int = 64, ttl: Optional[float] = None):
+        self.name = name
+        self.ways = ways
+        self.slots = max(ways, slots - slots % ways)
+        self.max_value_bytes = max_value_bytes
+        self.ttl = ttl
+        self.max_size = self.slots
+        self._buckets = self.slots // ways
+
+        dtype = _slot_dtype(max_value_bytes)
+        size = _CABECERA + self.slots * dtype.itemsize
+        try:
+            self._shm = SharedMemory(name=name, create=True, size=size)
+            self.created = True
+        except FileExistsError:
+            self._shm = SharedMemory(name=name)
+            self.created = False
+        # El resource_tracker borraría el segmento al salir este proceso aunque otros lo usen
+        try:
+            resource_tracker.unregister(self._shm._name, 'shared_memory')
+        except Exception:
+            pass
+
+        cabecera = np.ndarray((8,), dtype=np.uint64, buffer=self._shm.buf)
+        esperado = (SHARED_CACHE_VERSION, self.slots, ways, max_value_bytes)
+        if self.created:
+            cabecera[1:5] = esperado
+            cabecera[0] = SHARED_CACHE_MAGIC  # al final: marca la tabla como lista
+        else:
+            limite = time.monotonic() + 1.0
+            while int(cabecera[0]) != SHARED_CACHE_MAGIC and time.monotonic() < limite:
+                time.sleep(0.001)
+            if int(cabecera[0]) != SHARED_CACHE_MAGIC or tuple(int(v) for v in cabecera[1:5]) != esperado:
+                del cabecera
+                self._shm.close()
+                raise ValueError(f"La memoria compartida '{name}' tiene otro formato")
+
+        self._tabla = np.ndarray((self.slots,), dtype=dtype, buffer=self._shm.buf, offset=_CABECERA)
+        self._seq = self._tabla['seq']
+        self._length = self._tabla['length']
+        self._tag = self._tabla['tag']
+        self._expira = self._tabla['expira']
+        self._crc = self._tabla['crc']
+        self._datos = self._tabla['datos']
+
+        # Estadísticas locales de este proceso
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.expired_on_access = 0
+        self.expiry_sweeps = 0
+        self.evictions = 0
+        self.torn_reads = 0
+        self.oversize = 0
+
+    def _ranuras(self, key) -> Tuple[range, int]:
+        h, tag = _hash_clave(key)
+        base = (h % self._buckets) * self.ways
+        return range(base, base + self.ways), tag
+
+    def _buscar(self, ranuras: range, tag: int) -> Optional[int]:
+        for i in ranuras:
+            if self._tag[i] == tag:
+                return i
+        return None
+
+    def _escribir(self, i: int, tag: int, payload: bytes, expira: float):
+        """Escribe una ranura bajo el seqlock (impar durante la escritura)."""
+        seq = int(self._seq[i])
+        escribiendo = seq + 1 if seq % 2 == 0 else seq + 2
+        self._seq[i] = escribiendo & _MASCARA_CRC
+        self._tag[i] = tag
+        self._length[i] = len(payload)
+        self._expira[i] = expira
+        self._datos[i, :len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+        self._crc[i] = zlib.crc32(payload, tag & _MASCARA_CRC)
+        self._seq[i] = (escribiendo + 1) & _MASCARA_CRC
+
+    def _vaciar(self, i: int):
+        seq = int(self._seq[i])
+        self._seq[i] = (seq + 1 if seq % 2 == 0 else seq + 2) & _MASCARA_CRC
+        self._tag[i] = 0
+        self._length[i] = 0
+        self._seq[i] = (int(self._seq[i]) + 1) & _MASCARA_CRC
+
+    def get(self, key) -> Optional[Any]:
+        """Obtiene un valor del caché."""
+        ranuras, tag = self._ranuras(key)
+        i = self._buscar(ranuras, tag)
+        if i is not None:
+            seq = int(self._seq[i])
+            n = int(self._length[i])
+            if seq % 2 == 0 and 0 < n <= self.max_value_bytes:
+                payload = self._datos[i, :n].tobytes()
+                crc = int(self._crc[i])
+                expira = float(self._expira[i])
+                if (int(self._seq[i]) == seq and self._tag[i] == tag
+                        and zlib.crc32(payload, tag & _MASCARA_CRC) == crc):
+                    if expira > time.time():
+                        self.hits += 1
+                        return _decodificar(payload)
+                    self.expired += 1
+                    self.expired_on_access += 1
+                else:
+                    self.torn_reads += 1
+            else:
+                self.torn_reads += 1
+        self.misses += 1
+        return None
+
+    def put(self, key, value: Any):
+        """Almacena un valor en el caché (se ignora si no cabe en una ranura)."""
+        payload = _codificar(value)
+        if len(payload) > self.max_value_bytes:
+            self.oversize += 1
+            return
+        ranuras, tag = self._ranuras(key)
+        i = self._buscar(ranuras, tag)
+        if i is None:
+            ahora = time.time()
+            libre = [j for j in ranuras if self._tag[j] == 0 or self._expira[j] <= ahora]
+            if libre:
+                i = libre[0]
+            else:
+                # La de escritura más antigua: con TTL único, la que vence antes
+                i = min(ranuras, key=lambda j: float(self._expira[j]))
+                self.evictions += 1
+        expira = time.time() + self.ttl if self.ttl is not None else float('inf')
+        self._escribir(i, tag, payload, expira)
+
+    def remove(self, key) -> bool:
+        """Quita una entrada concreta; devuelve si existía."""
+        ranuras, tag = self._ranuras(key)
+        i = self._buscar(ranuras, tag)
+        if i is None:
+            return False
+        self._vaciar(i)
+        return True
+
+    def _cleanup_expired(self) -> int:
+        """Vacía las ranuras vencidas de toda la tabla (vectorizado)."""
+        vencidas = np.flatnonzero((self._tag != 0) & (self._expira <= time.time()))
+        for i in vencidas:
+            self._vaciar(int(i))
+        if len(vencidas):
+            self.expired += len(vencidas)
+            self.expiry_sweeps += 1
+        return len(vencidas)
+
+    def clear(self):
+        """Vacía la tabla compartida (para todos los procesos)."""
+        for i in np.flatnonzero(self._tag != 0):
+            self._vaciar(int(i))
+        self.hits = 0
+        self.misses = 0
+
+    def resize(self, max_size: int):
+        """La tabla compartida tiene tamaño fijo."""
+
+    def sample(self, n: int) -> List[Tuple[Any, Any]]:
+        """Sin claves originales (sólo huellas) no hay muestra que dar."""
+        return []
+
+    def snapshot_entries(self) -> List[Tuple[Any, Any, Optional[float]]]:
+        """La tabla guarda huellas, no claves: no se incluye en las instantáneas."""
+        return []
+
+    def restore(self, entradas: List[Tuple[Any, Any, Optional[float]]]) -> int:
+        return 0
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero((self._tag != 0) & (self._expira > time.time())))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estadísticas de este proceso más la ocupación de la tabla compartida."""
+        total_requests = self.hits + self.misses
+        return {
+            'size': len(self),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total_requests if total_requests > 0 else 0,
+            'ttl': self.ttl,
+            'expired': self.expired,
+            'expired_on_access': self.expired_on_access,
+            'expiry_sweeps': self.expiry_sweeps,
+            'evictions': self.evictions,
+            'shared_memory': self.name,
+            'created_here': self.created,
+            'slot_bytes': self._tabla.dtype.itemsize,
+            'torn_reads': self.torn_reads,
+            'oversize': self.oversize
+        }
+
+    def close(self):
+        """Suelta la vista de este proceso (la tabla sigue viva para los demás)."""
+        self._tabla = self._seq = self._length = self._tag = None
+        self._expira = self._crc = self._datos = None
+        self._shm.close()
+
+    def unlink(self):
+        """Destruye el segmento compartido (llamar desde un solo proceso)."""
+        # unlink() lo da de baja en el resource_tracker: volver a registrarlo antes
+        try:
+            resource_tracker.register(self._shm._name, 'shared_memory')
+        except Exception:
+            pass
+        self._shm.unlink()
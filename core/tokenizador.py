@@ -0,0 +1,87 @@
+"""
+Tokenizador de Frases para Krystal AI
+Convierte una frase del usuario en los vectores de entrada del razonador en una sola pasada.
+"""
+
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .embedding_engine import embedding_engine, normalizar
+
+
+class FraseCodificada:
+    """Resultado de codificar una frase: frase normalizada, tokens y sus embeddings."""
+
+    __slots__ = ('frase_original', 'frase_normalizada', 'tokens', 'matriz')
+
+    def __init__(self, frase_original: str, frase_normalizada: str,
+                 tokens: List[str], matriz: np.ndarray):
+        self.frase_original = frase_original
+        self.frase_normalizada = frase_normalizada
+        self.tokens = tokens
+        self.matriz = matriz  # (len(tokens), dim) float32, una fila por token
+
+    @property
+    def vectores_entrada(self) -> List[List[float]]:
+        """Embeddings de los tokens en el formato que esperan los razonadores."""
+        return self.matriz.tolist()
+
+    def __repr__(self) -> str:
+        return f"FraseCodificada(frase='{self.frase_normalizada}', tokens={self.tokens})"
+
+
+class TokenizadorFrases:
+    """Normaliza, segmenta y codifica frases reconociendo expresiones de varias palabras."""
+
+    def __init__(self, vocabulario: Iterable[str] = (), dim: int = 64):
+        self.dim = dim
+
+        # Expresiones multi-palabra indexadas por su primera palabra
+        self.expresiones: Dict[str, Set[Tuple[str, ...]]] = {}
+        self.max_palabras = 1
+
+        self.lock = threading.Lock()
+        self.agregar_vocabulario(vocabulario)
+
+    def agregar_vocabulario(self, conceptos: Iterable[str]):
+        """Registra conceptos del vocabulario; sólo los de varias palabras afectan la segmentación."""
+        with self.lock:
+            for concepto in conceptos:
+                palabras = tuple(normalizar(concepto).split())
+                if len(palabras) < 2:
+                    continue
+                self.expresiones.setdefault(palabras[0], set()).add(palabras)
+                self.max_palabras = max(self.max_palabras, len(palabras))
+
+    def tokenizar(self, frase_normalizada: str) -> List[str]:
+        """Segmenta una frase ya normalizada, priorizando la expresión más larga."""
+        palabras = frase_normalizada.split()
+        tokens = []
+        i = 0
+        while i < len(palabras):
+            candidatas = self.expresiones.get(palabras[i])
+            longitud = 1
+            if candidatas:
+                for n in range(min(self.max_palabras, len(palabras) - i), 1, -1):
+                    if tuple(palabras[i:i + n]) in candidatas:
+                        longitud = n
+                        break
+            tokens.append(' '.join(palabras[i:i + longitud]))
+            i += longitud
+        return tokens
+
+    def codificar(self, frase: str, dim: Optional[int] = None) -> FraseCodificada:
+        """Normaliza, segmenta y calcula en lote los embeddings de los tokens de una frase."""
+        dim = dim or self.dim
+        frase_normalizada = normalizar(frase)
+        tokens = self.tokenizar(frase_normalizada)
+
+        if not tokens:
+            return FraseCodificada(frase, frase_normalizada, [], np.zeros((0, dim), dtype=np.float32))
+
+        matriz, indice = embedding_engine.calcular_lote(tokens, dim)
+        # Una fila por token, en orden (los tokens repetidos comparten cálculo)
+        matriz = matriz[[indice[token] for token in tokens]]
+        return FraseCodificada(frase, frase_normalizada, tokens, matriz)